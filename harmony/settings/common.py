@@ -91,12 +91,15 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'lab.middleware.ServerTimingMiddleware',
+    'lab.middleware.MetricsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     #'cached_auth.Middleware',
+    'lti.middleware.LTINonceMiddleware',
     'django_auth_lti.middleware.LTIAuthMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -153,3 +156,90 @@ DATABASES = {
 REQUIREJS_DEBUG, REQUIREJS_CONFIG = requirejs.configure(ROOT_DIR, STATIC_URL)
 
 LTI_OAUTH_CREDENTIALS = {"harmonykey":"harmonysecret"}
+
+# Maximum number of parsed exercise definitions kept in memory per process.
+EXERCISE_DEFINITION_CACHE_SIZE = 1024
+
+# Number of threads (per process, shared by all requests) used to load
+# exercise files for bulk API requests
+# (GET /lab/api/v1/exercises?include=definitions).
+EXERCISE_BULK_LOAD_WORKERS = 4
+
+# Maximum page size ("limit" parameter) of the exercises and groups API.
+API_PAGE_MAX_LIMIT = 1000
+
+# Storage backend for exercises: "file" (data/exercises/json) or "database"
+# (lab.models.Exercise, populated with "./manage.py importexercises").
+EXERCISE_REPOSITORY_TYPE = "file"
+
+# Whether the file repository checks the mtime and size of every exercise
+# file on each request, besides the mtimes of the directories, so that files
+# edited in place (outside of the app) change the version and the ETag of the
+# exercises. This costs a stat() per exercise file per request.
+EXERCISE_INDEX_FILE_STATS = False
+
+# Maximum number of exercise group navigation lists (the exercise list of the
+# exercise page) kept in memory per process.
+EXERCISE_LIST_CACHE_SIZE = 256
+
+# Seconds that the group list of a course is kept in the cache (CACHES), or
+# None to keep it until it changes. The list is cached per version of the
+# course's exercises, so it never goes stale; with the default per-process
+# cache, each process builds it once per version.
+GROUP_LIST_CACHE_TIMEOUT = None
+
+# Seconds that the HTML of the exercise pages is kept in the cache (CACHES),
+# None to keep it until it is evicted, or 0 to turn the page cache off. Pages
+# are cached per version of the course's exercises and of the require.js
+# build, so this only bounds how long unused pages are kept.
+PAGE_CACHE_TIMEOUT = 600
+
+# Maximum number of LilyPond chord previews (GET /lab/api/v1/lilypond) kept
+# in memory per process.
+LILYPOND_PREVIEW_CACHE_SIZE = 4096
+
+# Seconds that the course of an LTI tool consumer is kept in the cache
+# (CACHES). Changes to a consumer delete its entry, but with the default
+# per-process cache, other workers only see them once their entry expires
+# (see lti.models.LTIConsumer.getCourseId).
+LTI_CONSUMER_CACHE_TIMEOUT = 300
+
+# Replay protection for LTI launches (see lti.nonces): launches are rejected
+# if their OAuth timestamp is more than LTI_NONCE_TTL seconds from the server
+# time, or if their nonce was already used. The default store keeps at most
+# LTI_NONCE_STORE_SIZE nonces in memory per process; under a multi-worker
+# server, use 'lti.nonces.CacheNonceStore' with a shared cache (LTI_NONCE_CACHE
+# is an alias in CACHES) so that a launch can't be replayed to another worker.
+LTI_NONCE_STORE = 'lti.nonces.MemoryNonceStore'
+LTI_NONCE_TTL = 600
+LTI_NONCE_STORE_SIZE = 100000
+LTI_NONCE_CACHE = 'default'
+
+# Metrics in the Prometheus text format at /metrics (see lab.metrics). Off by
+# default; the endpoint isn't authenticated, so restrict access to it in the
+# web server. Under a multi-worker server, set METRICS_DIR to a directory
+# shared by the workers (emptied on restart) so that scrapes add up all of
+# them; each worker writes to it at most every METRICS_FLUSH_INTERVAL seconds.
+METRICS_ENABLED = False
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Request timings (lab.middleware.ServerTimingMiddleware) are logged as one
+# JSON line per request on the "lab.timing" logger.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'lab.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
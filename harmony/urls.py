@@ -9,6 +9,7 @@ urlpatterns = patterns('',
     url(r'^$', RedirectView.as_view(url='/lab'), name='index'),
     url(r'^lab/', include('lab.urls', namespace="lab")),
     url(r'^lti/', include('lti.urls', namespace="lti")),
+    url(r'^metrics$', 'lab.views.metrics_view', name='metrics'),
     url(r'^jasmine/', include('jasmine.urls', namespace="jasmine")),
 
     # Uncomment the admin/doc line below to enable admin documentation:
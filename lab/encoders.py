@@ -0,0 +1,204 @@
+from .timing import timed
+
+import collections
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class StreamingJSONEncoder(object):
+    '''
+    Encodes a document as JSON in chunks, so that a large response can be
+    written out while it is still being produced.
+
+    Any iterator in the document (such as a generator) is encoded as a JSON
+    array and consumed lazily, one item at a time. Dicts that contain
+    iterators are encoded key by key. Everything else is handed to the
+    standard json encoder in one piece. The output is the same as
+    json.dumps() would produce for the fully materialized document.
+
+    Usage:
+        encoder = StreamingJSONEncoder(sort_keys=True, indent=4)
+        groups = (g.asDict() for g in repo.groups)
+        return StreamingHttpResponse(encoder.iterencode({"groups": groups}))
+    '''
+    CHUNK_SIZE = 8192
+    content_type = 'application/json'
+
+    def __init__(self, indent=None, sort_keys=False, separators=None, chunk_size=CHUNK_SIZE):
+        if separators is None:
+            separators = (', ', ': ')
+        self.indent = indent
+        self.sort_keys = sort_keys
+        self.item_separator, self.key_separator = separators
+        self.chunk_size = chunk_size
+        self.encoder = json.JSONEncoder(indent=indent, sort_keys=sort_keys, separators=separators)
+
+    def encode(self, obj):
+        '''Returns the whole document as a string.'''
+        return ''.join(self.iterencode(obj))
+
+    def iterencode(self, obj):
+        '''Yields the document in chunks of roughly chunk_size characters.'''
+        buf = []
+        buf_size = 0
+        for chunk in self._iterencode(obj, 0):
+            buf.append(chunk)
+            buf_size += len(chunk)
+            if buf_size >= self.chunk_size:
+                yield ''.join(buf)
+                buf = []
+                buf_size = 0
+        if buf:
+            yield ''.join(buf)
+
+    def _iterencode(self, obj, level):
+        if self._is_lazy(obj):
+            if isinstance(obj, dict):
+                return self._iterencode_dict(obj, level)
+            return self._iterencode_iterator(obj, level)
+        return iter([self._encode_value(obj, level)])
+
+    def _iterencode_dict(self, obj, level):
+        items = obj.items()
+        if self.sort_keys:
+            items = sorted(items)
+        if len(items) == 0:
+            yield '{}'
+            return
+        yield '{'
+        for i, (key, value) in enumerate(items):
+            prefix = self.item_separator if i > 0 else ''
+            yield prefix + self._newline(level + 1) + json.dumps(key) + self.key_separator
+            for chunk in self._iterencode(value, level + 1):
+                yield chunk
+        yield self._newline(level) + '}'
+
+    def _iterencode_iterator(self, obj, level):
+        yield '['
+        empty = True
+        for item in obj:
+            prefix = self.item_separator if not empty else ''
+            empty = False
+            yield prefix + self._newline(level + 1)
+            for chunk in self._iterencode(item, level + 1):
+                yield chunk
+        if not empty:
+            yield self._newline(level)
+        yield ']'
+
+    @timed('json')
+    def _encode_value(self, obj, level):
+        encoded = self.encoder.encode(obj)
+        if self.indent is not None and level > 0:
+            # JSON strings can't contain raw newlines, so every newline in
+            # the output is indentation that needs to be shifted
+            encoded = encoded.replace('\n', self._newline(level))
+        return encoded
+
+    def _newline(self, level):
+        if self.indent is None:
+            return ''
+        return '\n' + (' ' * (self.indent * level))
+
+    def _is_lazy(self, obj):
+        if isinstance(obj, dict):
+            for value in obj.itervalues():
+                if self._is_lazy(value):
+                    return True
+            return False
+        return isinstance(obj, collections.Iterator)
+
+
+class MessagePackEncoder(object):
+    '''
+    Encodes a document as MessagePack (http://msgpack.org/), a binary format
+    with the same data model as JSON that is smaller and faster to parse.
+
+    The msgpack package is used when it is installed, otherwise the document
+    is packed in pure Python. Strings are always packed with the "raw"/str
+    types, never as binary. MessagePack arrays are prefixed with their
+    length, so iterators in the document are materialized while packing.
+    '''
+    content_type = 'application/x-msgpack'
+
+    @timed('msgpack')
+    def encode(self, obj):
+        '''Returns the packed document as a byte string.'''
+        if msgpack is not None:
+            return msgpack.packb(self._materialize(obj), use_bin_type=False)
+        buf = []
+        self._pack(obj, buf)
+        return b''.join(buf)
+
+    def iterencode(self, obj):
+        yield self.encode(obj)
+
+    def _materialize(self, obj):
+        if isinstance(obj, dict):
+            return dict([(k, self._materialize(v)) for k, v in obj.iteritems()])
+        if isinstance(obj, collections.Iterator):
+            return [self._materialize(item) for item in obj]
+        return obj
+
+    def _pack(self, obj, buf):
+        if obj is None:
+            buf.append(b'\xc0')
+        elif obj is True:
+            buf.append(b'\xc3')
+        elif obj is False:
+            buf.append(b'\xc2')
+        elif isinstance(obj, (int, long)):
+            buf.append(self._pack_int(obj))
+        elif isinstance(obj, float):
+            buf.append(struct.pack('>Bd', 0xcb, obj))
+        elif isinstance(obj, basestring):
+            if isinstance(obj, unicode):
+                obj = obj.encode('utf-8')
+            buf.append(self._pack_header(len(obj), 0xa0, 32, 0xda, 0xdb))
+            buf.append(obj)
+        elif isinstance(obj, dict):
+            buf.append(self._pack_header(len(obj), 0x80, 16, 0xde, 0xdf))
+            for key, value in obj.iteritems():
+                self._pack(key, buf)
+                self._pack(value, buf)
+        elif isinstance(obj, (list, tuple)):
+            buf.append(self._pack_header(len(obj), 0x90, 16, 0xdc, 0xdd))
+            for item in obj:
+                self._pack(item, buf)
+        elif isinstance(obj, collections.Iterator):
+            self._pack(list(obj), buf)
+        else:
+            raise TypeError("%r is not MessagePack serializable" % (obj,))
+
+    def _pack_header(self, length, fix_type, fix_limit, type16, type32):
+        if length < fix_limit:
+            return struct.pack('>B', fix_type | length)
+        if length < 0x10000:
+            return struct.pack('>BH', type16, length)
+        return struct.pack('>BI', type32, length)
+
+    def _pack_int(self, n):
+        if 0 <= n < 0x80:
+            return struct.pack('>B', n)
+        if -0x20 <= n < 0:
+            return struct.pack('>b', n)
+        if n > 0:
+            if n < 0x100:
+                return struct.pack('>BB', 0xcc, n)
+            if n < 0x10000:
+                return struct.pack('>BH', 0xcd, n)
+            if n < 0x100000000:
+                return struct.pack('>BI', 0xce, n)
+            return struct.pack('>BQ', 0xcf, n)
+        if n >= -0x80:
+            return struct.pack('>Bb', 0xd0, n)
+        if n >= -0x8000:
+            return struct.pack('>Bh', 0xd1, n)
+        if n >= -0x80000000:
+            return struct.pack('>Bi', 0xd2, n)
+        return struct.pack('>Bq', 0xd3, n)
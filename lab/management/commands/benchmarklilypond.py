@@ -0,0 +1,145 @@
+# DESCRIPTION
+#
+# This script times the LilyPond chord parser (ExerciseLilyPond) against the
+# chords of every exercise source in data/exercises/ly, which is the work
+# done by "./manage.py importlilypond" and by every exercise saved from the
+# editor. The previous parser (a regex split, sub and two findalls per pitch
+# entry, kept below as ReferenceLilyPond) is timed over the same corpus as a
+# baseline, and both must give the same output. Each pass parses the whole
+# corpus; the best of several passes is reported.
+#
+# USAGE:
+#
+#   ./manage.py benchmarklilypond
+#   ./manage.py benchmarklilypond --passes=50
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from lab.objects import ExerciseLilyPond, ExerciseLilyPondFile, ExerciseLilyPondError
+
+import glob
+import os
+import re
+import timeit
+
+class ReferenceLilyPond(ExerciseLilyPond):
+    '''
+    The parser as it was before the note tables and patterns were compiled
+    once as class attributes, as a baseline for the benchmark.
+    '''
+    def parseChords(self, lpstring):
+        return re.findall('<([^>]+)>', lpstring.strip())
+
+    def parseChord(self, chordstring, start_octave=4):
+        # constants for parsing
+        note_tuples = [('c',0),('d',2),('e',4),('f',5),('g',7),('a',9),('b',11)]
+        notes = [n[0] for n in note_tuples]
+        note_pitch = dict(note_tuples)
+        up, down = ("'", ",")
+        sharp, flat = ("s", "f")
+        hidden_note_symbol = r"x"
+
+        # normalize the chord string 
+        chordstring = re.sub(r'\\xNote\s*', hidden_note_symbol, chordstring) # replace '\xNote' with just 'x'
+        chordstring = chordstring.lower().strip() # normalize to lower case
+
+        # mutable variables used during parsing
+        midi_chord = {"visible": [], "hidden": []}
+        
+        # parse each pitch entry in the chord and translate to MIDI
+        pitch_entries = re.split('\s+', chordstring)
+        for idx, pitch_entry in enumerate(pitch_entries):
+            octave = start_octave
+            tokens = list(pitch_entry) # convert entry to sequence of characters
+
+            # check if this is a "hidden" note
+            midi_entry = midi_chord['visible']
+            if tokens[0] == hidden_note_symbol:
+                midi_entry = midi_chord['hidden']
+                tokens = tokens[1:]
+
+            # check if the first character is a valid note name,
+            # otherwise record an error and skip the rest of the parsing
+            if len(tokens) == 0 or not (tokens[0] in notes):
+                self.is_valid = False
+                self.errors.append("Pitch [%s] in chord [%s] is invalid: missing or invalid note name" % (pitch_entry, chordstring))
+                raise ExerciseLilyPondError("Error parsing LilyPond chord: %s" % chordstring)
+            
+            note_name = tokens[0]
+            tokens = tokens[1:]
+            
+            # check that all subsequent characters are either octave changing marks, or accidentals
+            check_rest = re.sub('|'.join([up,down,sharp,flat,'\d']), '', ''.join(tokens))
+            if len(check_rest) > 0:
+                self.is_valid = False
+                self.errors.append("Pitch entry [%s] in chord [%s] contains unrecognized symbols: %s" % (pitch_entry, chordstring, check_rest))
+                raise ExerciseLilyPondError("Error parsing LilyPond chord: %s" % chordstring)
+
+            # look for octave changing marks
+            octave_change = 0
+            octaves = re.findall('('+up+'|'+down+'|\d)', ''.join(tokens))
+            if octaves is not None:
+                for o in octaves:
+                    if o == up:
+                        octave_change += 1
+                    elif o == down:
+                        octave_change -= 1
+                    else:
+                        octave = int(o)
+            
+            # look for change in the pitch by accidentals
+            pitch_change = 0  
+            accidentals = re.findall('('+sharp+'|'+flat+')', ''.join(tokens))
+            if accidentals is not None:
+                for acc in accidentals:
+                    if acc == sharp:
+                        pitch_change += 1
+                    elif acc == flat:
+                        pitch_change -= 1
+
+            # calculate the midi note number and add to the midi entry
+            octave += octave_change
+            midi_pitch = (octave * 12) + note_pitch[note_name] + pitch_change
+            midi_entry.append(midi_pitch)
+
+        return midi_chord
+
+class Command(BaseCommand):
+    help = 'Times the LilyPond chord parser, and the previous one, against the exercise sources in data/exercises/ly.'
+    option_list = BaseCommand.option_list + (
+        make_option('--passes', dest='passes', type='int', default=20,
+            help='Number of passes over the corpus in each timing run.'),
+    )
+
+    def handle(self, *args, **options):
+        sources = self._read_corpus()
+        if len(sources) == 0:
+            raise CommandError("No LilyPond sources found")
+
+        for source in sources:
+            expected, actual = ReferenceLilyPond(source), ExerciseLilyPond(source)
+            if (expected.toMIDI(), expected.isValid(), expected.errors) != (actual.toMIDI(), actual.isValid(), actual.errors):
+                raise CommandError("Parsers disagree on: %s" % source)
+
+        num_passes = options['passes']
+        num_chords = sum([len(ExerciseLilyPond(s).toMIDI()) for s in sources])
+        self.stdout.write("%d sources, %d chords, same output from both parsers" % (len(sources), num_chords))
+        self.stdout.write("%-10s %12s %12s %12s" % ("parser", "ms/pass", "us/source", "us/chord"))
+        timings = []
+        for name, parser in (("reference", ReferenceLilyPond), ("current", ExerciseLilyPond)):
+            best = min(timeit.repeat(lambda: [parser(s) for s in sources], number=num_passes, repeat=5))
+            per_pass = best / num_passes
+            timings.append(per_pass)
+            self.stdout.write("%-10s %12.3f %12.3f %12.3f" % (name, per_pass * 1e3, per_pass * 1e6 / len(sources), per_pass * 1e6 / num_chords))
+        self.stdout.write("speedup: %.2fx" % (timings[0] / timings[1]))
+
+    def _read_corpus(self):
+        '''Returns the chords of each LilyPond source (as LilyPond strings).'''
+        sources = []
+        for path in sorted(glob.glob(os.path.join(settings.ROOT_DIR, 'data', 'exercises', 'ly', '*', '*.ly'))):
+            with open(path) as f:
+                m = ExerciseLilyPondFile.CHORDS_RE.search(f.read())
+            if m is not None:
+                sources.append(m.group('chords'))
+        return sources
@@ -0,0 +1,72 @@
+# DESCRIPTION
+#
+# This script times the in-memory lookups that every exercise page depends
+# on (findGroup, findExercise, findExerciseByGroup and next/previous
+# navigation) against groups of increasing size. The lookups are backed by
+# dict indexes and stored positions, so the time per lookup should stay flat
+# as the groups grow.
+#
+# No files are read or written: the groups and exercises are synthetic.
+#
+# USAGE:
+#
+#   ./manage.py benchmarklookups
+#   ./manage.py benchmarklookups --sizes=10,1000,5000 --lookups=20000
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from lab.objects import ExerciseRepository, ExerciseGroup, ExerciseFile
+
+import random
+import timeit
+
+class Command(BaseCommand):
+    help = 'Times exercise lookups and navigation against groups of increasing size.'
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='10,100,1000,5000',
+            help='Comma-separated list of exercises per group.'),
+        make_option('--groups', dest='groups', type='int', default=20,
+            help='Number of groups in the repository.'),
+        make_option('--lookups', dest='lookups', type='int', default=10000,
+            help='Number of lookups to time for each operation.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(n) for n in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("Invalid sizes: %s" % options['sizes'])
+
+        num_groups = options['groups']
+        num_lookups = options['lookups']
+
+        self.stdout.write("%10s %14s %14s %14s %14s" % ("size", "findGroup", "findExercise", "byGroup", "next/prev"))
+        for size in sizes:
+            repo = self._build_repository(num_groups, size)
+            results = self._time_lookups(repo, num_groups, size, num_lookups)
+            self.stdout.write("%10d %12.3fus %12.3fus %12.3fus %12.3fus" % ((size,) + results))
+
+    def _build_repository(self, num_groups, size):
+        repo = ExerciseRepository()
+        for g in range(num_groups):
+            group = ExerciseGroup("group%d" % g)
+            group.add([ExerciseFile("%s.json" % str(n).zfill(2), group, "") for n in range(1, size + 1)])
+            repo.addGroup(group)
+        return repo
+
+    def _time_lookups(self, repo, num_groups, size, num_lookups):
+        group_names = ["group%d" % random.randrange(num_groups) for i in range(num_lookups)]
+        exercise_names = [str(random.randint(1, size)).zfill(2) for i in range(num_lookups)]
+        exercises = [repo.findExerciseByGroup(g, e) for g, e in zip(group_names, exercise_names)]
+        lookups = zip(group_names, exercise_names)
+
+        timings = (
+            self._time(lambda: [repo.findGroup(g) for g in group_names]),
+            self._time(lambda: [repo.findExercise(e) for e in exercise_names]),
+            self._time(lambda: [repo.findExerciseByGroup(g, e) for g, e in lookups]),
+            self._time(lambda: [(e.next(), e.previous()) for e in exercises]),
+        )
+        return tuple([t * 1e6 / num_lookups for t in timings])
+
+    def _time(self, fn):
+        return min(timeit.repeat(fn, number=1, repeat=3))
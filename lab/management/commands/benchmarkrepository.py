@@ -0,0 +1,287 @@
+# DESCRIPTION
+#
+# This script times the hot paths of the exercise repository and pages
+# against synthetic course trees of increasing size, and prints the results
+# as JSON so that runs can be compared and plotted.
+#
+# Each corpus is a temporary tree of courses x groups x exercises that is
+# generated for the run (data/exercises is not touched). For each corpus the
+# following operations are sampled one call at a time:
+#
+#   findFiles           ExerciseFileRepository(course_id) with a warm index
+#   findFiles.cold      ... after invalidating the index (directory walk)
+#   getGroupList        list of groups with URLs and sizes (cache cleared)
+#   getGroupList.cached ... from the group list cache
+#   findExerciseByGroup lookup of a random exercise
+#   ExerciseFile.load   load of a random exercise (definition cache cleared)
+#   ExerciseFile.load.cached
+#   ExerciseGroup.getList
+#                       navigation list of a group (list cache cleared)
+#   ExerciseGroup.getList.cached
+#   PlayView            GET /lab/courses/<id> through the test client, with
+#                       the page, group list and list caches off or cleared
+#   PlayView.cached     ... of a page that is in the page cache
+#   ExerciseView        GET /lab/courses/<id>/exercises/<group>/<exercise>
+#   ExerciseView.cached
+#
+# Times are in milliseconds; each operation reports count, min, mean, p50,
+# p90, p99 and max.
+#
+# USAGE:
+#
+#   ./manage.py benchmarkrepository
+#   ./manage.py benchmarkrepository --corpora=1x10x10,5x20x50 --samples=500
+#   ./manage.py benchmarkrepository --no-views --output=results.json
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+from optparse import make_option
+
+from lab.objects import ExerciseFileRepository, ExerciseFileIndex, ExerciseDefinitionCache, ExerciseListCache, ExerciseDefinition
+
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import timeit
+
+EXERCISE_DATA = {
+    "type": "matching",
+    "introText": "Match this progression.",
+    "reviewText": "",
+    "key": "jC_",
+    "keySignature": "",
+    "chord": [
+        {"visible": [47, 67, 74, 77], "hidden": []},
+        {"visible": [48, 67, 72, 76], "hidden": []},
+        {"visible": [53, 69], "hidden": [60, 65]},
+    ],
+    "analysis": {"enabled": True, "mode": {"note_names": False, "roman_numerals": True}},
+    "highlight": {"enabled": False, "mode": {"roothighlight": True, "tritonehighlight": False}},
+}
+
+def percentiles(samples):
+    '''Returns summary statistics (in milliseconds) of a list of times in seconds.'''
+    samples = sorted([s * 1e3 for s in samples])
+    def rank(p):
+        return samples[min(len(samples) - 1, int(round(p / 100.0 * len(samples) + 0.5)) - 1)]
+    return {
+        "count": len(samples),
+        "min": samples[0],
+        "mean": sum(samples) / len(samples),
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": samples[-1],
+    }
+
+class Command(BaseCommand):
+    help = 'Times repository lookups and page renders against synthetic course trees, with JSON output.'
+    option_list = BaseCommand.option_list + (
+        make_option('--corpora', dest='corpora', default='1x10x10,1x20x100,5x20x100',
+            help='Comma-separated list of corpus sizes, each COURSESxGROUPSxEXERCISES.'),
+        make_option('--samples', dest='samples', type='int', default=200,
+            help='Number of timed calls of each operation.'),
+        make_option('--no-views', dest='views', action='store_false', default=True,
+            help='Don\'t time the PlayView and ExerciseView pages.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+            help='Seed for the random choice of courses, groups and exercises.'),
+        make_option('--output', dest='output', default=None,
+            help='Write the JSON results to this file instead of stdout.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            corpora = [tuple([int(n) for n in c.split('x')]) for c in options['corpora'].split(',')]
+        except ValueError:
+            raise CommandError("Invalid corpora: %s" % options['corpora'])
+        if not all([len(c) == 3 and min(c) > 0 for c in corpora]):
+            raise CommandError("Invalid corpora: %s" % options['corpora'])
+
+        self.random = random.Random(options['seed'])
+        self.num_samples = options['samples']
+        self.views = options['views']
+
+        results = {
+            "started": datetime.datetime.utcnow().isoformat(),
+            "samples": self.num_samples,
+            "corpora": [self._benchmark_corpus(*c) for c in corpora],
+        }
+
+        output = json.dumps(results, sort_keys=True, indent=4)
+        if options['output'] is None:
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+
+    def _benchmark_corpus(self, num_courses, num_groups, num_exercises):
+        base_path = tempfile.mkdtemp()
+        original_base_path = ExerciseFileRepository.BASE_PATH
+        ExerciseFileRepository.BASE_PATH = base_path
+        try:
+            with override_settings(EXERCISE_REPOSITORY_TYPE="file"):
+                self._generate_corpus(base_path, num_courses, num_groups, num_exercises)
+                timings = self._time_operations(num_courses)
+        finally:
+            ExerciseFileRepository.BASE_PATH = original_base_path
+            ExerciseFileIndex.invalidate()
+            ExerciseDefinitionCache.getInstance().clear()
+            shutil.rmtree(base_path)
+
+        return {
+            "courses": num_courses,
+            "groups": num_groups,
+            "exercises": num_exercises,
+            "total_exercises": num_courses * num_groups * num_exercises,
+            "timings": timings,
+        }
+
+    def _generate_corpus(self, base_path, num_courses, num_groups, num_exercises):
+        content = ExerciseDefinition(dict(EXERCISE_DATA)).asJSON()
+        for c in range(1, num_courses + 1):
+            for g in range(num_groups):
+                group_path = os.path.join(base_path, "courses", str(c), "group%03d" % g)
+                os.makedirs(group_path)
+                for e in range(1, num_exercises + 1):
+                    with open(os.path.join(group_path, "%s.json" % str(e).zfill(2)), 'w') as f:
+                        f.write(content)
+
+        # directories and files modified within the last second are always
+        # scanned again (see ExerciseFileIndex.isRacy), so backdate them
+        mtime = time.time() - 60
+        for root, dirs, files in os.walk(base_path):
+            for path in [root] + [os.path.join(root, f) for f in files]:
+                os.utime(path, (mtime, mtime))
+
+    def _time_operations(self, num_courses):
+        course_ids = [str(c) for c in range(1, num_courses + 1)]
+        repos = dict([(c, ExerciseFileRepository(course_id=c)) for c in course_ids])
+        definition_cache = ExerciseDefinitionCache.getInstance()
+
+        def random_repo():
+            return repos[self.random.choice(course_ids)]
+
+        def random_exercise():
+            return self.random.choice(random_repo().exercises)
+
+        def find_files():
+            course_id = self.random.choice(course_ids)
+            return lambda: ExerciseFileRepository(course_id=course_id)
+
+        def find_files_cold():
+            course_id = self.random.choice(course_ids)
+            ExerciseFileIndex.invalidate(ExerciseFileRepository.getBasePath(course_id))
+            return lambda: ExerciseFileRepository(course_id=course_id)
+
+        def load_cold():
+            exercise = random_exercise()
+            definition_cache.clear()
+            return exercise.load
+
+        def load_cached():
+            exercise = random_exercise()
+            exercise.load()
+            return exercise.load
+
+        def clear_caches():
+            cache.clear()
+            ExerciseListCache.getInstance().clear()
+
+        def group_list_cold():
+            repo = random_repo()
+            repo.invalidateGroupList()
+            return repo.getGroupList
+
+        def group_list_cached():
+            repo = random_repo()
+            repo.getGroupList()
+            return repo.getGroupList
+
+        def exercise_list_cold():
+            group = self.random.choice(random_repo().groups)
+            group.exercise_list = None
+            ExerciseListCache.getInstance().clear()
+            return group.getList
+
+        def exercise_list_cached():
+            group = self.random.choice(random_repo().groups)
+            group.getList()
+            group.exercise_list = None
+            return group.getList
+
+        def lookup():
+            exercise = random_exercise()
+            repo = repos[exercise.group.course_id]
+            return lambda: repo.findExerciseByGroup(exercise.group.name, exercise.name)
+
+        operations = [
+            ("findFiles", find_files, {}),
+            ("findFiles.cold", find_files_cold, {}),
+            ("getGroupList", group_list_cold, {}),
+            ("getGroupList.cached", group_list_cached, {}),
+            ("findExerciseByGroup", lookup, {}),
+            ("ExerciseFile.load", load_cold, {}),
+            ("ExerciseFile.load.cached", load_cached, {}),
+            ("ExerciseGroup.getList", exercise_list_cold, {}),
+            ("ExerciseGroup.getList.cached", exercise_list_cached, {}),
+        ]
+        if self.views:
+            client = Client()
+
+            def play_url():
+                return reverse('lab:course-index', kwargs={"course_id": self.random.choice(course_ids)})
+
+            def exercise_url():
+                return random_exercise().url()
+
+            def view(get_url):
+                def setup():
+                    url = get_url()
+                    clear_caches()
+                    return lambda: client.get(url)
+                return setup
+
+            def cached_view(get_url):
+                def setup():
+                    url = get_url()
+                    client.get(url)
+                    return lambda: client.get(url)
+                return setup
+
+            uncached = {"PAGE_CACHE_TIMEOUT": 0}
+            operations.extend([
+                ("PlayView", view(play_url), uncached),
+                ("PlayView.cached", cached_view(play_url), {}),
+                ("ExerciseView", view(exercise_url), uncached),
+                ("ExerciseView.cached", cached_view(exercise_url), {}),
+            ])
+            setup_test_environment()
+
+        try:
+            timings = {}
+            for name, setup, settings in operations:
+                with override_settings(**settings):
+                    timings[name] = self._sample(setup)
+            return timings
+        finally:
+            if self.views:
+                teardown_test_environment()
+
+    def _sample(self, setup):
+        '''
+        Times num_samples calls. Before each call, setup() is called
+        (untimed) to pick the arguments and returns the function to time.
+        '''
+        samples = []
+        for i in range(self.num_samples):
+            fn = setup()
+            started = timeit.default_timer()
+            fn()
+            samples.append(timeit.default_timer() - started)
+        return percentiles(samples)
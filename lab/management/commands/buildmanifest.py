@@ -0,0 +1,54 @@
+# DESCRIPTION
+#
+# This script compiles the exercise directory tree of each course into a
+# single manifest file, so that a freshly started process can load the list
+# of groups and exercises with one file read instead of traversing the whole
+# tree (which is slow on network filesystems).
+#
+# The manifests are written to:
+#
+#   data/exercises/json/.manifests/
+#
+# Once a manifest exists, the application rebuilds it when it finds it stale,
+# once the changed directories and files are more than a second old (see
+# ExerciseFileIndex.scan). A stale manifest is never used, and re-running
+# this command is always safe.
+#
+# USAGE:
+#
+#   ./manage.py buildmanifest
+#   ./manage.py buildmanifest --course=123
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from lab.objects import ExerciseFileRepository, ExerciseFileManifest
+
+import os
+
+class Command(BaseCommand):
+    help = 'Compiles the exercise directory tree of each course into a manifest file.'
+    option_list = BaseCommand.option_list + (
+        make_option('--course', dest='course_id', default=None,
+            help='Only build the manifest for this course ID.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['course_id'] is not None:
+            course_ids = [options['course_id']]
+        else:
+            course_ids = [None] + self._get_course_ids()
+
+        for course_id in course_ids:
+            manifest = ExerciseFileManifest(course_id)
+            if not os.path.isdir(manifest.path):
+                raise CommandError("Course directory not found: {0}".format(manifest.path))
+            data = manifest.update()
+            num_exercises = sum([len(g['exercises']) for g in data['groups']])
+            self.stdout.write("Wrote manifest for course {0}: {1} groups, {2} exercises => {3}".format(
+                course_id, len(data['groups']), num_exercises, manifest.manifest_path))
+
+    def _get_course_ids(self):
+        courses_path = os.path.join(ExerciseFileRepository.BASE_PATH, "courses")
+        if not os.path.isdir(courses_path):
+            return []
+        return sorted([d for d in os.listdir(courses_path) if os.path.isdir(os.path.join(courses_path, d))])
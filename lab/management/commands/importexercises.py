@@ -0,0 +1,97 @@
+# DESCRIPTION
+#
+# This script copies the exercise files of each course from:
+#
+#   data/exercises/json/
+#
+# into the database, for use with the "database" exercise repository (set
+# EXERCISE_REPOSITORY_TYPE = "database" in the settings). Run "./manage.py
+# syncdb" first to create the table.
+#
+# Exercises that are already in the database are overwritten with the
+# contents of their files, so re-running this command is always safe. Each
+# course is imported in a single transaction. Files that can't be read or
+# parsed are reported and skipped.
+#
+# USAGE:
+#
+#   ./manage.py importexercises
+#   ./manage.py importexercises --course=123
+#   ./manage.py importexercises --replace
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from optparse import make_option
+
+from lab.models import Exercise
+from lab.objects import ExerciseFileRepository, ExerciseDatabaseRepository, ExerciseFileError
+
+import os
+
+class Command(BaseCommand):
+    help = 'Imports the exercise files of each course into the database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--course', dest='course_id', default=None,
+            help='Only import the exercises of this course ID.'),
+        make_option('--replace', dest='replace', action='store_true', default=False,
+            help='Delete exercises that are in the database but not in the files.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['course_id'] is not None:
+            course_ids = [options['course_id']]
+        else:
+            course_ids = [None] + self._get_course_ids()
+
+        for course_id in course_ids:
+            path = ExerciseFileRepository.getBasePath(course_id)
+            if not os.path.isdir(path):
+                raise CommandError("Course directory not found: {0}".format(path))
+            created, updated, deleted, failed = self._import_course(course_id, options['replace'])
+            self.stdout.write("Imported course {0}: {1} created, {2} updated, {3} deleted, {4} failed".format(
+                course_id, created, updated, deleted, failed))
+
+    def _import_course(self, course_id, replace):
+        repo = ExerciseFileRepository(course_id=course_id)
+        course_key = ExerciseDatabaseRepository.getCourseKey(course_id)
+        queryset = ExerciseDatabaseRepository.getQuerySet(course_id)
+
+        with transaction.atomic():
+            existing = dict([((g, e), pk) for pk, g, e in queryset.values_list('id', 'group_name', 'exercise_name')])
+            new_records = []
+            num_updated = 0
+            num_failed = 0
+            for exercise in repo.exercises:
+                key = (exercise.group.name, exercise.name)
+                try:
+                    exercise.load()
+                except (ExerciseFileError, ValueError) as e:
+                    self.stderr.write("Skipped {0}: {1}".format(exercise.getPathToFile(), e))
+                    existing.pop(key, None)
+                    num_failed += 1
+                    continue
+                definition = exercise.exerciseDefinition.asJSON()
+                pk = existing.pop(key, None)
+                if pk is None:
+                    new_records.append(Exercise(
+                        course_id=course_key,
+                        group_name=exercise.group.name,
+                        exercise_name=exercise.name,
+                        definition=definition))
+                else:
+                    Exercise.objects.filter(pk=pk).update(definition=definition, updated=timezone.now())
+                    num_updated += 1
+            Exercise.objects.bulk_create(new_records)
+
+            num_deleted = 0
+            if replace and existing:
+                num_deleted = len(existing)
+                Exercise.objects.filter(pk__in=existing.values()).delete()
+
+        return (len(new_records), num_updated, num_deleted, num_failed)
+
+    def _get_course_ids(self):
+        courses_path = os.path.join(ExerciseFileRepository.BASE_PATH, "courses")
+        if not os.path.isdir(courses_path):
+            return []
+        return sorted([d for d in os.listdir(courses_path) if os.path.isdir(os.path.join(courses_path, d))])
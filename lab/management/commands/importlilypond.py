@@ -0,0 +1,151 @@
+# DESCRIPTION
+#
+# This script converts the LilyPond exercise sources in:
+#
+#   data/exercises/ly/<group>/<exercise>.ly
+#
+# to exercise JSON files for a course (by default the catch-all exercises in
+# data/exercises/json/all). It replaces ly2json.sh: the sources are parsed by
+# ExerciseLilyPondFile, which uses the same LilyPond parser as the exercise
+# editor, and are converted in parallel by a pool of processes.
+#
+# The conversion is incremental: the hash of each source is recorded in
+#
+#   data/exercises/json/.manifests/lilypond-<course>.json
+#
+# and only sources that have changed since the last run (or whose JSON file is
+# missing) are converted again. JSON files are written atomically. A source
+# that can't be converted is reported and left for the next run; the other
+# files are still written.
+#
+# USAGE:
+#
+#   ./manage.py importlilypond
+#   ./manage.py importlilypond --course=123 --workers=8
+#   ./manage.py importlilypond --force
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from lab.objects import ExerciseFileRepository, ExerciseFileIndex
+from lab.objects import ExerciseLilyPondFile, ExerciseLilyPondError, ExerciseDefinition, ExerciseFile, ExerciseFileError, ExerciseGroup
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+
+SOURCE_PATH = os.path.join(settings.ROOT_DIR, 'data', 'exercises', 'ly')
+
+# Bump to convert every source again when the conversion changes.
+CONVERTER_VERSION = 1
+
+def convert(job):
+    '''
+    Converts one LilyPond source to an exercise JSON file. Runs in a worker
+    process, so it only takes and returns plain data.
+    '''
+    source_path, group_name, exercise_name, group_path = job
+    try:
+        data = ExerciseLilyPondFile(source_path).read()
+        ef = ExerciseFile("%s.json" % exercise_name, ExerciseGroup(group_name), group_path)
+        ef.save(ExerciseDefinition(data))
+    except (ExerciseLilyPondError, ExerciseFileError, IOError, OSError) as e:
+        return (source_path, str(e))
+    return (source_path, None)
+
+class Command(BaseCommand):
+    help = 'Converts the LilyPond exercise sources in data/exercises/ly to exercise JSON files.'
+    option_list = BaseCommand.option_list + (
+        make_option('--course', dest='course_id', default=None,
+            help='Course ID to import the exercises into (default: the exercises shared by all courses).'),
+        make_option('--workers', dest='workers', type='int', default=multiprocessing.cpu_count(),
+            help='Number of worker processes.'),
+        make_option('--force', dest='force', action='store_true', default=False,
+            help='Convert all sources, even if they haven\'t changed.'),
+    )
+
+    def handle(self, *args, **options):
+        course_id = options['course_id']
+        output_path = ExerciseFileRepository.getBasePath(course_id)
+        state_path = self._get_state_path(course_id)
+        state = {} if options['force'] else self._read_state(state_path)
+
+        jobs, hashes = [], {}
+        for group_name, exercise_name, source_path in self._find_sources():
+            relative_path = os.path.relpath(source_path, SOURCE_PATH)
+            group_path = os.path.join(output_path, group_name)
+            hashes[relative_path] = self._hash(source_path)
+            json_path = os.path.join(group_path, "%s.json" % exercise_name)
+            if state.get(relative_path) == hashes[relative_path] and os.path.exists(json_path):
+                continue
+            jobs.append((source_path, group_name, exercise_name, group_path))
+
+        num_sources = len(hashes)
+        errors = self._convert(jobs, options['workers'])
+        for source_path, error in errors:
+            self.stderr.write("Error converting {0}: {1}".format(source_path, error))
+            hashes.pop(os.path.relpath(source_path, SOURCE_PATH))
+
+        self._write_state(state_path, hashes)
+        if len(jobs) > 0:
+            # the course manifest (if any) is rebuilt once the new files have
+            # settled (see ExerciseFileIndex.scan)
+            ExerciseFileIndex.invalidate(output_path)
+
+        self.stdout.write("Converted {0} of {1} sources ({2} unchanged, {3} failed) => {4}".format(
+            len(jobs) - len(errors), num_sources, num_sources - len(jobs), len(errors), output_path))
+        if len(errors) > 0:
+            raise CommandError("{0} sources could not be converted".format(len(errors)))
+
+    def _convert(self, jobs, workers):
+        '''Converts the sources and returns a list of (source_path, error) tuples.'''
+        if len(jobs) == 0:
+            return []
+        if workers <= 1 or len(jobs) == 1:
+            results = map(convert, jobs)
+        else:
+            pool = multiprocessing.Pool(processes=min(workers, len(jobs)))
+            try:
+                results = pool.map(convert, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+            finally:
+                pool.close()
+                pool.join()
+        return [(source_path, error) for source_path, error in results if error is not None]
+
+    def _find_sources(self):
+        '''Yields (group_name, exercise_name, source_path) for each source.'''
+        if not os.path.isdir(SOURCE_PATH):
+            raise CommandError("Source directory not found: {0}".format(SOURCE_PATH))
+        for group_name in sorted(os.listdir(SOURCE_PATH)):
+            group_path = os.path.join(SOURCE_PATH, group_name)
+            if not os.path.isdir(group_path):
+                continue
+            for file_name in sorted(os.listdir(group_path)):
+                if file_name.endswith('.ly'):
+                    yield (group_name, file_name[:-len('.ly')], os.path.join(group_path, file_name))
+
+    def _hash(self, source_path):
+        with open(source_path) as f:
+            return hashlib.sha1("%d:%s" % (CONVERTER_VERSION, f.read())).hexdigest()
+
+    def _get_state_path(self, course_id):
+        name = "lilypond-all.json" if course_id is None else "lilypond-course-%s.json" % course_id
+        return os.path.join(ExerciseFileRepository.BASE_PATH, ".manifests", name)
+
+    def _read_state(self, state_path):
+        try:
+            with open(state_path) as f:
+                return json.load(f).get('sources', {})
+        except (IOError, ValueError):
+            return {}
+
+    def _write_state(self, state_path, hashes):
+        state_dir = os.path.dirname(state_path)
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"version": CONVERTER_VERSION, "sources": hashes}, f, sort_keys=True, indent=1)
+        os.rename(tmp_path, state_path)
@@ -0,0 +1,281 @@
+'''
+Prometheus-style metrics (request latency, repository scans, exercise loads,
+cache hits, writes, LTI launches and rejected launches), exposed in the text
+exposition format by lab.views.metrics_view at /metrics.
+
+Metrics are opt-in: nothing is collected or exposed unless METRICS_ENABLED
+is set. Code updates the metrics defined at the bottom of this module:
+
+    REPOSITORY_SCANS.inc(repository="file")
+    REQUEST_DURATION.observe(0.012, url_name="lab:index", method="GET", status="2xx")
+
+Each process collects its own values. Under a multi-worker WSGI server, set
+METRICS_DIR to a directory shared by the workers: each process then writes
+its values to a file of its own in that directory (at most once every
+METRICS_FLUSH_INTERVAL seconds, and when it exits), and a scrape adds up
+the files of all processes, so it doesn't matter which worker serves it.
+The files of workers that have exited are kept so that the counters never
+go backwards; the directory should be emptied when the server is
+restarted.
+'''
+from django.conf import settings
+from django.test.signals import setting_changed
+
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict # python 2.6
+
+log = logging.getLogger(__name__)
+
+class MetricsCollector(object):
+    '''
+    Holds the values of the metrics of this process. Counter values are
+    stored as {name: {label_values: value}}, histogram values as
+    {name: {label_values: [bucket counts..., sum]}} where the last bucket
+    is +Inf and the counts are not cumulative.
+    '''
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+        self.configured = False
+        self.reset()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def configure(self):
+        '''Reads the settings (again, e.g. after they are overridden in tests).'''
+        self.enabled = bool(getattr(settings, 'METRICS_ENABLED', False))
+        self.path = getattr(settings, 'METRICS_DIR', None)
+        self.flush_interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+        self.configured = True
+
+    def isEnabled(self):
+        if not self.configured:
+            self.configure()
+        return self.enabled
+
+    def reset(self):
+        '''Discards the values (and the file identity) of this process.'''
+        self.values = dict([(name, {}) for name in self.metrics])
+        self.pid = os.getpid()
+        self.file_name = "%d-%s.json" % (self.pid, uuid.uuid4().hex)
+        if getattr(self, 'flush_timer', None) is not None:
+            self.flush_timer.cancel()
+        self.flush_timer = None
+
+    def update(self, metric, key, fn):
+        '''Applies fn to the stored value of a series, under the lock.'''
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked: the values belong to the parent process
+                self.reset()
+            series = self.values.setdefault(metric.name, {})
+            series[key] = fn(series.get(key, None))
+            if self.path is not None and self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_interval, self.flushLater)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def snapshot(self):
+        '''Returns a copy of the values of this process.'''
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            return dict([(name, dict([(key, list(value) if isinstance(value, list) else value)
+                for key, value in series.iteritems()])) for name, series in self.values.iteritems()])
+
+    def flush(self):
+        '''Writes the values of this process to its file in METRICS_DIR.'''
+        if not self.configured or self.path is None:
+            return
+        with self.lock:
+            flush_timer, self.flush_timer = self.flush_timer, None
+        if flush_timer is not None and flush_timer is not threading.current_thread():
+            flush_timer.cancel()
+        data = dict([(name, [[list(key), value] for key, value in series.iteritems()])
+            for name, series in self.snapshot().iteritems()])
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, os.path.join(self.path, self.file_name))
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def flushLater(self):
+        '''Flushes from the timer thread started by update().'''
+        try:
+            self.flush()
+        except (IOError, OSError) as e:
+            log.warning("Unable to write metrics to %s: %s" % (self.path, e))
+
+    def collect(self):
+        '''
+        Returns the values of all processes: the files in METRICS_DIR (after
+        writing the current values of this process), or else the values of
+        this process.
+        '''
+        if self.path is None:
+            return self.snapshot()
+        self.flush()
+        values = {}
+        for file_path in sorted(glob.glob(os.path.join(self.path, '*.json'))):
+            try:
+                with open(file_path) as f:
+                    data = json.load(f)
+            except (IOError, ValueError):
+                continue
+            for name, entries in data.iteritems():
+                metric = self.metrics.get(name, None)
+                if metric is None:
+                    continue
+                series = values.setdefault(name, {})
+                for key, value in entries:
+                    key = tuple(key)
+                    series[key] = metric.merge(series.get(key, None), value)
+        return values
+
+    def render(self):
+        '''Returns the metrics of all processes in the text exposition format.'''
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.iteritems():
+            lines.append("# HELP %s %s" % (name, metric.documentation))
+            lines.append("# TYPE %s %s" % (name, metric.TYPE))
+            for key in sorted(values.get(name, {})):
+                lines.extend(metric.render(key, values[name][key]))
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        '''Discards all values, including the files of METRICS_DIR.'''
+        with self.lock:
+            self.reset()
+        if self.configured and self.path is not None:
+            for file_path in glob.glob(os.path.join(self.path, '*.json')):
+                os.remove(file_path)
+
+collector = MetricsCollector()
+
+def _flush_at_exit():
+    if collector.configured and collector.pid == os.getpid():
+        collector.flush()
+
+atexit.register(_flush_at_exit)
+
+def _settings_changed(sender, setting, **kwargs):
+    if setting.startswith('METRICS_'):
+        collector.configured = False
+
+setting_changed.connect(_settings_changed)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escape = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{%s}" % ",".join(['%s="%s"' % (n, escape(v)) for n, v in pairs])
+
+def format_value(value):
+    if isinstance(value, float) and value == int(value):
+        value = int(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        collector.register(self)
+
+    def getKey(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s expects the labels %s" % (self.name, ", ".join(self.labelnames)))
+        return tuple([unicode(labels[n]) for n in self.labelnames])
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not collector.isEnabled():
+            return
+        collector.update(self, self.getKey(labels), lambda value: (value or 0) + amount)
+
+    def merge(self, value, other):
+        return (value or 0) + other
+
+    def render(self, key, value):
+        return ["%s%s %s" % (self.name, format_labels(self.labelnames, key), format_value(value))]
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount, **labels):
+        if not collector.isEnabled():
+            return
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if amount <= bound:
+                index = i
+                break
+        def add(value):
+            if value is None:
+                value = [0] * (len(self.buckets) + 1) + [0.0]
+            value[index] += 1
+            value[-1] += amount
+            return value
+        collector.update(self, self.getKey(labels), add)
+
+    def merge(self, value, other):
+        if value is None:
+            return list(other)
+        return [a + b for a, b in zip(value, other)]
+
+    def render(self, key, value):
+        lines = []
+        cumulative = 0
+        bounds = [format_value(b) for b in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, value[:-1]):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (self.name, format_labels(self.labelnames, key, [("le", bound)]), cumulative))
+        labels = format_labels(self.labelnames, key)
+        lines.append("%s_sum%s %s" % (self.name, labels, format_value(value[-1])))
+        lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+REQUEST_DURATION = Histogram('harmonylab_request_duration_seconds',
+    'Time to produce a response, by URL name.', ['url_name', 'method', 'status'])
+REPOSITORY_SCANS = Counter('harmonylab_repository_scans_total',
+    'Number of scans of the exercise directories or queries of the exercise table.', ['repository'])
+EXERCISE_LOADS = Counter('harmonylab_exercise_loads_total',
+    'Number of exercise loads (including those answered by the definition cache).', ['repository'])
+CACHE_HITS = Counter('harmonylab_cache_hits_total',
+    'Number of lookups answered by an in-memory cache.', ['cache'])
+CACHE_MISSES = Counter('harmonylab_cache_misses_total',
+    'Number of lookups that missed an in-memory cache.', ['cache'])
+EXERCISE_WRITES = Counter('harmonylab_exercise_writes_total',
+    'Number of exercises created, updated or deleted, and of groups deleted.', ['operation'])
+LTI_LAUNCHES = Counter('harmonylab_lti_launches_total',
+    'Number of LTI launches, by whether the course was set up by the launch.', ['course'])
+LTI_NONCE_REJECTIONS = Counter('harmonylab_lti_nonce_rejections_total',
+    'Number of LTI launches rejected by the OAuth nonce check, by reason.', ['reason'])
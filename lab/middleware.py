@@ -0,0 +1,109 @@
+from django.core.exceptions import MiddlewareNotUsed
+
+from .timing import RequestTimer
+from .metrics import collector, REQUEST_DURATION
+
+from timeit import default_timer
+import json
+import logging
+
+timing_log = logging.getLogger('lab.timing')
+
+class ServerTimingMiddleware(object):
+    '''
+    Times each request and the phases marked with lab.timing.timed(), and
+    reports them in a Server-Timing response header, e.g.
+
+        Server-Timing: findFiles;dur=1.204, load;dur=0.311;desc="3 calls", total;dur=9.870
+
+    and as one JSON log line per request on the "lab.timing" logger (at
+    INFO level). The body of a streaming response is produced after this
+    middleware returns, so the time spent producing it is only logged, as
+    the "stream" phase, once the stream is finished.
+
+    This should be the first middleware, so that the total includes the
+    other middleware.
+    '''
+    def process_request(self, request):
+        request.timer = RequestTimer()
+        request.timer.activate()
+
+    def process_response(self, request, response):
+        timer = getattr(request, 'timer', None)
+        if timer is None:
+            return response
+        timer.deactivate()
+        response['Server-Timing'] = self.getHeader(timer)
+        if response.streaming:
+            response.streaming_content = self.timeStream(request, response, timer, response.streaming_content)
+        else:
+            self.log(request, response, timer)
+        return response
+
+    def timeStream(self, request, response, timer, content):
+        '''Yields the content of a streaming response, timing the production of each chunk.'''
+        iterator = iter(content)
+        try:
+            while True:
+                timer.activate()
+                started = timer.elapsed()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    timer.add('stream', timer.elapsed() - started)
+                    timer.deactivate()
+                yield chunk
+        finally:
+            self.log(request, response, timer)
+
+    def getHeader(self, timer):
+        metrics = []
+        for name, (seconds, count) in timer.phases.iteritems():
+            metric = "%s;dur=%.3f" % (name, seconds * 1e3)
+            if count > 1:
+                metric += ';desc="%d calls"' % count
+            metrics.append(metric)
+        metrics.append("total;dur=%.3f" % (timer.elapsed() * 1e3))
+        return ", ".join(metrics)
+
+    def log(self, request, response, timer):
+        if not timing_log.isEnabledFor(logging.INFO):
+            return
+        resolver_match = getattr(request, 'resolver_match', None)
+        timing_log.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "url_name": getattr(resolver_match, 'url_name', None),
+            "status": response.status_code,
+            "total_ms": round(timer.elapsed() * 1e3, 3),
+            "phases": timer.asDict(),
+        }))
+
+class MetricsMiddleware(object):
+    '''
+    Records the time to produce each response in the request duration
+    histogram of lab.metrics, by URL name (e.g. "lab:course-exercises"),
+    method and status class. For a streaming response this is the time until
+    the response is returned, not until the stream is finished.
+
+    This is only used if METRICS_ENABLED is set.
+    '''
+    def __init__(self):
+        if not collector.isEnabled():
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        request.metrics_started = default_timer()
+
+    def process_response(self, request, response):
+        started = getattr(request, 'metrics_started', None)
+        if started is None:
+            return response
+        resolver_match = getattr(request, 'resolver_match', None)
+        REQUEST_DURATION.observe(default_timer() - started,
+            url_name=getattr(resolver_match, 'view_name', None) or "unmatched",
+            method=request.method,
+            status="%dxx" % (response.status_code // 100))
+        return response
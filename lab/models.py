@@ -0,0 +1,19 @@
+from django.db import models
+
+class Exercise(models.Model):
+    '''
+    Stores an exercise definition for ExerciseDatabaseRepository. Exercises
+    that don't belong to a course have an empty course_id.
+    '''
+    course_id = models.CharField(max_length=255, blank=True, default='')
+    group_name = models.CharField(max_length=255)
+    exercise_name = models.CharField(max_length=255)
+    definition = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Exercise'
+        verbose_name_plural = 'Exercises'
+        unique_together = (('course_id', 'group_name', 'exercise_name'),)
+        ordering = ['course_id', 'group_name', 'exercise_name']
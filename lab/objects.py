@@ -1,11 +1,34 @@
 from django.conf import settings
-from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.core import urlresolvers
+from django.db import connection, transaction, IntegrityError, DatabaseError
+from django.db.models import Count, Max
+from django.utils import timezone
 import os
 import os.path
 import string
 import json
 import re
+import time
+import errno
+import calendar
+import hashlib
+import tempfile
+import base64
+import bisect
+import threading
 import logging
+from multiprocessing.pool import ThreadPool
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict # python 2.6
+
+from .models import Exercise as ExerciseModel
+from .timing import timed
+from .urltemplates import URLTemplate
+from .metrics import REPOSITORY_SCANS, EXERCISE_LOADS, EXERCISE_WRITES, CACHE_HITS, CACHE_MISSES
 
 log = logging.getLogger(__name__)
 
@@ -17,34 +40,128 @@ class ExerciseRepository(object):
 
     To get an instance of the repository, use the create() factory method. If
     the repositoryType keyword argument is not present, the default will be
-    returned, which is currently "file". It's best not to pass a specific
-    repository type and just use the default, so that it's easy to move to a
-    database backend later.
+    returned, which is set by the EXERCISE_REPOSITORY_TYPE setting ("file" or
+    "database"). It's best not to pass a specific repository type and just
+    use the default, so that the storage backend can be switched in one
+    place.
 
     Usage: 
         repo = ExerciseRepository.create()
         exercise = repo.findExerciseByGroup("MyGroupName", "03")
     '''
+    repositoryType = None
+
+    _load_pool = None
+    _load_pool_pid = None
+    _load_pool_lock = threading.Lock()
+
     def __init__(self, *args, **kwargs):
         self.course_id = kwargs.get('course_id', None)
         if self.course_id is not None:
             self.course_id = str(self.course_id)
-        self.groups = []
-        self.exercises = []
+        self.version = None
+        self.reset()
 
-    def getGroupList(self):
-        raise Exception("subclass responsibility")
+    def getGroupList(self, groups=None):
+        '''
+        Returns a list of group names (of all groups, or of the given groups).
+
+        The list of all groups is kept in the cache framework under the
+        course and the version of the listing it was built from, so it is
+        rebuilt after every change. Writes through this repository also
+        delete it. The entries expire after GROUP_LIST_CACHE_TIMEOUT seconds
+        (None: never).
+        '''
+        if groups is not None:
+            return self.makeGroupList(groups)
+        key = self.getGroupListCacheKey()
+        group_list = cache.get(key)
+        if group_list is None:
+            CACHE_MISSES.inc(cache="group_list")
+            group_list = self.makeGroupList(self.getSortedGroups()[0])
+            cache.set(key, group_list, getattr(settings, 'GROUP_LIST_CACHE_TIMEOUT', None))
+        else:
+            CACHE_HITS.inc(cache="group_list")
+        return group_list
+
+    def makeGroupList(self, groups):
+        return [{
+            "name": g.name,
+            "url": g.url(),
+            "size": g.size(),
+        } for g in groups]
+
+    def getGroupListCacheKey(self):
+        return "lab:group-list:%s:%s:%s" % (self.repositoryType, self.course_id or '', self.version)
+
+    def invalidateGroupList(self):
+        '''Deletes the cached group list of the version this repository was built from.'''
+        cache.delete(self.getGroupListCacheKey())
 
     def findGroup(self, group_name):
-        raise Exception("subclass responsibility")
+        '''Returns a single group (group names should be distinct).'''
+        return self.group_index.get(group_name, None)
 
     def findExercise(self, exercise_name):
-        raise Exception("subclass responsibility")
+        '''Returns an array of exercise matches (exercise names are not distinct).'''
+        return list(self.exercise_index.get(exercise_name, []))
 
     def findExerciseByGroup(self, group_name, exercise_name):
-        raise Exception("subclass responsibility")
+        '''Returns a single exercise (group+exercise is unique).'''
+        group = self.findGroup(group_name)
+        if group is not None:
+            return group.findExercise(exercise_name)
+        return None
 
     def createExercise(self, data):
+        '''Creates an exercise and returns the result (see createExercises).'''
+        return self.createExercises([data])[0]
+
+    def createExercises(self, data_list):
+        '''
+        Creates exercises from a list of exercise data, each with its own
+        group_name, so a batch can span several groups. All of the data is
+        validated before anything is saved, and the valid exercises are saved
+        together. Returns a result for each item, in the same order.
+        '''
+        items = []
+        for data in data_list:
+            if not isinstance(data, dict):
+                items.append((None, None, ["Exercise data must be an object."]))
+                continue
+            data = dict(data)
+            group_name = data.pop('group_name', None)
+            exercise_definition = ExerciseDefinition(data)
+            errors = list(exercise_definition.getErrors())
+            if not group_name:
+                errors.append("Missing group name.")
+            items.append((group_name, exercise_definition, errors))
+
+        valid = [(group_name, exercise_definition) for group_name, exercise_definition, errors in items if not errors]
+        created = iter(self.saveExercises(valid) if valid else [])
+        if valid:
+            self.invalidateGroupList()
+            EXERCISE_WRITES.inc(len(valid), operation="create")
+
+        results = []
+        for group_name, exercise_definition, errors in items:
+            result = {}
+            if not errors:
+                result['status'] = "success"
+                result['message'] = "Exercise created successfully!"
+                result['data'] = {"exercise": exercise_definition.getData(), "url": next(created).url()}
+            else:
+                result['status'] = "error"
+                result['message'] = "Exercise failed to save."
+                result['errors'] = errors
+            results.append(result)
+        return results
+
+    def saveExercises(self, definitions):
+        '''
+        Saves a list of (group_name, ExerciseDefinition) tuples as new
+        exercises and returns the exercises in the same order.
+        '''
         raise Exception("subclass responsibility")
 
     def updateExercise(self, group_name, exercise_name, data):
@@ -64,18 +181,106 @@ class ExerciseRepository(object):
     def reset(self):
         self.exercises = []
         self.groups = []
+        self.group_index = {}
+        self.exercise_index = {}
+        self.sorted_groups = None
+
+    def addGroup(self, group):
+        '''Adds a group and its exercises, indexing them by name.'''
+        self.sorted_groups = None
+        self.groups.append(group)
+        self.group_index.setdefault(group.name, group)
+        self.exercises.extend(group.exercises)
+        for e in group.exercises:
+            self.exercise_index.setdefault(e.name, []).append(e)
+        return self
 
-    def asDict(self):
+    def getSortedGroups(self):
+        '''
+        Returns the named groups in sort order (case-insensitive by name),
+        along with their sort keys for use with ExerciseCursor.
+        '''
+        if self.sorted_groups is None:
+            keyed = sorted([(g.getSortKey(), g) for g in self.groups if len(g.name) > 0], key=lambda kg: kg[0])
+            self.sorted_groups = ([g for k, g in keyed], [k for k, g in keyed])
+        return self.sorted_groups
+
+    def asDict(self, lazy=False, groups=None):
+        '''
+        Returns the repository as a Dict. If lazy is true, the exercises and
+        groups are generators instead of lists (see StreamingJSONEncoder).
+        If groups is given, only those groups and their exercises are
+        included.
+        '''
+        if groups is None:
+            groups, exercises = self.groups, self.exercises
+        else:
+            exercises = [e for g in groups for e in g.exercises]
+        if lazy:
+            exercises = (e.asDict() for e in exercises)
+            groups = (g.asDict(lazy=True) for g in groups)
+        else:
+            exercises = [e.asDict() for e in exercises]
+            groups = [g.asDict() for g in groups]
         return {
             "course_id": self.course_id,
             "data": {
-                "exercises": [e.asDict() for e in self.exercises],
-                "groups": [g.asDict() for g in self.groups]
+                "exercises": exercises,
+                "groups": groups
             }
         }
 
     def asJSON(self):
         return json.dumps(self.asDict())
+
+    def iterLoadedGroups(self, groups=None):
+        '''
+        Yields each group (or each of the given groups) after loading all of
+        its exercise definitions. The files of each group are loaded
+        concurrently by the process-wide load pool, and the next group is
+        loaded while the current one is being consumed.
+        '''
+        groups = list(self.groups if groups is None else groups)
+        if len(groups) == 0:
+            return
+        pool = ExerciseRepository.getLoadPool()
+        pending = pool.map_async(ExerciseRepository.loadExercise, groups[0].exercises)
+        for i, group in enumerate(groups):
+            pending.get()
+            if i + 1 < len(groups):
+                pending = pool.map_async(ExerciseRepository.loadExercise, groups[i + 1].exercises)
+            yield group
+
+    @staticmethod
+    def getLoadPool():
+        '''
+        Returns the pool of EXERCISE_BULK_LOAD_WORKERS threads that load
+        exercises for iterLoadedGroups(), shared by the whole process. A
+        forked process gets a pool of its own.
+        '''
+        with ExerciseRepository._load_pool_lock:
+            if ExerciseRepository._load_pool is None or ExerciseRepository._load_pool_pid != os.getpid():
+                ExerciseRepository._load_pool = ThreadPool(processes=getattr(settings, 'EXERCISE_BULK_LOAD_WORKERS', 4))
+                ExerciseRepository._load_pool_pid = os.getpid()
+            return ExerciseRepository._load_pool
+
+    @staticmethod
+    def loadExercise(exercise):
+        '''
+        Loads an exercise in a thread of the load pool, closing the thread's
+        database connection (if it opened one) so that pool threads don't
+        keep connections open between requests. An exercise that can't be
+        loaded gets a load_error instead of a definition, so that one bad
+        file doesn't fail a response that is already being streamed.
+        '''
+        exercise.load_error = None
+        try:
+            return exercise.load()
+        except (ExerciseFileError, ValueError) as e:
+            exercise.setLoadError(e)
+            return False
+        finally:
+            connection.close()
         
     def __str__(self):
         return ', '.join([str(e) for e in self.exercises])
@@ -84,12 +289,35 @@ class ExerciseRepository(object):
         return self.__str__()
     
     @staticmethod
-    def create(*args, **kwargs):
-        repositories = {"file": ExerciseFileRepository}
-        repositoryType = kwargs.pop('repositoryType', "file")
+    def getRepositoryClass(repositoryType="file"):
+        repositories = {"file": ExerciseFileRepository, "database": ExerciseDatabaseRepository}
         if not (repositoryType in repositories):
-            raise "Invalid repository type"
-        return repositories[repositoryType](*args, **kwargs)
+            raise Exception("Invalid repository type")
+        return repositories[repositoryType]
+
+    @staticmethod
+    def getDefaultType():
+        '''Returns the repository type configured by EXERCISE_REPOSITORY_TYPE.'''
+        return getattr(settings, 'EXERCISE_REPOSITORY_TYPE', "file")
+
+    @staticmethod
+    def create(*args, **kwargs):
+        repositoryType = kwargs.pop('repositoryType', ExerciseRepository.getDefaultType())
+        return ExerciseRepository.getRepositoryClass(repositoryType)(*args, **kwargs)
+
+    @staticmethod
+    def getVersion(course_id=None, repositoryType=None):
+        '''
+        Returns a (version, last_modified) tuple for the content of a course's
+        exercises, without creating a repository. The version changes
+        whenever exercises or groups are added, changed or removed, and last_modified
+        is a timestamp (or None).
+        '''
+        if course_id is not None:
+            course_id = str(course_id)
+        if repositoryType is None:
+            repositoryType = ExerciseRepository.getDefaultType()
+        return ExerciseRepository.getRepositoryClass(repositoryType).getContentVersion(course_id)
     
 
 class ExerciseFileRepository(ExerciseRepository):
@@ -98,6 +326,7 @@ class ExerciseFileRepository(ExerciseRepository):
     store exercises.
     '''
     BASE_PATH = os.path.join(settings.ROOT_DIR, 'data', 'exercises', 'json')
+    repositoryType = "file"
 
     def __init__(self, *args, **kwargs):
         '''
@@ -124,82 +353,67 @@ class ExerciseFileRepository(ExerciseRepository):
             return os.path.join(ExerciseFileRepository.BASE_PATH, "all")
         return os.path.join(ExerciseFileRepository.BASE_PATH, "courses", course_id)
 
-    def getGroupList(self):
-        '''Returns a list of group names.'''
-        return sorted([{
-            "name": g.name,
-            "url": g.url(),
-            "size": g.size(),
-        } for g in self.groups if len(g.name) > 0], key=lambda g:g['name'].lower())           
-
-    def findGroup(self, group_name):
-        '''Returns a single group (group names should be distinct).'''
-        for g in self.groups:
-            if group_name == g.name:
-                return g
-        return None
-
-    def findExercise(self, exercise_name):
-        '''Returns an array of exercise matches (exercise names are not distinct).'''
-        result = []
-        for e in self.exercises:
-            if exercise_name == e.name:
-                result.append(e)
-        return result
-
-    def findExerciseByGroup(self, group_name, exercise_name):
-        '''Returns a single exercise (group+exercise is unique).'''
-        group = self.findGroup(group_name)
-        if group is not None:
-            return group.findExercise(exercise_name)
-        return None
+    @staticmethod
+    def getManifestPath(course_id):
+        '''
+        Returns the file path to the manifest for a given course. Manifests are
+        kept outside of the course directories so that writing one doesn't
+        change the directories it describes.
+        '''
+        if course_id is None:
+            return os.path.join(ExerciseFileRepository.BASE_PATH, ".manifests", "all.json")
+        return os.path.join(ExerciseFileRepository.BASE_PATH, ".manifests", "course-%s.json" % course_id)
 
+    @timed('findFiles')
     def findFiles(self):
         '''
-        Traverses the directory tree looking for all directories (groups) and
-        files (exercises) and instantiates objects for each.
+        Instantiates objects for all directories (groups) and files (exercises)
+        under the course path. The directory listing comes from the
+        process-wide ExerciseFileIndex, so the tree is only traversed again
+        when it has changed.
         '''
         self.reset()
 
         path_to_exercises = ExerciseFileRepository.getBasePath(self.course_id)
+        index = ExerciseFileIndex.forPath(path_to_exercises, manifest=ExerciseFileManifest(self.course_id))
 
-        for root, dirs, files in os.walk(path_to_exercises):
+        listing, signature, self.version, last_modified = index.getState()
+        for root, file_names in listing:
             group_name = string.replace(root, path_to_exercises, '')
             exercise_group = ExerciseGroup(group_name, course_id=self.course_id)
-            exercise_files = []  
+            exercise_files = [ExerciseFile(file_name, exercise_group, root) for file_name in file_names]
+            exercise_group.add(exercise_files)
+            self.addGroup(exercise_group)
 
-            sorted_files = sorted(files, key=lambda e: e.lower())
-            for file_name in sorted_files:
-                if file_name.endswith('.json'):
-                    exercise_file = ExerciseFile(file_name, exercise_group, root)
-                    exercise_files.append(exercise_file)
+    @staticmethod
+    def getContentVersion(course_id):
+        '''Returns the (version, last_modified) tuple from the course index.'''
+        path_to_exercises = ExerciseFileRepository.getBasePath(course_id)
+        index = ExerciseFileIndex.forPath(path_to_exercises, manifest=ExerciseFileManifest(course_id))
+        return index.getVersion()
 
-            if len(exercise_files) > 0:
-                exercise_group.add(exercise_files)
-                self.groups.append(exercise_group)
-                self.exercises.extend(exercise_files)
+    def invalidateIndex(self):
+        '''
+        Discards the cached directory listing for the course. Its manifest
+        (if any) is rebuilt by the index once the tree has settled (see
+        ExerciseFileIndex.scan).
+        '''
+        ExerciseFileIndex.invalidate(ExerciseFileRepository.getBasePath(self.course_id))
 
-    def createExercise(self, data):
+    def saveExercises(self, definitions):
         '''
-        Stores an exercise in a group folder with the given data, assuming it is
-        valid.
+        Stores exercises in their group folders. The groups are looked up in
+        this repository instead of scanning the tree again for each exercise,
+        and the index is invalidated once at the end.
         '''
-        group_name = data.pop('group_name', None)
-        exercise_definition = ExerciseDefinition(data)
-        result = {}
-        if exercise_definition.isValid():
-            ef = ExerciseFile.create(
+        try:
+            return [ExerciseFile.create(
                 course_id=self.course_id,
                 group_name=group_name,
-                exercise_definition=exercise_definition)
-            result['status'] = "success"
-            result['message'] = "Exercise created successfully!"
-            result['data'] = {"exercise": exercise_definition.getData(), "url": ef.url()}
-        else:
-            result['status'] = "error"
-            result['message'] = "Exercise failed to save."
-            result['errors'] = exercise_definition.getErrors()
-        return result
+                exercise_definition=exercise_definition,
+                repository=self) for group_name, exercise_definition in definitions]
+        finally:
+            self.invalidateIndex()
     
     def deleteExercise(self, group_name, exercise_name):
         '''
@@ -211,6 +425,10 @@ class ExerciseFileRepository(ExerciseRepository):
                 exercise.delete()
             except OSError as e:
                 return (False, str(e))
+            finally:
+                self.invalidateIndex()
+                self.invalidateGroupList()
+            EXERCISE_WRITES.inc(operation="delete_exercise")
         return (True, "Deleted exercise %s of group %s" % (exercise_name, group_name))
 
     def deleteGroup(self, group_name):
@@ -223,8 +441,552 @@ class ExerciseFileRepository(ExerciseRepository):
                 group.delete()
             except OSError as e:
                 return (False, str(e))
+            finally:
+                self.invalidateIndex()
+                self.invalidateGroupList()
+            EXERCISE_WRITES.inc(operation="delete_group")
         return (True, "Deleted exercise group %s" % (group_name))
 
+class ExerciseDatabaseRepository(ExerciseRepository):
+    '''
+    Implements the ExerciseRepository interface using the database to store
+    exercises (see lab.models.Exercise). Exercises are looked up with indexed
+    queries on (course_id, group_name, exercise_name) instead of scanning
+    directories, and writes are transactional.
+
+    To copy the existing exercise files into the database:
+        ./manage.py importexercises
+    '''
+    MAX_CREATE_ATTEMPTS = 5
+    repositoryType = "database"
+
+    def __init__(self, *args, **kwargs):
+        '''
+        Initializes the object by querying the names of all exercises and
+        groups in the course. Exercise definitions are not loaded (client
+        must do that).
+        '''
+        super(ExerciseDatabaseRepository, self).__init__(*args, **kwargs)
+        self.findRecords()
+
+    @staticmethod
+    def getCourseKey(course_id):
+        '''Returns the value of the course_id column for a course (or no course).'''
+        if course_id is None:
+            return ''
+        return str(course_id)
+
+    @staticmethod
+    def getQuerySet(course_id):
+        '''Returns a QuerySet of the exercises of a course.'''
+        return ExerciseModel.objects.filter(course_id=ExerciseDatabaseRepository.getCourseKey(course_id))
+
+    @timed('findRecords')
+    def findRecords(self):
+        '''
+        Instantiates objects for all groups and exercises of the course with
+        a single query that doesn't fetch the exercise definitions. Groups
+        and exercises are ordered like ExerciseFileRepository orders
+        directories and files.
+        '''
+        self.reset()
+        REPOSITORY_SCANS.inc(repository="database")
+
+        rows = ExerciseDatabaseRepository.getQuerySet(self.course_id).values_list('id', 'group_name', 'exercise_name', 'updated')
+        records = {}
+        for pk, group_name, exercise_name, updated in rows:
+            records.setdefault(group_name, []).append((exercise_name, pk, updated))
+        self.version = ExerciseDatabaseRepository.makeVersion(len(rows), max([r[3] for r in rows] or [None]))[0]
+
+        for group_name in sorted(records, key=lambda name: (name.lower(), name)):
+            exercise_group = ExerciseGroup(group_name, course_id=self.course_id)
+            exercise_records = sorted(records[group_name], key=lambda r: ExerciseFile.getSortKey(r[0]))
+            exercise_group.add([ExerciseRecord(name, exercise_group, pk, updated) for name, pk, updated in exercise_records])
+            self.addGroup(exercise_group)
+
+    @staticmethod
+    def getContentVersion(course_id):
+        '''
+        Returns the (version, last_modified) tuple of a course from the
+        number of exercises and the time of the most recent change.
+        '''
+        stats = ExerciseDatabaseRepository.getQuerySet(course_id).aggregate(count=Count('id'), updated=Max('updated'))
+        return ExerciseDatabaseRepository.makeVersion(stats['count'], stats['updated'])
+
+    @staticmethod
+    def makeVersion(count, updated):
+        '''Returns the (version, last_modified) tuple for a number of exercises and the time of the latest change.'''
+        version = hashlib.sha1(repr((count, updated))).hexdigest()
+        last_modified = None
+        if updated is not None:
+            last_modified = calendar.timegm(updated.utctimetuple())
+        return (version, last_modified)
+
+    @staticmethod
+    def getNextExerciseName(exercise_names):
+        '''Generates the next exercise name after the highest numbered one (01,02...).'''
+        numbers = [int(name) for name in exercise_names if name.isdigit()]
+        return str(max(numbers or [0]) + 1).zfill(2)
+
+    def saveExercises(self, definitions):
+        '''
+        Inserts exercises with the next available names in their groups, in
+        one transaction. The existing names of all the groups are read with
+        a single query. If another request takes one of the names first, the
+        unique index rejects the insert and the whole batch is retried.
+        '''
+        group_names = [re.sub(r'[^a-zA-Z0-9._\-]', r'', group_name) for group_name, exercise_definition in definitions] # scrub group names
+        for attempt in range(self.MAX_CREATE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    records = self.insertRecords(group_names, [d for g, d in definitions])
+                break
+            except IntegrityError:
+                log.warning("Exercise names in course %s were taken, retrying (attempt %d)" % (self.course_id, attempt + 1))
+        else:
+            raise Exception("unable to get next exercise names after %d tries" % self.MAX_CREATE_ATTEMPTS)
+
+        groups = {}
+        exercises = []
+        for record in records:
+            group = groups.setdefault(record.group_name, ExerciseGroup(record.group_name, course_id=self.course_id))
+            exercises.append(ExerciseRecord(record.exercise_name, group, record.pk, record.updated))
+            log.info("Created exercise. Course: %s Group: %s Exercise: %s" % (self.course_id, record.group_name, record.exercise_name))
+        return exercises
+
+    def insertRecords(self, group_names, exercise_definitions):
+        '''Inserts exercises numbered after the existing ones in their groups.'''
+        queryset = ExerciseDatabaseRepository.getQuerySet(self.course_id)
+        exercise_names = {}
+        for group_name, exercise_name in queryset.filter(group_name__in=set(group_names)).values_list('group_name', 'exercise_name'):
+            exercise_names.setdefault(group_name, []).append(exercise_name)
+
+        records = []
+        for group_name, exercise_definition in zip(group_names, exercise_definitions):
+            exercise_name = ExerciseDatabaseRepository.getNextExerciseName(exercise_names.get(group_name, []))
+            exercise_names.setdefault(group_name, []).append(exercise_name)
+            records.append(ExerciseModel(
+                course_id=ExerciseDatabaseRepository.getCourseKey(self.course_id),
+                group_name=group_name,
+                exercise_name=exercise_name,
+                definition=exercise_definition.asJSON()))
+        ExerciseModel.objects.bulk_create(records)
+
+        # bulk_create() doesn't set the primary keys (on Django 1.6), so they
+        # are read back in the same transaction
+        inserted = queryset.filter(group_name__in=set(group_names), exercise_name__in=set([r.exercise_name for r in records]))
+        keys = dict([((group_name, exercise_name), (pk, updated)) for group_name, exercise_name, pk, updated in
+            inserted.values_list('group_name', 'exercise_name', 'id', 'updated')])
+        for record in records:
+            record.pk, record.updated = keys[(record.group_name, record.exercise_name)]
+        return records
+
+    def iterLoadedGroups(self, groups=None):
+        '''
+        Yields each group (or each of the given groups) after loading all of
+        its exercise definitions with one query (see ExerciseRecord.loadAll).
+        The queries run in the calling thread, on its own connection.
+        '''
+        for group in list(self.groups if groups is None else groups):
+            ExerciseRecord.loadAll(group.exercises)
+            yield group
+
+    def updateExercise(self, group_name, exercise_name, data):
+        '''
+        Replaces the definition of an exercise in a group, assuming the data
+        is valid. Returns a (success, message) tuple.
+        '''
+        exercise_definition = ExerciseDefinition(data)
+        if not exercise_definition.isValid():
+            return (False, "Exercise failed to save.")
+        queryset = ExerciseDatabaseRepository.getQuerySet(self.course_id)
+        updated = queryset.filter(group_name=group_name, exercise_name=exercise_name).update(
+            definition=exercise_definition.asJSON(),
+            updated=timezone.now())
+        if updated == 0:
+            return (False, "Exercise %s of group %s does not exist" % (exercise_name, group_name))
+        EXERCISE_WRITES.inc(operation="update")
+        return (True, "Updated exercise %s of group %s" % (exercise_name, group_name))
+
+    def deleteExercise(self, group_name, exercise_name):
+        '''
+        Deletes an exercise in a group.
+        '''
+        try:
+            ExerciseDatabaseRepository.getQuerySet(self.course_id).filter(group_name=group_name, exercise_name=exercise_name).delete()
+        except DatabaseError as e:
+            return (False, str(e))
+        self.invalidateGroupList()
+        EXERCISE_WRITES.inc(operation="delete_exercise")
+        return (True, "Deleted exercise %s of group %s" % (exercise_name, group_name))
+
+    def deleteGroup(self, group_name):
+        '''
+        Deletes a group, including all exercises in the group.
+        '''
+        try:
+            ExerciseDatabaseRepository.getQuerySet(self.course_id).filter(group_name=group_name).delete()
+        except DatabaseError as e:
+            return (False, str(e))
+        self.invalidateGroupList()
+        EXERCISE_WRITES.inc(operation="delete_group")
+        return (True, "Deleted exercise group %s" % (group_name))
+
+class ExerciseFileIndex(object):
+    '''
+    Process-wide cache of the directory listing for one course path, so that
+    ExerciseFileRepository doesn't have to walk the directory tree on every
+    request.
+
+    The listing is a list of (group_path, file_names) tuples in os.walk()
+    order, with the exercise file names sorted. It is reused until the mtime
+    of one of the directories it was built from changes, or until
+    invalidate() is called after a write. When the listing is first needed it
+    is read from the course manifest if there is a current one, otherwise the
+    directory tree is traversed.
+
+    Writes go through a temp file and a rename, which changes the mtime of
+    the directory, so only a file edited in place by hand goes unnoticed. If
+    EXERCISE_INDEX_FILE_STATS is set, the mtime and size of every file are
+    checked as well, at the cost of a stat() per file on every request.
+
+    The index also provides a content version for the tree (a hash of the
+    mtimes it checks) and a last-modified time, which can be used as HTTP
+    validators without building any exercise objects.
+
+    Usage:
+        index = ExerciseFileIndex.forPath(path_to_exercises)
+        for group_path, file_names in index.getListing():
+            ...
+    '''
+    # Directories modified this close to a scan could change again without a
+    # visible mtime change on filesystems with coarse timestamps, so a
+    # listing built from them is not trusted.
+    MTIME_GRANULARITY = 1.0
+
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, path, manifest=None):
+        self.path = path
+        self.manifest = manifest
+        self.lock = threading.Lock()
+        self.state = (None, None, None, None) # (listing, signature, version, last_modified)
+
+    @classmethod
+    def forPath(cls, path, manifest=None):
+        '''Returns the shared index for a path, creating it if necessary.'''
+        with cls._indexes_lock:
+            if path not in cls._indexes:
+                cls._indexes[path] = cls(path, manifest=manifest)
+            return cls._indexes[path]
+
+    @classmethod
+    def invalidate(cls, path=None):
+        '''Discards the cached listing for a path, or for all paths.'''
+        with cls._indexes_lock:
+            if path is None:
+                indexes = cls._indexes.values()
+            else:
+                indexes = [cls._indexes[path]] if path in cls._indexes else []
+        for index in indexes:
+            index.clear()
+
+    def clear(self):
+        self.state = (None, None, None, None)
+
+    def getListing(self):
+        '''Returns the directory listing, scanning only if it is out of date.'''
+        return self.getState()[0]
+
+    def getVersion(self):
+        '''Returns a (version, last_modified) tuple for the directory tree.'''
+        return self.getState()[2:]
+
+    def getState(self):
+        state = self.state
+        if state[0] is not None and self.isCurrent(state[1]):
+            return state
+        with self.lock:
+            # another thread may have scanned while we were waiting
+            state = self.state
+            if state[0] is None:
+                self.load()
+            elif not self.isCurrent(state[1]):
+                self.scan()
+            return self.state
+
+    def load(self):
+        '''
+        Loads the listing from the manifest, falling back to a scan if the
+        manifest is missing or stale.
+        '''
+        if self.manifest is not None:
+            result = self.manifest.getListing()
+            if result is not None:
+                listing, (dir_paths, mtimes, file_paths, file_stats) = result
+                self.state = self.makeState(listing, dir_paths, mtimes, file_paths, file_stats)
+                return listing
+        return self.scan()
+
+    def isCurrent(self, signature):
+        '''Returns true if none of the checked directories and files have changed.'''
+        if signature is None:
+            return False
+        dir_paths, mtimes, file_paths, file_stats = signature
+        return self.getMtimes(dir_paths) == mtimes and self.getFileStats(file_paths) == file_stats
+
+    def scan(self):
+        '''
+        Traverses the directory tree and stores the resulting listing. A
+        stale manifest is rebuilt after a trusted scan only: one built while
+        the tree is still changing would be racy, so it would never be used.
+        '''
+        started = time.time()
+        REPOSITORY_SCANS.inc(repository="file")
+        listing, dir_paths = self.walk(self.path)
+        mtimes = self.getMtimes(dir_paths)
+        file_paths = self.getCheckedFilePaths(listing)
+        file_stats = self.getFileStats(file_paths)
+        trusted = not self.isRacy(mtimes + self.getFileMtimes(file_stats), started)
+        self.state = self.makeState(listing, dir_paths, mtimes, file_paths, file_stats, trusted=trusted)
+        log.debug("Scanned exercise directory %s: %d groups" % (self.path, len(listing)))
+        if trusted and self.manifest is not None and self.manifest.exists() and self.manifest.getListing() is None:
+            self.manifest.refresh()
+        return listing
+
+    def makeState(self, listing, dir_paths, mtimes, file_paths, file_stats, trusted=True):
+        '''
+        Returns the state tuple for a listing. An untrusted listing has no
+        signature, so it is rebuilt on the next request, and it gets a version
+        of its own because its mtimes might not change with its content.
+        '''
+        signature = (tuple(dir_paths), tuple(mtimes), tuple(file_paths), tuple(file_stats))
+        content = repr(signature)
+        if not trusted:
+            signature = None
+            content += repr(time.time())
+        version = hashlib.sha1(content).hexdigest()
+        known_mtimes = [m for m in mtimes + self.getFileMtimes(file_stats) if m is not None]
+        last_modified = max(known_mtimes) if known_mtimes else None
+        return (listing, signature, version, last_modified)
+
+    @staticmethod
+    def walk(path):
+        '''
+        Traverses the directory tree and returns the listing along with the
+        paths of all directories that were visited.
+        '''
+        listing = []
+        dir_paths = [path]
+        for root, dirs, files in os.walk(path):
+            if root != path:
+                dir_paths.append(root)
+            file_names = sorted([f for f in files if f.endswith('.json')], key=lambda f: ExerciseFile.getSortKey(f[:-len('.json')]))
+            if len(file_names) > 0:
+                listing.append((root, file_names))
+        return listing, dir_paths
+
+    @classmethod
+    def isRacy(cls, mtimes, scanned_at):
+        '''Returns true if any directory changed too close to the scan to trust.'''
+        return any(m is not None and m > scanned_at - cls.MTIME_GRANULARITY for m in mtimes)
+
+    @staticmethod
+    def getMtimes(dir_paths):
+        mtimes = []
+        for dir_path in dir_paths:
+            try:
+                mtimes.append(os.stat(dir_path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    @staticmethod
+    def getFilePaths(listing):
+        return tuple([os.path.join(group_path, file_name) for group_path, file_names in listing for file_name in file_names])
+
+    @staticmethod
+    def getCheckedFilePaths(listing):
+        '''Returns the paths of the files to check, if EXERCISE_INDEX_FILE_STATS is set.'''
+        if getattr(settings, 'EXERCISE_INDEX_FILE_STATS', False):
+            return ExerciseFileIndex.getFilePaths(listing)
+        return ()
+
+    @staticmethod
+    def getFileStats(file_paths):
+        '''Returns the (mtime, size) of each file, or None for a missing file.'''
+        stats = []
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+                stats.append((stat.st_mtime, stat.st_size))
+            except OSError:
+                stats.append(None)
+        return tuple(stats)
+
+    @staticmethod
+    def getFileMtimes(file_stats):
+        return tuple([s[0] if s is not None else None for s in file_stats])
+
+class ExerciseFileManifest(object):
+    '''
+    A manifest is a single JSON file that describes the exercise directory
+    tree of a course: group and exercise names in sort order, their URLs, the
+    size, mtime and content hash of each exercise file, and the mtime of each
+    directory. A cold process can build its listing from the manifest with
+    one read and a stat() per directory instead of traversing the tree.
+
+    Manifests are compiled with "./manage.py buildmanifest". A stale manifest
+    is never used; the tree is scanned instead. Once a manifest exists, it is
+    rebuilt by the first scan after a change that is older than
+    ExerciseFileIndex.MTIME_GRANULARITY, rather than on every write.
+    '''
+    VERSION = 1
+
+    def __init__(self, course_id=None):
+        self.course_id = course_id
+        self.path = ExerciseFileRepository.getBasePath(course_id)
+        self.manifest_path = ExerciseFileRepository.getManifestPath(course_id)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def read(self):
+        '''Returns the manifest data, or None if there is no usable manifest.'''
+        try:
+            with open(self.manifest_path) as f:
+                data = json.loads(f.read())
+        except IOError:
+            return None
+        except ValueError as e:
+            log.warning("Ignoring invalid manifest %s: %s" % (self.manifest_path, e))
+            return None
+        if data.get('version', None) != self.VERSION:
+            return None
+        return data
+
+    def getListing(self):
+        '''
+        Returns a (listing, (dir_paths, mtimes, file_paths, file_stats)) tuple
+        as used by ExerciseFileIndex, or None if the manifest is missing or no
+        longer matches the directories (and files, if EXERCISE_INDEX_FILE_STATS
+        is set).
+        '''
+        data = self.read()
+        if data is None:
+            return None
+        dir_paths = tuple([self.getAbsolutePath(d['path']) for d in data['directories']])
+        mtimes = tuple([d['mtime'] for d in data['directories']])
+        listing = [(self.getAbsolutePath(g['path']), [e['file_name'] for e in g['exercises']]) for g in data['groups']]
+        file_paths = ExerciseFileIndex.getCheckedFilePaths(listing)
+        file_stats = ()
+        if len(file_paths) > 0:
+            file_stats = tuple([(e['mtime'], e['size']) for g in data['groups'] for e in g['exercises']])
+        if ExerciseFileIndex.isRacy(mtimes + ExerciseFileIndex.getFileMtimes(file_stats), data['generated']):
+            return None
+        if ExerciseFileIndex.getMtimes(dir_paths) != mtimes:
+            return None
+        if ExerciseFileIndex.getFileStats(file_paths) != file_stats:
+            return None
+        return (listing, (dir_paths, mtimes, file_paths, file_stats))
+
+    def build(self, previous=None):
+        '''
+        Traverses the directory tree and returns the manifest data. Content
+        hashes are reused from the previous manifest for files whose size and
+        mtime haven't changed.
+        '''
+        known = {}
+        if previous is not None:
+            for g in previous['groups']:
+                for e in g['exercises']:
+                    known[(g['path'], e['file_name'])] = e
+
+        generated = time.time()
+        listing, dir_paths = ExerciseFileIndex.walk(self.path)
+        mtimes = ExerciseFileIndex.getMtimes(dir_paths)
+
+        groups = []
+        for group_path, file_names in listing:
+            relative_group_path = self.getRelativePath(group_path)
+            group = ExerciseGroup(string.replace(group_path, self.path, ''), course_id=self.course_id)
+            group.add([ExerciseFile(file_name, group, group_path) for file_name in file_names])
+            exercises = []
+            for ef in group.exercises:
+                stat = os.stat(ef.getPathToFile())
+                entry = known.get((relative_group_path, ef.file_name), None)
+                if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                    entry = {"sha1": self.getContentHash(ef.getPathToFile())}
+                exercises.append({
+                    "name": ef.name,
+                    "file_name": ef.file_name,
+                    "url": ef.url(),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha1": entry['sha1'],
+                })
+            groups.append({
+                "name": group.name,
+                "path": relative_group_path,
+                "url": group.url(),
+                "size": group.size(),
+                "exercises": exercises,
+            })
+
+        return {
+            "version": self.VERSION,
+            "course_id": self.course_id,
+            "generated": generated,
+            "directories": [{"path": self.getRelativePath(p), "mtime": m} for p, m in zip(dir_paths, mtimes)],
+            "groups": groups,
+        }
+
+    def save(self, data):
+        '''Writes the manifest atomically (temp file + rename).'''
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=manifest_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(data, sort_keys=True, indent=1))
+            os.rename(tmp_path, self.manifest_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def update(self):
+        '''Rebuilds and saves the manifest, returning the new data.'''
+        data = self.build(previous=self.read())
+        self.save(data)
+        log.info("Updated exercise manifest: %s" % self.manifest_path)
+        return data
+
+    def refresh(self):
+        '''Updates the manifest if there is one, logging rather than raising errors.'''
+        if not self.exists():
+            return None
+        try:
+            return self.update()
+        except (IOError, OSError) as e:
+            log.error("Error updating exercise manifest %s: %s" % (self.manifest_path, e))
+        return None
+
+    def getRelativePath(self, path):
+        return os.path.relpath(path, self.path)
+
+    def getAbsolutePath(self, relative_path):
+        return os.path.normpath(os.path.join(self.path, relative_path))
+
+    @staticmethod
+    def getContentHash(file_path):
+        m = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                m.update(chunk)
+        return m.hexdigest()
+
 class ExerciseDefinition:
     '''
     An ExerciseDefinition is a stateless object that describes an exercise
@@ -298,6 +1060,18 @@ class ExerciseLilyPond:
 
     http://www.lilypond.org/doc/v2.18/Documentation/notation/writing-pitches
     '''
+    NOTE_PITCH = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+    HIDDEN_NOTE_SYMBOL = "x"
+
+    CHORD_RE = re.compile(r'<([^>]+)>')
+    HIDDEN_NOTE_RE = re.compile(r'\\xNote\s*')
+    WHITESPACE_RE = re.compile(r'\s+')
+    # a pitch entry: optional hidden note symbol, note name, then octave marks,
+    # octave numbers and accidentals in any order
+    PITCH_RE = re.compile(r"(x?)([a-g])([',sf0-9]*)$")
+    DIGIT_RE = re.compile(r'[0-9]')
+    UNRECOGNIZED_RE = re.compile(r"[^',sf0-9]")
+
     def __init__(self, lilypondString, *args, **kwargs):
         self.lpstring = lilypondString
         self.errors = []
@@ -306,7 +1080,7 @@ class ExerciseLilyPond:
 
     def parseChords(self, lpstring):
         '''Parses the string into chords.'''
-        chords = re.findall('<([^>]+)>', lpstring.strip())
+        chords = self.CHORD_RE.findall(lpstring.strip())
         # re.findall('<([^>]+)>', "<e c' g' bf'>1\n<f \xNote c' \xNote f' a'>1")
         return chords
     
@@ -318,79 +1092,55 @@ class ExerciseLilyPond:
         # http://www.lilypond.org/doc/v2.18/Documentation/notation/writing-pitches
         # parsing notes in "absolute" octave mode - each note must be specified absolutely
 
-        # constants for parsing
-        note_tuples = [('c',0),('d',2),('e',4),('f',5),('g',7),('a',9),('b',11)]
-        notes = [n[0] for n in note_tuples]
-        note_pitch = dict(note_tuples)
-        up, down = ("'", ",")
-        sharp, flat = ("s", "f")
-        hidden_note_symbol = r"x"
-
         # normalize the chord string 
-        chordstring = re.sub(r'\\xNote\s*', hidden_note_symbol, chordstring) # replace '\xNote' with just 'x'
+        chordstring = self.HIDDEN_NOTE_RE.sub(self.HIDDEN_NOTE_SYMBOL, chordstring) # replace '\xNote' with just 'x'
         chordstring = chordstring.lower().strip() # normalize to lower case
 
-        # mutable variables used during parsing
         midi_chord = {"visible": [], "hidden": []}
-        
+        visible, hidden = midi_chord['visible'], midi_chord['hidden']
+        note_pitch = self.NOTE_PITCH
+
         # parse each pitch entry in the chord and translate to MIDI
-        pitch_entries = re.split('\s+', chordstring)
-        for idx, pitch_entry in enumerate(pitch_entries):
+        for pitch_entry in self.WHITESPACE_RE.split(chordstring):
+            m = self.PITCH_RE.match(pitch_entry)
+            if m is None:
+                self.addPitchError(pitch_entry, chordstring)
+            is_hidden, note_name, marks = m.groups()
+
+            # octave changing marks are relative to the last octave number (if any),
+            # and accidentals change the pitch by a half step
             octave = start_octave
-            tokens = list(pitch_entry) # convert entry to sequence of characters
-
-            # check if this is a "hidden" note
-            midi_entry = midi_chord['visible']
-            if tokens[0] == hidden_note_symbol:
-                midi_entry = midi_chord['hidden']
-                tokens = tokens[1:]
+            if marks:
+                digits = self.DIGIT_RE.findall(marks)
+                if digits:
+                    octave = int(digits[-1])
+                octave += marks.count("'") - marks.count(",")
+                pitch_change = marks.count("s") - marks.count("f")
+            else:
+                pitch_change = 0
 
-            # check if the first character is a valid note name,
-            # otherwise record an error and skip the rest of the parsing
-            if len(tokens) == 0 or not (tokens[0] in notes):
-                self.is_valid = False
-                self.errors.append("Pitch [%s] in chord [%s] is invalid: missing or invalid note name" % (pitch_entry, chordstring))
-                raise ExerciseLilyPondError("Error parsing LilyPond chord: %s" % chordstring)
-            
-            note_name = tokens[0]
-            tokens = tokens[1:]
-            
-            # check that all subsequent characters are either octave changing marks, or accidentals
-            check_rest = re.sub('|'.join([up,down,sharp,flat,'\d']), '', ''.join(tokens))
-            if len(check_rest) > 0:
-                self.is_valid = False
-                self.errors.append("Pitch entry [%s] in chord [%s] contains unrecognized symbols: %s" % (pitch_entry, chordstring, check_rest))
-                raise ExerciseLilyPondError("Error parsing LilyPond chord: %s" % chordstring)
-
-            # look for octave changing marks
-            octave_change = 0
-            octaves = re.findall('('+up+'|'+down+'|\d)', ''.join(tokens))
-            if octaves is not None:
-                for o in octaves:
-                    if o == up:
-                        octave_change += 1
-                    elif o == down:
-                        octave_change -= 1
-                    else:
-                        octave = int(o)
-            
-            # look for change in the pitch by accidentals
-            pitch_change = 0  
-            accidentals = re.findall('('+sharp+'|'+flat+')', ''.join(tokens))
-            if accidentals is not None:
-                for acc in accidentals:
-                    if acc == sharp:
-                        pitch_change += 1
-                    elif acc == flat:
-                        pitch_change -= 1
-
-            # calculate the midi note number and add to the midi entry
-            octave += octave_change
             midi_pitch = (octave * 12) + note_pitch[note_name] + pitch_change
-            midi_entry.append(midi_pitch)
+            if is_hidden:
+                hidden.append(midi_pitch)
+            else:
+                visible.append(midi_pitch)
 
         return midi_chord
 
+    def addPitchError(self, pitch_entry, chordstring):
+        '''Records why a pitch entry couldn't be parsed and raises ExerciseLilyPondError.'''
+        tokens = pitch_entry
+        if tokens.startswith(self.HIDDEN_NOTE_SYMBOL):
+            tokens = tokens[1:]
+
+        self.is_valid = False
+        if len(tokens) == 0 or not (tokens[0] in self.NOTE_PITCH):
+            self.errors.append("Pitch [%s] in chord [%s] is invalid: missing or invalid note name" % (pitch_entry, chordstring))
+        else:
+            check_rest = ''.join(self.UNRECOGNIZED_RE.findall(tokens[1:]))
+            self.errors.append("Pitch entry [%s] in chord [%s] contains unrecognized symbols: %s" % (pitch_entry, chordstring, check_rest))
+        raise ExerciseLilyPondError("Error parsing LilyPond chord: %s" % chordstring)
+
     def parse(self):
         '''
         Parse method that parses the LilyPond string into an array
@@ -418,37 +1168,279 @@ class ExerciseLilyPond:
         '''
         return self.midi
 
+    @classmethod
+    def preview(cls, lilypondString):
+        '''
+        Returns the parse result of a chord string as a Dict with "valid",
+        "chord" (MIDI) and "errors", for showing while the chords are being
+        edited. Results of valid chord strings are memoized in the
+        ExerciseLilyPondCache, keyed by the chord string with runs of
+        whitespace collapsed, and must be treated as read-only.
+        '''
+        key = ' '.join(cls.WHITESPACE_RE.split(lilypondString.strip()))
+        cache = ExerciseLilyPondCache.getInstance()
+        result = cache.get(key, None)
+        if result is None:
+            lilypond = cls(key)
+            result = {"valid": lilypond.isValid(), "chord": lilypond.toMIDI(), "errors": lilypond.errors}
+            if lilypond.isValid():
+                cache.set(key, None, result)
+        return result
+
+class ExerciseLilyPondFile:
+    '''
+    This object converts an exercise written as a LilyPond file (see
+    data/exercises/SAMPLE.ly) to the data of an ExerciseDefinition. It
+    replaces the sed rules in data/exercises/ly2json.sed:
+
+    * The first boxed \\markup is the intro text, and an \\italic one is
+      the review text.
+    * The "theKey" variable gives the key signature and the key. The key
+      can be overridden with a comment (e.g. "f \\major % iG#").
+    * The chords inside "\\absolute { ... } % end" are parsed by
+      ExerciseLilyPond.
+    * The commented-out "HarmonyLab options" block is merged into the data
+      as JSON (trailing commas are allowed).
+    '''
+    MARKUP_RE = re.compile(r'^\\markup(?P<options>[^{\n]*)\{[ \t]*\n[ \t]*(?P<text>.*?)[ \t]*(?:\\strut)?[ \t]*\n[ \t]*\}', re.MULTILINE)
+    KEY_RE = re.compile(r'theKey\s*=\s*\{\s*\\key\s+(?P<tonic>[a-g][fs]?)\s+\\(?P<mode>major|minor)[ \t]*(?:%[ \t]*(?P<key>[ij][A-G][b_#]))?')
+    CHORDS_RE = re.compile(r'\\absolute\s*\{(?P<chords>.*?)\}\s*% end', re.DOTALL)
+    OPTIONS_RE = re.compile(r'^%\{[ \t]*%[ \t]*HarmonyLab options[ \t]*\n(?P<options>.*?)^%\}', re.MULTILINE | re.DOTALL)
+    TRAILING_COMMA_RE = re.compile(r',(\s*[\]}])')
+
+    # tonics in circle of fifths order, from seven flats to seven sharps
+    MAJOR_TONICS = ['cf', 'gf', 'df', 'af', 'ef', 'bf', 'f', 'c', 'g', 'd', 'a', 'e', 'b', 'fs', 'cs']
+    MINOR_TONICS = ['af', 'ef', 'bf', 'f', 'c', 'g', 'd', 'a', 'e', 'b', 'fs', 'cs', 'gs', 'ds', 'as']
+
+    def __init__(self, path):
+        self.path = path
+        self.errors = []
+
+    def read(self):
+        '''Reads the file and returns the exercise data (raises ExerciseLilyPondError).'''
+        with open(self.path) as f:
+            return self.parse(f.read())
+
+    def parse(self, text):
+        '''Parses the text of a LilyPond exercise into exercise data.'''
+        data = OrderedDict([("type", "matching"), ("reviewText", "")])
+
+        for m in self.MARKUP_RE.finditer(text):
+            if '\\italic' in m.group('options'):
+                data['reviewText'] = m.group('text')
+            elif 'introText' not in data:
+                data['introText'] = m.group('text')
+
+        m = self.KEY_RE.search(text)
+        if m is not None:
+            data['keySignature'], key = self.getKey(m.group('tonic'), m.group('mode'))
+            data['key'] = m.group('key') or key
+
+        m = self.CHORDS_RE.search(text)
+        if m is None:
+            self.fail("Missing chords: expected \\absolute { ... } % end")
+        lilypond = ExerciseLilyPond(m.group('chords').replace('\\theKey', '').replace('\\lyCommands', ''))
+        if not lilypond.isValid():
+            self.errors.extend(lilypond.errors)
+            self.fail("Invalid chords: %s" % "; ".join(lilypond.errors))
+        data['chord'] = lilypond.toMIDI()
+
+        m = self.OPTIONS_RE.search(text)
+        if m is not None:
+            options = self.TRAILING_COMMA_RE.sub(r'\1', "{%s}" % m.group('options').strip().rstrip(','))
+            try:
+                data.update(json.loads(options, object_pairs_hook=OrderedDict))
+            except ValueError as e:
+                self.fail("Invalid HarmonyLab options: %s" % e)
+
+        return data
+
+    def getKey(self, tonic, mode):
+        '''Returns the (keySignature, key) of a key in the notation used by exercises (e.g. "b", "jF_").'''
+        if mode == 'major':
+            fifths, prefix = self.MAJOR_TONICS.index(tonic) - 7, 'j'
+        else:
+            fifths, prefix = self.MINOR_TONICS.index(tonic) - 7, 'i'
+        key_signature = ('#' * fifths) if fifths > 0 else ('b' * -fifths)
+        accidental = {'': '_', 'f': 'b', 's': '#'}[tonic[1:]]
+        return (key_signature, prefix + tonic[0].upper() + accidental)
+
+    def fail(self, message):
+        self.errors.append(message)
+        raise ExerciseLilyPondError("Error parsing LilyPond file %s: %s" % (self.path, message))
+
 class ExerciseFileError(Exception):
     pass
 
+class ExerciseFileExistsError(ExerciseFileError):
+    pass
+
+class ExerciseDefinitionCache(object):
+    '''
+    Bounded LRU cache of parsed ExerciseDefinition objects, shared by the
+    whole process. Entries are keyed by file path and are only returned
+    while the file's (mtime, size) matches the one it was parsed from, so
+    changes on disk are picked up by the next load.
+
+    Cached definitions are shared between requests and must be treated as
+    read-only.
+
+    The size of the cache is set with EXERCISE_DEFINITION_CACHE_SIZE.
+    '''
+    DEFAULT_SIZE = 1024
+    SIZE_SETTING = 'EXERCISE_DEFINITION_CACHE_SIZE'
+    METRICS_NAME = 'exercise_definition'
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_size=DEFAULT_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.clear()
+
+    @classmethod
+    def getInstance(cls):
+        '''Returns the process-wide cache.'''
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(getattr(settings, cls.SIZE_SETTING, cls.DEFAULT_SIZE))
+            return cls._instance
+
+    def get(self, path, stamp):
+        '''Returns the cached definition for a path, or None if missing or stale.'''
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None and entry[0] == stamp:
+                self.entries[path] = entry
+                self.hits += 1
+                entry = entry[1]
+            else:
+                self.misses += 1
+                entry = None
+        if entry is None:
+            CACHE_MISSES.inc(cache=self.METRICS_NAME)
+        else:
+            CACHE_HITS.inc(cache=self.METRICS_NAME)
+        return entry
+
+    def set(self, path, stamp, exercise_definition):
+        '''Caches a definition, evicting the least recently used if full.'''
+        with self.lock:
+            self.entries.pop(path, None)
+            self.entries[path] = (stamp, exercise_definition)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class ExerciseLilyPondCache(ExerciseDefinitionCache):
+    '''
+    Bounded LRU cache of LilyPond chord previews (see
+    ExerciseLilyPond.preview), shared by the whole process. Entries are keyed
+    by the normalized chord string and never go stale. Only chord strings
+    that parse are cached.
+
+    The size of the cache is set with LILYPOND_PREVIEW_CACHE_SIZE.
+    '''
+    DEFAULT_SIZE = 4096
+    SIZE_SETTING = 'LILYPOND_PREVIEW_CACHE_SIZE'
+    METRICS_NAME = 'lilypond_preview'
+
+    _instance = None
+
+class ExerciseListCache(ExerciseDefinitionCache):
+    '''
+    Bounded LRU cache of the navigation lists of exercise groups (see
+    ExerciseGroup.getList), shared by the whole process. Entries are keyed
+    by course and group, and are stale once the names of the exercises in
+    the group, or the URLconf or script prefix, change.
+
+    The size of the cache is set with EXERCISE_LIST_CACHE_SIZE.
+    '''
+    DEFAULT_SIZE = 256
+    SIZE_SETTING = 'EXERCISE_LIST_CACHE_SIZE'
+    METRICS_NAME = 'exercise_list'
+
+    _instance = None
+
 class ExerciseFile:
     '''
     ExerciseFile is responsible for knowing how to load() and save()
     ExerciseDefinition objects to the file system. 
     '''
+    FILE_MODE = 0644
+
+    # errors of os.link() on filesystems without hard links (FAT, some
+    # network and overlay mounts)
+    LINK_UNSUPPORTED_ERRNOS = set([errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)])
+
+    # Per-group locks and the next number to try in each group, so that new
+    # exercise numbers are handed out without probing the directory.
+    _group_locks = {}
+    _next_numbers = {}
+    _lock = threading.Lock()
+
     def __init__(self, file_name, group, group_path):
         self.file_name = file_name
         self.group_path = group_path
         self.name = file_name.replace('.json', '')
         self.group = group
         self.exerciseDefinition = None
+        self.load_error = None
         self.selected = False
+        self.position = None
         
     def getPathToFile(self, ):
         return os.path.join(self.group_path, self.file_name)
     
+    @timed('load')
     def load(self):
-        '''Loads an ExerciseDefinition from a file.'''
+        '''
+        Loads an ExerciseDefinition from a file. The parsed definition is
+        taken from the ExerciseDefinitionCache if the file hasn't changed
+        since it was last parsed.
+        '''
+        EXERCISE_LOADS.inc(repository="file")
+        path = self.getPathToFile()
+        cache = ExerciseDefinitionCache.getInstance()
         try:
-            with open(self.getPathToFile()) as f:
-                data = f.read().strip()
-                self.exerciseDefinition = ExerciseDefinition.fromJSON(data) 
-        except IOError as e:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime, stat.st_size)
+            exercise_definition = cache.get(path, stamp)
+            if exercise_definition is None:
+                with open(path) as f:
+                    data = f.read().strip()
+                exercise_definition = ExerciseDefinition.fromJSON(data)
+                cache.set(path, stamp, exercise_definition)
+        except (IOError, OSError) as e:
             raise ExerciseFileError("Error loading exercise file: {0} => {1}".format(e.errno, e.strerror))
+        self.exerciseDefinition = exercise_definition
         return True
 
-    def save(self, exercise_definition):
-        '''Saves an ExerciseDefinition to a file.'''
+    def save(self, exercise_definition, exclusive=False):
+        '''
+        Saves an ExerciseDefinition to a file. The definition is written to a
+        temporary file that is then moved into place, so the file is never
+        seen half written. If exclusive is true, ExerciseFileExistsError is
+        raised instead of replacing an existing file.
+        '''
         if exercise_definition is not None:
             self.exerciseDefinition = exercise_definition
         elif self.exerciseDefinition is None:
@@ -458,20 +1450,60 @@ class ExerciseFile:
             return False
 
         try:
-            if not os.path.exists(self.group_path):
+            try:
                 os.makedirs(self.group_path)
-            with open(self.getPathToFile(), 'w') as f:
-                f.write(self.exerciseDefinition.asJSON())
-        except IOError as e:
-            raise ExerciseFileError("Error loading exercise file: {0} => {1}".format(e.errno, e.strerror))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            content = self.exerciseDefinition.asJSON()
+            fd, tmp_path = tempfile.mkstemp(dir=self.group_path, prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(content)
+                os.chmod(tmp_path, self.FILE_MODE)
+                if exclusive:
+                    self.linkExclusive(tmp_path, content)
+                else:
+                    os.rename(tmp_path, self.getPathToFile())
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except (IOError, OSError) as e:
+            if exclusive and e.errno == errno.EEXIST:
+                raise ExerciseFileExistsError("Exercise file already exists: {0}".format(self.getPathToFile()))
+            raise ExerciseFileError("Error saving exercise file: {0} => {1}".format(e.errno, e.strerror))
 
         return True
+
+    def linkExclusive(self, tmp_path, content):
+        '''
+        Moves a temporary file into place, failing with EEXIST if the file
+        name is taken: unlike rename, link fails if the name is taken. Without
+        hard links (no os.link() on Windows, or an unsupported filesystem),
+        the name is claimed with O_EXCL and the file is moved over it, or
+        written in place where rename doesn't replace files (Windows).
+        '''
+        path = self.getPathToFile()
+        if hasattr(os, 'link'):
+            try:
+                os.link(tmp_path, path)
+                return
+            except OSError as e:
+                if e.errno not in self.LINK_UNSUPPORTED_ERRNOS:
+                    raise
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, self.FILE_MODE))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            with open(path, 'w') as f:
+                f.write(content)
     
     def delete(self):
         '''Deletes an exercise file.'''
         if not os.path.exists(self.getPathToFile()):
             return False
         os.remove(self.getPathToFile())
+        ExerciseFile._next_numbers.pop(self.group_path, None)
         try:
             os.rmdir(self.group_path)
             log.info("Removed group directory because it was empty: %s" % self.group_path)
@@ -485,14 +1517,16 @@ class ExerciseFile:
 
     def nextUrl(self):
         '''Returns the URL to the next exercise in the group.'''
-        if self.next():
-            return self.next().url()
+        next_exercise = self.next()
+        if next_exercise is not None:
+            return next_exercise.url()
         return None
 
     def previousUrl(self):
         '''Returns the URL to the previous exercise in the group.'''
-        if self.previous():
-            return self.previous().url()
+        previous_exercise = self.previous()
+        if previous_exercise is not None:
+            return previous_exercise.url()
         return None
 
     def previous(self):
@@ -502,15 +1536,13 @@ class ExerciseFile:
     def url(self):
         '''Returns the URL to the exercise.'''
         if self.group.course_id is None:
-            return reverse('lab:exercises', kwargs={
-                "group_name": self.group.name, 
-                "exercise_name": self.name
-            })
-        return reverse('lab:course-exercises', kwargs={
-                "course_id": self.group.course_id,
-                "group_name": self.group.name, 
-                "exercise_name": self.name           
-        })
+            return URLTemplate.get('lab:exercises').format(
+                group_name=self.group.name,
+                exercise_name=self.name)
+        return URLTemplate.get('lab:course-exercises').format(
+                course_id=self.group.course_id,
+                group_name=self.group.name,
+                exercise_name=self.name)
     
     def getName(self):
         '''Returns the name of the exercise file.'''
@@ -533,8 +1565,18 @@ class ExerciseFile:
         '''Returns the exercise as JSON.'''
         return json.dumps(self.asDict())
 
+    def setLoadError(self, error):
+        '''Records why the exercise couldn't be loaded (see asDict).'''
+        self.load_error = str(error)
+        log.warning("Error loading exercise %s: %s" % (self.getID(), error))
+
     def asDict(self):
-        '''Returns the exercise as Dict.'''
+        '''
+        Returns the exercise as Dict, or only its id and the error if it
+        couldn't be loaded.
+        '''
+        if self.load_error is not None:
+            return {"id": self.getID(), "error": self.load_error}
         d = {}
         if self.exerciseDefinition is not None:
             d.update(self.exerciseDefinition.getData())
@@ -554,19 +1596,46 @@ class ExerciseFile:
         return self.__str__()
 
     @staticmethod
-    def getNextFileName(group_path, group_size):
-        '''Generates the next file name for the group (numbers 01,02...99).'''
-        max_tries = 99
-        n = group_size + 1
-        file_name = "%s.json" % str(n).zfill(2)
-
-        while os.path.exists(os.path.join(group_path, file_name)):
-            n += 1
-            if n > max_tries:
-                raise Exception("unable to get next exercise file name after %d tries" % max_tries)
-            file_name = "%s.json" % str(n).zfill(2)
-
-        return file_name
+    def getSortKey(name):
+        '''
+        Returns the sort key of an exercise name. Numbered exercises sort by
+        number (so that 100 comes after 99) and before any other names.
+        '''
+        if name.isdigit():
+            return (0, int(name), name)
+        return (1, name.lower(), name)
+
+    @staticmethod
+    def getFileName(n):
+        '''Returns the file name for an exercise number (01,02...99,100...).'''
+        return "%s.json" % str(n).zfill(2)
+
+    @classmethod
+    def getGroupLock(cls, group_path):
+        '''Returns the lock that serializes new exercises in a group.'''
+        with cls._lock:
+            return cls._group_locks.setdefault(group_path, threading.Lock())
+
+    @classmethod
+    def createNext(cls, group, group_path, exercise_definition):
+        '''
+        Saves an exercise definition under the next free number in the group.
+        Within the process, new exercises in a group are serialized by a lock
+        and numbering continues where it left off. Across processes, the
+        exclusive save fails if another process took the number first, and
+        the next number is tried.
+        '''
+        with cls.getGroupLock(group_path):
+            n = max(group.size() + 1, cls._next_numbers.get(group_path, 1))
+            while True:
+                ef = ExerciseFile(cls.getFileName(n), group, group_path)
+                try:
+                    ef.save(exercise_definition, exclusive=True)
+                    break
+                except ExerciseFileExistsError:
+                    n += 1
+            cls._next_numbers[group_path] = n + 1
+        return ef
     
     @staticmethod
     def create(**kwargs):
@@ -575,25 +1644,153 @@ class ExerciseFile:
         group_name = kwargs.get('group_name', None)
         file_name = kwargs.get('file_name', None)
         exercise_definition = kwargs.get("exercise_definition", None)
-        
-        er = ExerciseFileRepository(course_id=course_id)
+        er = kwargs.get("repository", None)
+
+        if er is None:
+            er = ExerciseFileRepository(course_id=course_id)
         group = er.findGroup(group_name)
         if group is None:
             group_name = re.sub(r'[^a-zA-Z0-9._\-]', r'', group_name) # scrub group name
             group = ExerciseGroup(group_name, course_id=course_id)
 
-        group_size = group.size()
         group_path = os.path.join(ExerciseFileRepository.getBasePath(course_id), group_name)
 
         if file_name is None:
-            file_name = ExerciseFile.getNextFileName(group_path, group_size)
-        
-        ef = ExerciseFile(file_name, group, group_path)
-        ef.save(exercise_definition)
+            ef = ExerciseFile.createNext(group, group_path, exercise_definition)
+            file_name = ef.file_name
+        else:
+            ef = ExerciseFile(file_name, group, group_path)
+            ef.save(exercise_definition)
         log.info("Created exercise. Course: %s Group: %s File: %s Path: %s" % (course_id, group_path, file_name, ef.getPathToFile()))
 
         return ef
 
+class ExerciseRecord(ExerciseFile):
+    '''
+    ExerciseRecord is the ExerciseFile counterpart for exercises stored in
+    the database by ExerciseDatabaseRepository. It only knows the primary key
+    and last update time of its row until load() is called.
+    '''
+    def __init__(self, exercise_name, group, pk, updated=None):
+        ExerciseFile.__init__(self, "%s.json" % exercise_name, group, None)
+        self.name = exercise_name
+        self.pk = pk
+        self.updated = updated
+
+    def getPathToFile(self):
+        return None
+
+    @timed('load')
+    def load(self):
+        '''
+        Loads the ExerciseDefinition from the database. The parsed definition
+        is taken from the ExerciseDefinitionCache if the row hasn't changed
+        since it was last parsed.
+        '''
+        ExerciseRecord.loadAll([self])
+        if self.load_error is not None:
+            raise ExerciseFileError("Error loading exercise %s: %s" % (self.getID(), self.load_error))
+        return True
+
+    @staticmethod
+    def loadAll(records):
+        '''
+        Loads the ExerciseDefinitions of records, reading the rows of those
+        that aren't in the ExerciseDefinitionCache with a single query. A
+        record whose row is missing or invalid gets a load_error instead.
+        '''
+        cache = ExerciseDefinitionCache.getInstance()
+        missing = []
+        for record in records:
+            EXERCISE_LOADS.inc(repository="database")
+            record.load_error = None
+            exercise_definition = None
+            if record.updated is not None:
+                exercise_definition = cache.get("exercise:%s" % record.pk, record.updated)
+            if exercise_definition is None:
+                missing.append(record)
+            else:
+                record.exerciseDefinition = exercise_definition
+        if len(missing) == 0:
+            return
+        rows = ExerciseModel.objects.filter(pk__in=[r.pk for r in missing]).values_list('id', 'definition', 'updated')
+        rows = dict([(pk, (definition, updated)) for pk, definition, updated in rows])
+        for record in missing:
+            if record.pk not in rows:
+                record.setLoadError("Exercise does not exist")
+                continue
+            definition, record.updated = rows[record.pk]
+            try:
+                record.exerciseDefinition = ExerciseDefinition.fromJSON(definition)
+            except ValueError as e:
+                record.setLoadError(e)
+                continue
+            cache.set("exercise:%s" % record.pk, record.updated, record.exerciseDefinition)
+
+    def save(self, exercise_definition):
+        '''Saves an ExerciseDefinition to the database.'''
+        if exercise_definition is not None:
+            self.exerciseDefinition = exercise_definition
+        elif self.exerciseDefinition is None:
+            raise ExerciseFileError("No exercise definition to save.")
+
+        if not self.exerciseDefinition.isValid():
+            return False
+
+        self.updated = timezone.now()
+        ExerciseModel.objects.filter(pk=self.pk).update(definition=self.exerciseDefinition.asJSON(), updated=self.updated)
+        return True
+
+    def delete(self):
+        '''Deletes the exercise from the database.'''
+        ExerciseModel.objects.filter(pk=self.pk).delete()
+        return True
+
+class ExerciseCursorError(ValueError):
+    pass
+
+class ExerciseCursor(object):
+    '''
+    Cursor-based pagination over groups or exercises in their sort order.
+
+    A cursor is an opaque token holding the sort key of the last item on the
+    previous page, so pages stay stable when items are added or removed. The
+    start of a page is found by binary search on the sorted keys, so fetching
+    page N doesn't look at any of the items on the pages before it.
+
+    Usage:
+        groups, keys = repo.getSortedGroups()
+        page, next_cursor = ExerciseCursor.paginate(groups, keys, cursor, 50)
+    '''
+    @staticmethod
+    def encode(key):
+        return base64.urlsafe_b64encode(json.dumps(key))
+
+    @staticmethod
+    def decode(cursor):
+        try:
+            key = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError, UnicodeEncodeError):
+            raise ExerciseCursorError("Invalid cursor: %s" % cursor)
+        if not isinstance(key, list):
+            raise ExerciseCursorError("Invalid cursor: %s" % cursor)
+        return tuple(key)
+
+    @staticmethod
+    def paginate(items, keys, cursor=None, limit=None):
+        '''
+        Returns a (page, next_cursor) tuple for the page of items following
+        the cursor. The next cursor is None on the last page.
+        '''
+        start = 0
+        if cursor is not None:
+            start = bisect.bisect_right(keys, ExerciseCursor.decode(cursor))
+        end = len(items) if limit is None else start + limit
+        next_cursor = None
+        if end < len(items):
+            next_cursor = ExerciseCursor.encode(keys[end - 1])
+        return items[start:end], next_cursor
+
 class ExerciseGroup:
     '''
     Exercises belong to groups, so this object is a container
@@ -606,13 +1803,28 @@ class ExerciseGroup:
         if self.name.startswith('/'):
             self.name = self.name[1:]
         self.exercises = []
+        self.exercise_index = {}
+        self.sort_keys = None
+        self.exercise_list = None
         
     def size(self):
         return len(self.exercises)    
 
     def add(self, exercises):
-        self.exercises.extend(exercises)
+        self.sort_keys = None
+        self.exercise_list = None
+        for exercise in exercises:
+            exercise.position = len(self.exercises)
+            self.exercises.append(exercise)
+            self.exercise_index.setdefault(exercise.name, exercise)
         return self
+
+    def indexOf(self, exercise):
+        '''Returns the position of an exercise in the group, or None.'''
+        position = exercise.position
+        if position is not None and position < len(self.exercises) and self.exercises[position] is exercise:
+            return position
+        return None
     
     def delete(self):
         for exercise in self.exercises:
@@ -620,8 +1832,8 @@ class ExerciseGroup:
 
     def url(self):
         if self.course_id is None:
-            return reverse('lab:exercise-groups', kwargs={"group_name": self.name})
-        return reverse('lab:course-exercise-groups', kwargs={"group_name": self.name, "course_id": self.course_id})
+            return URLTemplate.get('lab:exercise-groups').format(group_name=self.name)
+        return URLTemplate.get('lab:course-exercise-groups').format(group_name=self.name, course_id=self.course_id)
 
     def first(self):
         if len(self.exercises) > 0:
@@ -634,46 +1846,83 @@ class ExerciseGroup:
         return None
 
     def next(self, exercise):
-        if exercise in self.exercises:
-            index = self.exercises.index(exercise)
-            if index < len(self.exercises) - 1:
-                return self.exercises[index + 1]
+        index = self.indexOf(exercise)
+        if index is not None and index < len(self.exercises) - 1:
+            return self.exercises[index + 1]
         return None
 
     def previous(self, exercise):
-        if exercise in self.exercises:
-            index = self.exercises.index(exercise)
-            if index > 0:
-                return self.exercises[index - 1]
+        index = self.indexOf(exercise)
+        if index is not None and index > 0:
+            return self.exercises[index - 1]
         return None
 
     def findExercise(self, exercise_name):
-        for e in self.exercises:
-            if exercise_name == e.name:
-                return e
-        return None
+        return self.exercise_index.get(exercise_name, None)
 
-    def getList(self):
-        exercise_list = []
-        for e in self.exercises:
-            d = e.asDict()
-            exercise_list.append({
-                "id": d['id'],
-                "name": d['name'], 
-                "url": d['url'],
-                "selected": d['selected']
-            })
+    def getSortKey(self):
+        return (self.name.lower(), self.name)
+
+    def getSortKeys(self):
+        '''Returns the sort keys of the exercises, for use with ExerciseCursor.'''
+        if self.sort_keys is None:
+            self.sort_keys = [ExerciseFile.getSortKey(e.name) for e in self.exercises]
+        return self.sort_keys
+
+    def getList(self, selected=None):
+        '''
+        Returns the list of exercises for navigation (id, name, url and
+        selected), with the given exercise selected, or else the exercises
+        whose selected attribute is set.
+        '''
+        exercise_list = list(self.getExerciseList())
+        if selected is not None:
+            positions = [self.indexOf(selected)]
+        else:
+            positions = [i for i, e in enumerate(self.exercises) if e.selected]
+        for i in positions:
+            if i is not None:
+                exercise_list[i] = dict(exercise_list[i], selected=True)
         return exercise_list
 
+    def getExerciseList(self):
+        '''
+        Returns the navigation list with no exercise selected. It is built
+        without loading or copying the exercises, and is shared through the
+        ExerciseListCache, so it must be treated as read-only.
+        '''
+        if self.exercise_list is None:
+            names = tuple([e.name for e in self.exercises])
+            key = (self.course_id, self.name)
+            stamp = (urlresolvers.get_urlconf(), urlresolvers.get_script_prefix(), names)
+            cache = ExerciseListCache.getInstance()
+            exercise_list = cache.get(key, stamp)
+            if exercise_list is None:
+                exercise_list = tuple([{
+                    "id": e.getID(),
+                    "name": e.name,
+                    "url": e.url(),
+                    "selected": False,
+                } for e in self.exercises])
+                cache.set(key, stamp, exercise_list)
+            self.exercise_list = exercise_list
+        return self.exercise_list
+
     def asJSON(self):
         return json.dumps(self.asDict())
 
-    def asDict(self):
+    def asDict(self, lazy=False, exercises=None):
+        if exercises is None:
+            exercises = self.exercises
+        if lazy:
+            exercises = (e.asDict() for e in exercises)
+        else:
+            exercises = [e.asDict() for e in exercises]
         return {
             "name": self.name,
             "url": self.url(),
             "data": {
-                "exercises": [e.asDict() for e in self.exercises]
+                "exercises": exercises
             }
         }
 
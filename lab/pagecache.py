@@ -0,0 +1,87 @@
+'''
+Cache of the HTML of the exercise pages (PlayView and ExerciseView) in the
+cache framework.
+
+A page only depends on its URL (course, group and exercise), on whether the
+user may manage the course's exercises, on the require.js config (the build
+in data/requirejs/build.json) and on the version of the course's exercises,
+so those make up the cache key. Any write to the repository changes its
+version, and a new require.js build changes the config, so entries never
+go stale; PAGE_CACHE_TIMEOUT only bounds how long unused pages are kept.
+
+Only the content of the page is cached. Each response is a new HttpResponse,
+so the session cookie and headers that middleware adds for the current user
+are never shared between users.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.decorators import available_attrs
+
+from .objects import ExerciseRepository
+from .requirejs import RequirejsContext
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+from functools import wraps
+import hashlib
+
+class PageCache(object):
+    KEY_PREFIX = 'lab:page'
+
+    def __init__(self, request, course_id=None, manage_perm=False):
+        self.request = request
+        self.course_id = course_id
+        self.manage_perm = bool(manage_perm)
+        self.timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+
+    def isEnabled(self):
+        return self.timeout != 0 and self.request.method in ('GET', 'HEAD')
+
+    def getKey(self):
+        inputs = (
+            self.request.path,
+            self.manage_perm,
+            RequirejsContext.getBuildVersion(settings.REQUIREJS_CONFIG, settings.REQUIREJS_DEBUG),
+            ExerciseRepository.getVersion(course_id=self.course_id)[0],
+        )
+        return "%s:%s" % (self.KEY_PREFIX, hashlib.sha1(repr(inputs)).hexdigest())
+
+    def get(self, key):
+        '''Returns a response with the cached page, or None.'''
+        page = cache.get(key)
+        if page is None:
+            CACHE_MISSES.inc(cache="page")
+            return None
+        CACHE_HITS.inc(cache="page")
+        content, content_type = page
+        return HttpResponse(content, content_type=content_type)
+
+    def set(self, key, response):
+        '''Caches the page of a successful response.'''
+        if response.status_code != 200 or response.streaming:
+            return
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        cache.set(key, (response.content, response['Content-Type']), self.timeout)
+
+def page_cache(get_manage_perm):
+    '''
+    Returns a decorator that caches the page of a view (see PageCache).
+    get_manage_perm(request, course_id) returns true if the user may manage
+    the course, which changes the page.
+    '''
+    def decorator(view):
+        @wraps(view, assigned=available_attrs(view))
+        def _wrapper(request, *args, **kwargs):
+            course_id = kwargs.get('course_id', None)
+            page_cache = PageCache(request, course_id, get_manage_perm(request, course_id))
+            if not page_cache.isEnabled():
+                return view(request, *args, **kwargs)
+            key = page_cache.getKey()
+            response = page_cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                page_cache.set(key, response)
+            return response
+        return _wrapper
+    return decorator
@@ -0,0 +1,85 @@
+from .timing import timed
+
+import hashlib
+import json
+import threading
+
+class RequirejsContext(object):
+    '''
+    The require.js config of a page: the base config (REQUIREJS_CONFIG),
+    plus the module params set by the view, which are layered on top of the
+    "config" section of the base config when the page is rendered.
+
+    The base config is shared by all requests and is never modified. All of
+    it except the "config" section is encoded once per process, so a page
+    only encodes its module params.
+    '''
+    _base_json = {}
+    _base_json_lock = threading.Lock()
+    _build_versions = {}
+
+    def __init__(self, config, debug=True):
+        self._debug = debug
+        self._config = config
+        self._module_params = {}
+
+    def set_module_params(self, module_id, params):
+        self._module_params.setdefault(module_id, {}).update(params)
+        return self
+
+    def set_app_module(self, app_module_id):
+        self.set_module_params('app/main', {'app_module': app_module_id})
+        return self
+
+    def add_to_view(self, view_context):
+        view_context['requirejs'] = self
+        return self
+
+    def debug(self):
+        if self._debug:
+            return True
+        return False
+
+    @classmethod
+    def getBaseJSON(cls, config):
+        '''
+        Returns the JSON of a base config without its "config" section and
+        closing brace, so that the section can be appended.
+        '''
+        key = id(config)
+        cached = cls._base_json.get(key, None)
+        if cached is None or cached[0] is not config:
+            base = dict([(k, v) for k, v in config.iteritems() if k != 'config'])
+            base_json = json.dumps(base)[:-1]
+            if base:
+                base_json += ', '
+            cached = (config, base_json)
+            with cls._base_json_lock:
+                cls._base_json[key] = cached
+        return cached[1]
+
+    @classmethod
+    def getBuildVersion(cls, config, debug=True):
+        '''
+        Returns a hash of a base config, which names the build of main.js
+        (if any), for use in cache keys. It is computed once per config.
+        '''
+        key = (id(config), debug)
+        cached = cls._build_versions.get(key, None)
+        if cached is None or cached[0] is not config:
+            cached = (config, hashlib.sha1(json.dumps([config, debug], sort_keys=True)).hexdigest())
+            cls._build_versions[key] = cached
+        return cached[1]
+
+    def get_config(self):
+        '''Returns the "config" section of the base config with the module params merged in.'''
+        config = dict(self._config.get('config', {}))
+        for module_id, params in self._module_params.iteritems():
+            module_config = dict(config.get(module_id, {}))
+            module_config.update(params)
+            config[module_id] = module_config
+        return config
+
+    @timed('requirejs')
+    def config_json(self):
+        return '%s"config": %s}' % (self.getBaseJSON(self._config), json.dumps(self.get_config()))
@@ -0,0 +1,74 @@
+import unittest
+import json
+from mock import patch
+
+from .. import encoders
+from ..encoders import StreamingJSONEncoder, MessagePackEncoder
+
+class StreamingJSONEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = {
+            "course_id": None,
+            "data": {
+                "groups": [
+                    {"name": "groupA", "data": {"exercises": [{"id": "groupA/01", "chord": [[60, 64], []]}]}},
+                    {"name": "groupB", "data": {"exercises": []}},
+                ],
+                "empty": [],
+            }
+        }
+
+    def lazy(self, doc):
+        '''Returns the test document with the lists of groups and exercises as generators.'''
+        groups = doc['data']['groups']
+        lazy_doc = dict(doc)
+        lazy_doc['data'] = dict(doc['data'])
+        lazy_doc['data']['empty'] = (x for x in [])
+        lazy_doc['data']['groups'] = ({
+            "name": g['name'],
+            "data": {"exercises": (e for e in g['data']['exercises'])}
+        } for g in groups)
+        return lazy_doc
+
+    def test_matches_json_dumps(self):
+        options = [
+            {"sort_keys": True},
+            {"sort_keys": True, "indent": 4, "separators": (',', ': ')},
+            {"sort_keys": True, "separators": (',', ':')},
+        ]
+        for kwargs in options:
+            expected = json.dumps(self.doc, **kwargs)
+            actual = StreamingJSONEncoder(**kwargs).encode(self.lazy(self.doc))
+            self.assertEqual(expected, actual, "options: %s" % kwargs)
+
+    def test_chunks(self):
+        encoder = StreamingJSONEncoder(chunk_size=16)
+        chunks = list(encoder.iterencode(self.lazy(self.doc)))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(self.doc, json.loads(''.join(chunks)))
+
+class MessagePackEncoderTest(unittest.TestCase):
+    def pack(self, obj):
+        with patch.object(encoders, 'msgpack', None):
+            return MessagePackEncoder().encode(obj)
+
+    def test_scalars(self):
+        self.assertEqual(b'\xc0', self.pack(None))
+        self.assertEqual(b'\xc3', self.pack(True))
+        self.assertEqual(b'\xc2', self.pack(False))
+        self.assertEqual(b'\x01', self.pack(1))
+        self.assertEqual(b'\xff', self.pack(-1))
+        self.assertEqual(b'\xcd\x01\x2c', self.pack(300))
+        self.assertEqual(b'\xd1\xff\x38', self.pack(-200))
+        self.assertEqual(b'\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00', self.pack(1.5))
+        self.assertEqual(b'\xa2ab', self.pack(u'ab'))
+        self.assertEqual(b'\xda\x00\x28' + b'x' * 40, self.pack('x' * 40))
+
+    def test_containers(self):
+        self.assertEqual(b'\x81\xa1a\x93\x01\x02\x03', self.pack({"a": [1, 2, 3]}))
+        self.assertEqual(b'\x81\xa1a\x93\x01\x02\x03', self.pack({"a": (x for x in [1, 2, 3])}))
+
+    @unittest.skipIf(encoders.msgpack is None, "msgpack is not installed")
+    def test_matches_msgpack(self):
+        doc = {"groups": [{"name": u"groupA", "size": 70000, "chord": [[-40, 2 ** 40], []], "x": None}]}
+        self.assertEqual(encoders.msgpack.packb(doc, use_bin_type=False), self.pack(doc))
@@ -0,0 +1,90 @@
+import unittest
+import os
+import shutil
+import tempfile
+from django.test.utils import override_settings
+
+from ..metrics import collector, MetricsCollector, Counter, Histogram
+from ..objects import ExerciseDefinitionCache
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.collector = MetricsCollector()
+        self.collector.configured = True
+        self.collector.enabled = True
+        self.collector.path = None
+        self.collector.flush_interval = 60
+        self.addCleanup(self.collector.reset) # cancels the flush timer
+        self.counter = Counter('test_total', 'Test counter.', ['kind'])
+        self.histogram = Histogram('test_seconds', 'Test histogram.', ['kind'], buckets=[0.1, 1])
+        for metric in (self.counter, self.histogram):
+            del collector.metrics[metric.name]
+            self.collector.register(metric)
+
+    def update(self):
+        from .. import metrics
+        original = metrics.collector
+        metrics.collector = self.collector
+        try:
+            self.counter.inc(kind="a")
+            self.counter.inc(2, kind="a")
+            self.counter.inc(kind='b"')
+            self.histogram.observe(0.05, kind="a")
+            self.histogram.observe(0.5, kind="a")
+            self.histogram.observe(5, kind="a")
+        finally:
+            metrics.collector = original
+
+    def test_render(self):
+        self.update()
+        self.assertEqual(self.collector.render().splitlines(), [
+            '# HELP test_total Test counter.',
+            '# TYPE test_total counter',
+            'test_total{kind="a"} 3',
+            'test_total{kind="b\\""} 1',
+            '# HELP test_seconds Test histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{kind="a",le="0.1"} 1',
+            'test_seconds_bucket{kind="a",le="1"} 2',
+            'test_seconds_bucket{kind="a",le="+Inf"} 3',
+            'test_seconds_sum{kind="a"} 5.55',
+            'test_seconds_count{kind="a"} 3',
+        ])
+
+    def test_labels_required(self):
+        self.assertRaises(ValueError, self.counter.getKey, {})
+
+    def test_processes_aggregated(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.collector.path = path
+        self.update()
+        self.collector.flush()
+
+        # another worker process, with its own file in the same directory
+        self.collector.reset()
+        self.update()
+
+        lines = self.collector.render().splitlines()
+        self.assertIn('test_total{kind="a"} 6', lines)
+        self.assertIn('test_seconds_bucket{kind="a",le="1"} 4', lines)
+        self.assertIn('test_seconds_count{kind="a"} 6', lines)
+        self.assertEqual(2, len(os.listdir(path)))
+
+    def test_cache_hits_counted(self):
+        with override_settings(METRICS_ENABLED=True, METRICS_DIR=None):
+            collector.clear()
+            cache = ExerciseDefinitionCache(10)
+            cache.set("a", 1, "definition")
+            cache.get("a", 1)
+            cache.get("a", 2)
+            lines = collector.render().splitlines()
+        collector.clear()
+        self.assertIn('harmonylab_cache_hits_total{cache="exercise_definition"} 1', lines)
+        self.assertIn('harmonylab_cache_misses_total{cache="exercise_definition"} 1', lines)
+
+    def test_disabled(self):
+        with override_settings(METRICS_ENABLED=False):
+            self.assertFalse(collector.isEnabled())
+            ExerciseDefinitionCache(10).get("a", 1)
+            self.assertEqual({}, collector.snapshot().get('harmonylab_cache_misses_total', {}))
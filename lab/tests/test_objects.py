@@ -1,10 +1,550 @@
 import unittest
+import tempfile
+import shutil
+import os
+import json
+import threading
+import errno
+from mock import patch
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.cache import cache
 
-from ..objects import ExerciseLilyPond
+from ..objects import ExerciseLilyPond, ExerciseLilyPondFile, ExerciseLilyPondError, ExerciseLilyPondCache, ExerciseListCache, ExerciseFileIndex, ExerciseFileManifest, ExerciseDefinitionCache
+from ..objects import ExerciseRepository, ExerciseFileRepository, ExerciseGroup, ExerciseFile, ExerciseDefinition, ExerciseFileExistsError
+from ..objects import ExerciseCursor, ExerciseCursorError
+from ..objects import ExerciseDatabaseRepository, ExerciseRecord, ExerciseFileError
+from ..models import Exercise as ExerciseModel
+from ..encoders import StreamingJSONEncoder
 
 class ExerciseRepositoryTest(unittest.TestCase):
     def setUp(self):
-        pass
+        self.repo = ExerciseRepository()
+        for group_name in ('groupA', 'groupB'):
+            group = ExerciseGroup(group_name)
+            group.add([ExerciseFile(f, group, '') for f in ('01.json', '02.json', '03.json')])
+            self.repo.addGroup(group)
+
+    def test_find_group(self):
+        self.assertEqual('groupB', self.repo.findGroup('groupB').name)
+        self.assertIsNone(self.repo.findGroup('groupC'))
+
+    def test_find_exercise(self):
+        self.assertEqual(['groupA/02', 'groupB/02'], [e.getID() for e in self.repo.findExercise('02')])
+        self.assertEqual([], self.repo.findExercise('04'))
+
+    def test_as_dict_lazy(self):
+        with patch.object(ExerciseFile, 'url', lambda ef: '/' + ef.getID()):
+            with patch.object(ExerciseGroup, 'url', lambda g: '/' + g.name):
+                expected = json.dumps(self.repo.asDict(), sort_keys=True)
+                actual = StreamingJSONEncoder(sort_keys=True).encode(self.repo.asDict(lazy=True))
+        self.assertEqual(expected, actual)
+
+    def test_iter_loaded_groups(self):
+        group_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, group_path)
+        repo = ExerciseRepository()
+        for group_name in ('groupA', 'groupB'):
+            os.makedirs(os.path.join(group_path, group_name))
+            group = ExerciseGroup(group_name)
+            exercises = []
+            for file_name in ('01.json', '02.json'):
+                with open(os.path.join(group_path, group_name, file_name), 'w') as f:
+                    f.write('{"introText": "%s %s"}' % (group_name, file_name))
+                exercises.append(ExerciseFile(file_name, group, os.path.join(group_path, group_name)))
+            repo.addGroup(group.add(exercises))
+
+        groups = list(repo.iterLoadedGroups())
+        self.assertEqual(['groupA', 'groupB'], [g.name for g in groups])
+        self.assertEqual('groupB 02.json', groups[1].exercises[1].exerciseDefinition.getData()['introText'])
+        self.assertIs(ExerciseRepository.getLoadPool(), ExerciseRepository.getLoadPool())
+
+    def test_iter_loaded_groups_with_invalid_file(self):
+        group_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, group_path)
+        repo = ExerciseRepository()
+        group = ExerciseGroup('groupA')
+        for file_name, content in (('01.json', '{"introText": "ok"}'), ('02.json', '{"introText": "trailing",}')):
+            with open(os.path.join(group_path, file_name), 'w') as f:
+                f.write(content)
+        repo.addGroup(group.add([ExerciseFile(f, group, group_path) for f in ('01.json', '02.json', '03.json')]))
+
+        with patch.object(ExerciseFile, 'url', lambda ef: '/' + ef.getID()), patch.object(ExerciseGroup, 'url', lambda g: '/' + g.name):
+            data = json.loads(StreamingJSONEncoder().encode({"groups": (g.asDict(lazy=True) for g in repo.iterLoadedGroups())}))
+        exercises = data['groups'][0]['data']['exercises']
+        self.assertEqual("ok", exercises[0]['introText'])
+        self.assertEqual(['error', 'id'], sorted(exercises[1].keys()))
+        self.assertEqual('groupA/02', exercises[1]['id'])
+        self.assertEqual('groupA/03', exercises[2]['id'])
+        self.assertIn('error', exercises[2])
+
+    def test_load_exercise_closes_connection(self):
+        exercise = self.repo.exercises[0]
+        with patch.object(exercise, 'load') as load, patch('lab.objects.connection') as connection:
+            ExerciseRepository.loadExercise(exercise)
+        self.assertTrue(load.called)
+        self.assertTrue(connection.close.called)
+
+    def test_find_exercise_by_group(self):
+        self.assertEqual('groupB/03', self.repo.findExerciseByGroup('groupB', '03').getID())
+        self.assertIsNone(self.repo.findExerciseByGroup('groupB', '04'))
+        self.assertIsNone(self.repo.findExerciseByGroup('groupC', '01'))
+
+class ExerciseCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.items = ['a', 'B', 'c', 'D', 'e']
+        self.keys = [(x.lower(), x) for x in self.items]
+
+    def test_paginate(self):
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = ExerciseCursor.paginate(self.items, self.keys, cursor, 2)
+            pages.append(page)
+            if cursor is None:
+                break
+        self.assertEqual([['a', 'B'], ['c', 'D'], ['e']], pages)
+
+    def test_paginate_without_limit(self):
+        self.assertEqual((self.items, None), ExerciseCursor.paginate(self.items, self.keys))
+
+    def test_cursor_is_stable(self):
+        page, cursor = ExerciseCursor.paginate(self.items, self.keys, None, 2)
+        items = ['a', 'b2', 'c'] # 'B' was removed and 'b2' was added
+        keys = [(x.lower(), x) for x in items]
+        self.assertEqual((['b2', 'c'], None), ExerciseCursor.paginate(items, keys, cursor, 2))
+
+    def test_invalid_cursor(self):
+        self.assertRaises(ExerciseCursorError, ExerciseCursor.decode, 'not a cursor')
+        self.assertRaises(ExerciseCursorError, ExerciseCursor.decode, ExerciseCursor.encode({"a": 1}))
+
+class ExerciseGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.group = ExerciseGroup('groupA')
+        self.group.add([ExerciseFile(f, self.group, '') for f in ('01.json', '02.json', '03.json')])
+
+    def test_next_previous(self):
+        first, second, third = self.group.exercises
+        self.assertIs(second, first.next())
+        self.assertIs(third, second.next())
+        self.assertIsNone(third.next())
+        self.assertIs(second, third.previous())
+        self.assertIsNone(first.previous())
+
+    def test_next_previous_not_in_group(self):
+        other = ExerciseGroup('groupB')
+        other.add([ExerciseFile('01.json', other, '')])
+        self.assertIsNone(self.group.next(other.first()))
+        self.assertIsNone(self.group.previous(other.first()))
+
+    def test_get_list(self):
+        cache = ExerciseListCache(10)
+        with patch.object(ExerciseListCache, '_instance', cache), patch.object(ExerciseFile, 'url', lambda ef: '/' + ef.getID()):
+            second = self.group.exercises[1]
+            expected = [{"id": e.getID(), "name": e.name, "url": e.url(), "selected": e is second} for e in self.group.exercises]
+            self.assertEqual(expected, self.group.getList(selected=second))
+            second.selected = True
+            self.assertEqual(expected, self.group.getList())
+
+            # shared by other instances of the group until its exercises change
+            group = ExerciseGroup('groupA')
+            group.add([ExerciseFile(f, group, '') for f in ('01.json', '02.json', '03.json')])
+            self.assertIs(self.group.getExerciseList(), group.getExerciseList())
+            self.assertFalse(any([e['selected'] for e in group.getList()]))
+            group.add([ExerciseFile('04.json', group, '')])
+            self.assertEqual(['01', '02', '03', '04'], [e['name'] for e in group.getList()])
+            self.assertEqual(1, cache.stats()['hits'])
+
+class ExerciseFileCreateTest(unittest.TestCase):
+    def setUp(self):
+        self.group_path = os.path.join(tempfile.mkdtemp(), 'groupA')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.group_path))
+        self.group = ExerciseGroup('groupA')
+
+    def createNext(self):
+        return ExerciseFile.createNext(self.group, self.group_path, ExerciseDefinition({"type": "matching"}))
+
+    def test_create_next(self):
+        self.assertEqual('01.json', self.createNext().file_name)
+        second = self.createNext()
+        self.assertEqual('02.json', second.file_name)
+        second.delete()
+        self.assertEqual('02.json', self.createNext().file_name)
+        self.assertEqual(['01.json', '02.json'], sorted(os.listdir(self.group_path)))
+
+    def test_create_next_skips_taken_names(self):
+        os.makedirs(self.group_path)
+        for file_name in ('01.json', '02.json'):
+            with open(os.path.join(self.group_path, file_name), 'w') as f:
+                f.write('{}')
+        self.assertEqual('03.json', self.createNext().file_name)
+        with open(os.path.join(self.group_path, '02.json')) as f:
+            self.assertEqual('{}', f.read())
+
+    def test_create_next_concurrently(self):
+        results = []
+        def create():
+            for i in range(30):
+                results.append(self.createNext().file_name)
+        threads = [threading.Thread(target=create) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(120, len(set(results)))
+        self.assertEqual(sorted(results), sorted(os.listdir(self.group_path)))
+        self.assertIn('120.json', results)
+
+    def test_create_next_without_hard_links(self):
+        def link(src, dst):
+            raise OSError(errno.EPERM, "Operation not permitted")
+        with patch('os.link', link):
+            self.assertEqual('01.json', self.createNext().file_name)
+            ef = ExerciseFile('01.json', self.group, self.group_path)
+            self.assertRaises(ExerciseFileExistsError, ef.save, ExerciseDefinition({"type": "matching"}), exclusive=True)
+            self.assertEqual('02.json', self.createNext().file_name)
+        ef.load()
+        self.assertEqual({"type": "matching"}, ef.exerciseDefinition.getData())
+        self.assertEqual(['01.json', '02.json'], sorted(os.listdir(self.group_path)))
+
+    def test_sort_key(self):
+        names = ['100', 'b', '99', 'A', '01']
+        self.assertEqual(['01', '99', '100', 'A', 'b'], sorted(names, key=ExerciseFile.getSortKey))
+
+class ExerciseFileRepositoryCreateTest(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        for patcher in (patch.object(ExerciseFileRepository, 'BASE_PATH', self.base_path),
+                        patch.object(ExerciseFile, 'url', lambda ef: '/' + ef.getID()),
+                        patch.object(ExerciseGroup, 'url', lambda g: '/' + g.name)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_create_exercises(self):
+        data = [
+            {"group_name": "groupA", "lilypond_chords": "<c e g>"},
+            {"group_name": "groupB", "lilypond_chords": "<x>"},
+            {"group_name": "groupB"},
+            {"lilypond_chords": "<c e g>"},
+            {"group_name": "groupA"},
+        ]
+        with patch.object(ExerciseFileRepository, 'findFiles', autospec=True, side_effect=ExerciseFileRepository.findFiles) as find_files:
+            results = ExerciseFileRepository().createExercises(data)
+            self.assertEqual(1, find_files.call_count)
+
+        self.assertEqual(["success", "error", "success", "error", "success"], [r['status'] for r in results])
+        self.assertEqual(['/groupA/01', '/groupB/01', '/groupA/02'], [r['data']['url'] for r in results if 'data' in r])
+        self.assertEqual(['groupA/01', 'groupA/02', 'groupB/01'], sorted([e.getID() for e in ExerciseFileRepository().exercises]))
+
+    def test_create_exercise(self):
+        result = ExerciseFileRepository().createExercise({"group_name": "group A!"})
+        self.assertEqual('/groupA/01', result['data']['url'])
+        self.assertEqual(["Missing group name."], ExerciseFileRepository().createExercise({})['errors'])
+
+class ExerciseFileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = ExerciseFileIndex(self.path)
+        self.addExercise('groupB', '01.json')
+        self.addExercise('groupA', '02.json')
+        self.addExercise('groupA', '01.json')
+        self.setMtimes(1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def addExercise(self, group_name, file_name):
+        group_path = os.path.join(self.path, group_name)
+        if not os.path.exists(group_path):
+            os.makedirs(group_path)
+        with open(os.path.join(group_path, file_name), 'w') as f:
+            f.write('{}')
+
+    def setMtimes(self, mtime):
+        for root, dirs, files in os.walk(self.path):
+            for path in [root] + [os.path.join(root, f) for f in files]:
+                os.utime(path, (mtime, mtime))
+
+    def test_listing(self):
+        listing = dict(self.index.getListing())
+        self.assertEqual(['01.json', '02.json'], listing[os.path.join(self.path, 'groupA')])
+        self.assertEqual(['01.json'], listing[os.path.join(self.path, 'groupB')])
+
+    def test_listing_is_reused(self):
+        listing = self.index.getListing()
+        self.assertIs(listing, self.index.getListing())
+
+    def test_listing_changes_with_directory(self):
+        listing = self.index.getListing()
+        self.addExercise('groupB', '02.json')
+        self.setMtimes(2000)
+        listing = dict(self.index.getListing())
+        self.assertEqual(['01.json', '02.json'], listing[os.path.join(self.path, 'groupB')])
+
+    def test_version(self):
+        version, last_modified = self.index.getVersion()
+        self.assertEqual(1000, last_modified)
+        self.assertEqual(version, ExerciseFileIndex(self.path).getVersion()[0])
+        self.addExercise('groupA', '03.json')
+        self.setMtimes(2000)
+        self.assertNotEqual(version, self.index.getVersion()[0])
+        self.assertEqual(2000, self.index.getVersion()[1])
+
+    def test_files_not_checked_by_default(self):
+        version = self.index.getVersion()[0]
+        with patch.object(ExerciseFileIndex, 'getFileStats', return_value=()) as getFileStats:
+            self.assertEqual(version, self.index.getVersion()[0])
+        getFileStats.assert_called_once_with(())
+
+    @override_settings(EXERCISE_INDEX_FILE_STATS=True)
+    def test_version_changes_with_file(self):
+        version, last_modified = self.index.getVersion()
+        # rewritten in place, which doesn't change the directory's mtime
+        with open(os.path.join(self.path, 'groupA', '01.json'), 'w') as f:
+            f.write('{"type": "matching"}')
+        self.setMtimes(1000)
+        self.assertNotEqual(version, self.index.getVersion()[0])
+        version = self.index.getVersion()[0]
+        os.utime(os.path.join(self.path, 'groupA', '01.json'), (2000, 2000))
+        self.assertNotEqual(version, self.index.getVersion()[0])
+        self.assertEqual(2000, self.index.getVersion()[1])
+
+    def test_invalidate(self):
+        listing = self.index.getListing()
+        self.index.clear()
+        self.assertIsNot(listing, self.index.getListing())
+
+class ExerciseFileManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(ExerciseFileRepository, 'BASE_PATH', self.base_path),
+            patch.object(ExerciseFile, 'url', lambda ef: '/' + ef.getID()),
+            patch.object(ExerciseGroup, 'url', lambda g: '/' + g.name),
+        ]
+        for p in self.patches:
+            p.start()
+        self.manifest = ExerciseFileManifest()
+        for file_name in ('02.json', '01.json'):
+            self.addExercise('groupA', file_name)
+        self.setMtimes(1000)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.base_path)
+
+    def addExercise(self, group_name, file_name):
+        group_path = os.path.join(self.manifest.path, group_name)
+        if not os.path.exists(group_path):
+            os.makedirs(group_path)
+        with open(os.path.join(group_path, file_name), 'w') as f:
+            f.write('{"type": "matching"}')
+
+    def setMtimes(self, mtime):
+        for root, dirs, files in os.walk(self.manifest.path):
+            for path in [root] + [os.path.join(root, f) for f in files]:
+                os.utime(path, (mtime, mtime))
+
+    def test_build(self):
+        data = self.manifest.build()
+        self.assertEqual(['groupA'], [g['name'] for g in data['groups']])
+        exercises = data['groups'][0]['exercises']
+        self.assertEqual(['01', '02'], [e['name'] for e in exercises])
+        self.assertEqual('/groupA/01', exercises[0]['url'])
+        self.assertEqual(20, exercises[0]['size'])
+        self.assertEqual(ExerciseFileManifest.getContentHash(os.path.join(self.manifest.path, 'groupA', '01.json')), exercises[0]['sha1'])
+
+    def test_listing_from_manifest(self):
+        self.manifest.update()
+        index = ExerciseFileIndex(self.manifest.path, manifest=self.manifest)
+        with patch.object(ExerciseFileIndex, 'walk') as walk:
+            listing = index.getListing()
+            self.assertFalse(walk.called)
+        self.assertEqual([(os.path.join(self.manifest.path, 'groupA'), ['01.json', '02.json'])], listing)
+
+    def test_stale_manifest_is_not_used(self):
+        self.manifest.update()
+        self.addExercise('groupA', '03.json')
+        self.setMtimes(2000)
+        self.assertIsNone(self.manifest.getListing())
+
+        index = ExerciseFileIndex(self.manifest.path, manifest=self.manifest)
+        self.assertEqual(['01.json', '02.json', '03.json'], index.getListing()[0][1])
+        self.assertIsNotNone(self.manifest.getListing())
+
+    def test_manifest_not_rebuilt_while_racy(self):
+        self.manifest.update()
+        data = self.manifest.read()
+        self.addExercise('groupA', '03.json') # modified now
+        index = ExerciseFileIndex(self.manifest.path, manifest=self.manifest)
+        self.assertEqual(['01.json', '02.json', '03.json'], index.getListing()[0][1])
+        self.assertEqual(data, self.manifest.read())
+
+        self.setMtimes(2000)
+        index.getListing()
+        self.assertEqual(3, len(self.manifest.getListing()[0][0][1]))
+
+    def test_manifest_with_rewritten_file_is_not_used(self):
+        self.manifest.update()
+        with open(os.path.join(self.manifest.path, 'groupA', '01.json'), 'w') as f:
+            f.write('{"type": "analytical"}')
+        self.setMtimes(1000)
+        self.assertIsNotNone(self.manifest.getListing())
+        with override_settings(EXERCISE_INDEX_FILE_STATS=True):
+            self.assertIsNone(self.manifest.getListing())
+
+class ExerciseDatabaseRepositoryTest(TestCase):
+    def setUp(self):
+        for patcher in (patch.object(ExerciseFile, 'url', lambda ef: '/' + ef.getID()),
+                        patch.object(ExerciseGroup, 'url', lambda g: '/' + g.name)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        self.repo = ExerciseRepository.create(course_id=1, repositoryType="database")
+
+    def create(self, group_name, course_id=1):
+        repo = ExerciseDatabaseRepository(course_id=course_id)
+        return repo.createExercise({"group_name": group_name, "type": "matching", "lilypond_chords": "<c e g>"})
+
+    def test_create_exercise(self):
+        results = [self.create('groupB'), self.create('groupA'), self.create('groupB')]
+        self.assertEqual(['/groupB/01', '/groupA/01', '/groupB/02'], [r['data']['url'] for r in results])
+
+        repo = ExerciseDatabaseRepository(course_id=1)
+        self.assertEqual(['groupA', 'groupB'], [g['name'] for g in repo.getGroupList()])
+        exercise = repo.findExerciseByGroup('groupB', '02')
+        self.assertIsInstance(exercise, ExerciseRecord)
+        self.assertEqual('groupB/01', exercise.previous().getID())
+        exercise.load()
+        self.assertEqual(results[2]['data']['exercise'], exercise.exerciseDefinition.getData())
+
+    def test_courses_are_separate(self):
+        self.create('groupA', course_id=None)
+        self.assertEqual([], ExerciseDatabaseRepository(course_id=1).groups)
+        self.assertEqual(['groupA'], [g.name for g in ExerciseDatabaseRepository().groups])
+
+    def test_create_invalid_exercise(self):
+        result = self.repo.createExercise({"group_name": "groupA", "lilypond_chords": "<x>"})
+        self.assertEqual("error", result['status'])
+        self.assertEqual([], ExerciseDatabaseRepository(course_id=1).groups)
+
+    def test_create_exercises(self):
+        self.create('groupA')
+        results = self.repo.createExercises([{"group_name": "groupA"}, {"group_name": "groupB"}, {"group_name": "groupA"}, "groupB"])
+        self.assertEqual(['/groupA/02', '/groupB/01', '/groupA/03'], [r['data']['url'] for r in results if 'data' in r])
+        self.assertEqual("error", results[3]['status'])
+        self.assertEqual(4, len(ExerciseDatabaseRepository(course_id=1).exercises))
+
+    def test_load_created_exercises(self):
+        definitions = [("groupA", ExerciseDefinition({"type": "matching", "lilypond_chords": chords})) for chords in ("<c e g>", "<d f a>")]
+        exercises = self.repo.saveExercises(definitions)
+        self.assertEqual(2, len(set([e.pk for e in exercises])))
+        for exercise, (group_name, exercise_definition) in zip(exercises, definitions):
+            self.assertIsNotNone(exercise.pk)
+            exercise.load()
+            self.assertEqual(exercise_definition.getData(), exercise.exerciseDefinition.getData())
+
+    def test_iter_loaded_groups(self):
+        for group_name in ('groupA', 'groupA', 'groupB'):
+            self.create(group_name)
+        repo = ExerciseDatabaseRepository(course_id=1)
+        ExerciseDefinitionCache.getInstance().clear()
+        with self.assertNumQueries(2):
+            groups = list(repo.iterLoadedGroups())
+        self.assertEqual([2, 1], [len(g.exercises) for g in groups])
+        self.assertTrue(all([e.exerciseDefinition is not None for g in groups for e in g.exercises]))
+        repo = ExerciseDatabaseRepository(course_id=1)
+        with self.assertNumQueries(0):
+            list(repo.iterLoadedGroups())
+
+    def test_iter_loaded_groups_with_invalid_definition(self):
+        for group_name in ('groupA', 'groupA'):
+            self.create(group_name)
+        ExerciseModel.objects.filter(exercise_name='02').update(definition='{"type": "matching",}')
+        ExerciseDefinitionCache.getInstance().clear()
+        exercises = list(ExerciseDatabaseRepository(course_id=1).iterLoadedGroups())[0].exercises
+        self.assertIsNotNone(exercises[0].exerciseDefinition)
+        self.assertEqual(['error', 'id'], sorted(exercises[1].asDict().keys()))
+        self.assertRaises(ExerciseFileError, exercises[1].load)
+
+    def test_update_exercise(self):
+        self.create('groupA')
+        self.assertTrue(self.repo.updateExercise('groupA', '01', {"type": "analyze"})[0])
+        self.assertFalse(self.repo.updateExercise('groupA', '02', {"type": "analyze"})[0])
+        exercise = ExerciseDatabaseRepository(course_id=1).findExerciseByGroup('groupA', '01')
+        exercise.load()
+        self.assertEqual({"type": "analyze"}, exercise.exerciseDefinition.getData())
+
+    def test_delete(self):
+        for group_name in ('groupA', 'groupA', 'groupB'):
+            self.create(group_name)
+        self.repo.deleteExercise('groupA', '01')
+        self.repo.deleteGroup('groupB')
+        repo = ExerciseDatabaseRepository(course_id=1)
+        self.assertEqual(['groupA/02'], [e.getID() for e in repo.exercises])
+        self.assertEqual('03', ExerciseDatabaseRepository.getNextExerciseName(['02', '01']))
+
+    def test_version(self):
+        version, last_modified = ExerciseRepository.getVersion(1, repositoryType="database")
+        self.assertIsNone(last_modified)
+        self.create('groupA')
+        self.assertNotEqual(version, ExerciseRepository.getVersion(1, repositoryType="database")[0])
+        self.assertIsNotNone(ExerciseRepository.getVersion(1, repositoryType="database")[1])
+
+    def test_group_list_cached(self):
+        self.create('groupA')
+        repo = ExerciseDatabaseRepository(course_id=1)
+        group_list = [{"name": "groupA", "url": "/groupA", "size": 1}]
+        self.assertEqual(group_list, repo.getGroupList())
+        self.assertEqual(ExerciseRepository.getVersion(1, repositoryType="database")[0], repo.version)
+        with patch.object(ExerciseRepository, 'makeGroupList') as make_group_list:
+            self.assertEqual(group_list, ExerciseDatabaseRepository(course_id=1).getGroupList())
+            self.assertEqual(0, make_group_list.call_count)
+
+        repo.deleteGroup('groupA')
+        self.assertIsNone(cache.get(repo.getGroupListCacheKey()))
+        self.assertEqual([], ExerciseDatabaseRepository(course_id=1).getGroupList())
+        self.create('groupB')
+        self.assertEqual(['groupB'], [g['name'] for g in ExerciseDatabaseRepository(course_id=1).getGroupList()])
+
+class ExerciseDefinitionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ExerciseDefinitionCache(max_size=2)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('a', (1, 1)))
+        self.cache.set('a', (1, 1), 'A')
+        self.assertEqual('A', self.cache.get('a', (1, 1)))
+        self.assertIsNone(self.cache.get('a', (2, 1)))
+        self.assertEqual({"size": 0, "max_size": 2, "hits": 1, "misses": 2, "evictions": 0}, self.cache.stats())
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', (1, 1), 'A')
+        self.cache.set('b', (1, 1), 'B')
+        self.cache.get('a', (1, 1))
+        self.cache.set('c', (1, 1), 'C')
+        self.assertIsNone(self.cache.get('b', (1, 1)))
+        self.assertEqual('A', self.cache.get('a', (1, 1)))
+        self.assertEqual('C', self.cache.get('c', (1, 1)))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_exercise_file_load(self):
+        group_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, group_path)
+        with open(os.path.join(group_path, '01.json'), 'w') as f:
+            f.write('{"type": "matching"}')
+
+        with patch.object(ExerciseDefinitionCache, '_instance', self.cache):
+            first = ExerciseFile('01.json', ExerciseGroup('groupA'), group_path)
+            second = ExerciseFile('01.json', ExerciseGroup('groupA'), group_path)
+            first.load()
+            second.load()
+
+        self.assertIs(first.exerciseDefinition, second.exerciseDefinition)
+        self.assertEqual({"type": "matching"}, second.exerciseDefinition.getData())
+        self.assertEqual(1, self.cache.stats()['hits'])
 
 class ExerciseLilyPondTest(unittest.TestCase):
     def setUp(self):
@@ -43,6 +583,95 @@ class ExerciseLilyPondTest(unittest.TestCase):
             lp = ExerciseLilyPond(t['input'])
             self.assertTrue(lp.isValid())
             self.assertEqual(t['output'], lp.toMIDI())
+
+    def test_parse_octave_numbers(self):
+        lp = ExerciseLilyPond("<c5 c5, e3'' xg2>1")
+        self.assertEqual([{'visible': [60, 48, 64], 'hidden': [31]}], lp.toMIDI())
+
+    def test_preview(self):
+        cache = ExerciseLilyPondCache(max_size=2)
+        with patch.object(ExerciseLilyPondCache, '_instance', cache):
+            first = ExerciseLilyPond.preview("<c e g>1\n  <c' \\xNote e'>1 ")
+            second = ExerciseLilyPond.preview("<c e g>1 <c' \\xNote e'>1")
+            invalid = ExerciseLilyPond.preview("<c h>1")
+
+        self.assertIs(first, second)
+        self.assertEqual({
+            "valid": True,
+            "chord": [{'visible': [48, 52, 55], 'hidden': []}, {'visible': [60], 'hidden': [64]}],
+            "errors": [],
+        }, first)
+        self.assertFalse(invalid['valid'])
+        self.assertEqual(["Pitch [h] in chord [c h] is invalid: missing or invalid note name"], invalid['errors'])
+        # chord strings that don't parse aren't cached
+        self.assertEqual({"size": 1, "max_size": 2, "hits": 1, "misses": 2, "evictions": 0}, cache.stats())
+
+    def test_parse_errors(self):
+        error_tests = [
+            ("<c e h>1", "Pitch [h] in chord [c e h] is invalid: missing or invalid note name"),
+            ("<c \\xNote>1", "Pitch [x] in chord [c x] is invalid: missing or invalid note name"),
+            ("<c ez'>1", "Pitch entry [ez'] in chord [c ez'] contains unrecognized symbols: z"),
+            ("< >1", "Pitch [] in chord [] is invalid: missing or invalid note name"),
+        ]
+        for lpstring, error in error_tests:
+            lp = ExerciseLilyPond(lpstring)
+            self.assertFalse(lp.isValid())
+            self.assertEqual([], lp.toMIDI())
+            self.assertEqual([error], lp.errors)
         
 
+class ExerciseLilyPondFileTest(unittest.TestCase):
+    SOURCE = '''\\version "2.18.2" \\language "english" #(set-global-staff-size 18)
+
+\\markup \\small \\left-column { \\line { chromatic-chords } \\line { test } }
+
+\\markup \\pad-around #3 \\box \\pad-markup #1 \\wordwrap {
+  Resolve the "Italian" sixth chord.\\strut
+}
+
+theKey = { \\key
+  %s
+}
+
+\\absolute { \\theKey \\lyCommands
+
+  <af c'' c'' fs''>1 <\\xNote g \\xNote b'>1
+
+} %% end
+
+\\markup \\italic \\pad-around #3 \\box \\pad-markup #1 \\wordwrap {
+  Well done.
+}
+
+%%{ %% HarmonyLab options
+  "analysis": {
+    "enabled": true,
+  },
+%%}
+'''
+
+    def parse(self, key):
+        return ExerciseLilyPondFile('test.ly').parse(self.SOURCE % key)
+
+    def test_parse(self):
+        data = self.parse("f \\major % iG#")
+        self.assertEqual({
+            "type": "matching",
+            "introText": 'Resolve the "Italian" sixth chord.',
+            "reviewText": "Well done.",
+            "keySignature": "b",
+            "key": "iG#",
+            "chord": [{"visible": [56, 72, 72, 78], "hidden": []}, {"visible": [], "hidden": [55, 71]}],
+            "analysis": {"enabled": True},
+        }, dict(data))
+
+    def test_parse_key(self):
+        self.assertEqual(("######", "jF#"), (self.parse("fs \\major")['keySignature'], self.parse("fs \\major")['key']))
+        self.assertEqual(("bbbbbbb", "iAb"), (self.parse("af \\minor")['keySignature'], self.parse("af \\minor")['key']))
+        self.assertEqual(("", "iA_"), (self.parse("a \\minor")['keySignature'], self.parse("a \\minor")['key']))
 
+    def test_parse_invalid_chords(self):
+        lp_file = ExerciseLilyPondFile('test.ly')
+        with self.assertRaises(ExerciseLilyPondError):
+            lp_file.parse((self.SOURCE % "c \\major").replace("<af", "<hf"))
+        self.assertEqual(2, len(lp_file.errors))
@@ -0,0 +1,102 @@
+import unittest
+from mock import patch
+from django.core.cache import cache
+from django.http import HttpResponse, Http404
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from ..pagecache import page_cache
+from ..objects import ExerciseRepository, ExerciseFileRepository
+
+import os
+import shutil
+import tempfile
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = RequestFactory()
+        self.renders = []
+        self.manage_perm = False
+        self.version = "v1"
+        patcher = patch.object(ExerciseRepository, 'getVersion', staticmethod(lambda course_id=None: (self.version, None)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        @page_cache(lambda request, course_id: self.manage_perm)
+        def view(request, course_id=None, group_name=None, exercise_name=None):
+            if group_name == "missing":
+                raise Http404()
+            self.renders.append(request.path)
+            return HttpResponse("page %d" % len(self.renders), content_type="text/html")
+        self.view = view
+
+    def get(self, path, **kwargs):
+        return self.view(self.factory.get(path), **kwargs)
+
+    def test_repeated_pages_are_cached(self):
+        first = self.get('/lab/courses/1/exercises/g/01', course_id="1", group_name="g", exercise_name="01")
+        second = self.get('/lab/courses/1/exercises/g/01', course_id="1", group_name="g", exercise_name="01")
+        self.assertEqual("page 1", second.content)
+        self.assertEqual("text/html", second['Content-Type'])
+        self.assertIsNot(first, second)
+        self.get('/lab/courses/1/exercises/g/02', course_id="1", group_name="g", exercise_name="02")
+        self.get('/lab/courses/2/exercises/g/01', course_id="2", group_name="g", exercise_name="01")
+        self.assertEqual(3, len(self.renders))
+
+    def test_key_inputs(self):
+        self.get('/lab/courses/1', course_id="1")
+        self.manage_perm = True
+        self.assertEqual("page 2", self.get('/lab/courses/1', course_id="1").content)
+        self.version = "v2" # the repository was changed
+        self.assertEqual("page 3", self.get('/lab/courses/1', course_id="1").content)
+        with override_settings(REQUIREJS_CONFIG={"paths": {"app/main": "/static/js/build/main-123"}}):
+            self.assertEqual("page 4", self.get('/lab/courses/1', course_id="1").content)
+        self.assertEqual("page 3", self.get('/lab/courses/1', course_id="1").content)
+
+    def test_errors_not_cached(self):
+        self.assertRaises(Http404, self.get, '/lab/exercises/missing', group_name="missing")
+        self.view(self.factory.post('/lab/courses/1'), course_id="1")
+        self.view(self.factory.post('/lab/courses/1'), course_id="1")
+        self.assertEqual(2, len(self.renders))
+
+    def test_disabled(self):
+        with override_settings(PAGE_CACHE_TIMEOUT=0):
+            self.get('/lab/courses/1', course_id="1")
+            self.get('/lab/courses/1', course_id="1")
+        self.assertEqual(2, len(self.renders))
+
+class PageCacheFileRepositoryTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+        patcher = patch.object(ExerciseFileRepository, 'BASE_PATH', base_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.file_path = os.path.join(base_path, 'courses', '1', 'groupA', '01.json')
+        os.makedirs(os.path.dirname(self.file_path))
+        self.write('{"type": "matching"}', 1000)
+        self.renders = []
+
+        @page_cache(lambda request, course_id: False)
+        def view(request, course_id=None):
+            self.renders.append(request.path)
+            return HttpResponse("page %d" % len(self.renders), content_type="text/html")
+        self.view = lambda: view(RequestFactory().get('/lab/courses/1/exercises/groupA/01'), course_id="1")
+
+    def write(self, content, mtime):
+        with open(self.file_path, 'w') as f:
+            f.write(content)
+        group_path = os.path.dirname(self.file_path)
+        for path in (self.file_path, group_path, os.path.dirname(group_path)):
+            os.utime(path, (mtime, mtime))
+
+    @override_settings(EXERCISE_REPOSITORY_TYPE="file", EXERCISE_INDEX_FILE_STATS=True)
+    def test_edited_exercise_is_a_miss(self):
+        self.view()
+        self.assertEqual("page 1", self.view().content)
+        # rewritten in place, leaving the directory's mtime as it was
+        self.write('{"type": "analytical"}', 1000)
+        self.assertEqual("page 2", self.view().content)
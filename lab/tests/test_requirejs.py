@@ -0,0 +1,37 @@
+import unittest
+import copy
+import json
+
+from ..requirejs import RequirejsContext
+
+class RequirejsContextTest(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            'baseUrl': '/static/js/lib',
+            'paths': {'app': '/static/js/src'},
+            'config': {'app/main': {'debug': True}},
+        }
+        self.original = copy.deepcopy(self.config)
+
+    def test_config_json(self):
+        context = RequirejsContext(self.config)
+        context.set_app_module('app/components/app/exercise')
+        context.set_module_params('app/components/app/exercise', {'exerciseList': [1, 2]})
+        context.set_module_params('app/components/app/exercise', {'nextExercise': None})
+
+        expected = copy.deepcopy(self.original)
+        expected['config']['app/main']['app_module'] = 'app/components/app/exercise'
+        expected['config']['app/components/app/exercise'] = {'exerciseList': [1, 2], 'nextExercise': None}
+        self.assertEqual(expected, json.loads(context.config_json()))
+        self.assertEqual(self.original, self.config)
+        self.assertEqual(self.original, json.loads(RequirejsContext(self.config).config_json()))
+
+    def test_base_encoded_once(self):
+        base_json = RequirejsContext.getBaseJSON(self.config)
+        self.assertIs(base_json, RequirejsContext.getBaseJSON(self.config))
+        self.assertNotIn('"config"', base_json)
+
+    def test_config_without_sections(self):
+        for config in ({}, {'baseUrl': '/static'}):
+            context = RequirejsContext(config).set_app_module('app/main')
+            self.assertEqual(dict(config, config={'app/main': {'app_module': 'app/main'}}), json.loads(context.config_json()))
@@ -0,0 +1,70 @@
+import unittest
+import json
+import logging
+from mock import patch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test.client import RequestFactory
+
+from ..timing import RequestTimer, timed
+from ..middleware import ServerTimingMiddleware, timing_log
+
+@timed('work')
+def work(result=None):
+    return result
+
+class TimedTest(unittest.TestCase):
+    def tearDown(self):
+        RequestTimer().deactivate()
+
+    def test_not_recorded_without_timer(self):
+        self.assertIsNone(RequestTimer.current())
+        self.assertEqual(1, work(1))
+        with timed('block'):
+            pass
+
+    def test_recorded_with_timer(self):
+        timer = RequestTimer()
+        timer.activate()
+        self.assertEqual(1, work(1))
+        work()
+        with timed('block'):
+            pass
+        self.assertEqual(['work', 'block'], list(timer.phases.keys()))
+        self.assertEqual(2, timer.phases['work'][1])
+        self.assertEqual(1, timer.asDict()['block']['count'])
+
+class ServerTimingMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.middleware = ServerTimingMiddleware()
+        self.request = RequestFactory().get('/lab/exercises')
+        level = timing_log.level
+        timing_log.setLevel(logging.INFO)
+        self.addCleanup(timing_log.setLevel, level)
+
+    def test_header(self):
+        self.middleware.process_request(self.request)
+        work()
+        work()
+        with patch.object(timing_log, 'info') as log:
+            response = self.middleware.process_response(self.request, HttpResponse("ok"))
+        self.assertIsNone(RequestTimer.current())
+        self.assertRegexpMatches(response['Server-Timing'], r'^work;dur=[0-9.]+;desc="2 calls", total;dur=[0-9.]+$')
+        self.assertEqual(1, log.call_count)
+        entry = json.loads(log.call_args[0][0])
+        self.assertEqual(("GET", "/lab/exercises", 200), (entry['method'], entry['path'], entry['status']))
+        self.assertEqual(2, entry['phases']['work']['count'])
+
+    def test_streaming_response(self):
+        def content():
+            yield work("a")
+            yield work("b")
+        self.middleware.process_request(self.request)
+        with patch.object(timing_log, 'info') as log:
+            response = self.middleware.process_response(self.request, StreamingHttpResponse(content()))
+            self.assertEqual('', response['Server-Timing'].split('total')[0])
+            self.assertEqual(0, log.call_count)
+            self.assertEqual("ab", "".join(response.streaming_content))
+        self.assertIsNone(RequestTimer.current())
+        entry = json.loads(log.call_args[0][0])
+        self.assertEqual(["work", "stream"], list(entry['phases'].keys()))
+        self.assertEqual(2, entry['phases']['work']['count'])
@@ -0,0 +1,88 @@
+from django.conf.urls import patterns, include, url
+from django.core.urlresolvers import reverse, NoReverseMatch, set_script_prefix, clear_script_prefix
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from ..urltemplates import URLTemplate
+
+import itertools
+
+def view(request, **kwargs):
+    pass
+
+# the URLs of lab/urls.py, without the views that need LTI
+lab_patterns = patterns('',
+    url(r'^$', view, name='index'),
+    url(r'^courses/(?P<course_id>\d+)/manage$', view, name="course-manage"),
+    url(r'^courses/(?P<course_id>\d+)/authcheck$', view, name="course-authorization-check"),
+    url(r'^courses/(?P<course_id>\d+)/exercises/(?P<group_name>[a-zA-Z0-9_\-.]+)/(?P<exercise_name>\d+)$', view, name="course-exercises"),
+    url(r'^courses/(?P<course_id>\d+)/exercises/(?P<group_name>[a-zA-Z0-9_\-.]+)$', view, name="course-exercise-groups"),
+    url(r'^courses/(?P<course_id>\d+)$', view, name="course-index"),
+    url(r'^manage$', view, name="manage"),
+    url(r'^exercises/(?P<group_name>[a-zA-Z0-9_\-.]+)/(?P<exercise_name>\d+)$', view, name="exercises"),
+    url(r'^exercises/(?P<group_name>[a-zA-Z0-9_\-.]+)$', view, name="exercise-groups"),
+    url(r'^api/v1/exercises$', view, name="api-exercises"),
+    url(r'^api/v1/groups$', view, name="api-groups"),
+)
+other_patterns = patterns('',
+    url(r'^any/(?P<path>.+)$', view, name="any"),
+    url(r'^letters/(?P<name>[a-z]+)$', view, name="letters"),
+    url(r'^default$', view, {"group_name": "a"}, name="default"),
+)
+urlpatterns = patterns('',
+    url(r'^lab/', include(lab_patterns + other_patterns, namespace="lab")),
+)
+
+VALUES = ('V65', 'group_A-1.2', 'group A', u'gr\xfcppe', '', '%s', 'V65\n', '03', 3, None, u'/\xe9?#')
+
+@override_settings(ROOT_URLCONF='lab.tests.test_urltemplates')
+class URLTemplateTest(SimpleTestCase):
+    def setUp(self):
+        URLTemplate.clear()
+        self.addCleanup(URLTemplate.clear)
+        self.addCleanup(clear_script_prefix)
+
+    def assertSameAsReverse(self, viewname, **kwargs):
+        try:
+            expected = reverse(viewname, kwargs=kwargs)
+        except NoReverseMatch:
+            self.assertRaises(NoReverseMatch, URLTemplate.get(viewname).format, **kwargs)
+        else:
+            self.assertEqual(expected, URLTemplate.get(viewname).format(**kwargs))
+
+    def test_every_pattern(self):
+        for prefix in ('/', '/a b/%7E/'):
+            set_script_prefix(prefix)
+            for pattern in lab_patterns + other_patterns:
+                names = sorted(pattern.regex.groupindex)
+                for values in itertools.product(VALUES, repeat=len(names)):
+                    self.assertSameAsReverse('lab:' + pattern.name, **dict(zip(names, values)))
+
+    def test_same_as_reverse(self):
+        for prefix in ('/', '/harmony/', '/a b/%7E/'):
+            set_script_prefix(prefix)
+            for group_name in ('V65', 'group_A-1.2', 'group A', u'gr\xfcppe', '', '%s', 'V65\n'):
+                for exercise_name in ('03', 3, 'x'):
+                    self.assertSameAsReverse('lab:exercises', group_name=group_name, exercise_name=exercise_name)
+                    for course_id in ('1', 12, None):
+                        self.assertSameAsReverse('lab:course-exercises', course_id=course_id, group_name=group_name, exercise_name=exercise_name)
+                self.assertSameAsReverse('lab:exercise-groups', group_name=group_name)
+                self.assertSameAsReverse('lab:course-exercise-groups', course_id='7', group_name=group_name)
+                self.assertSameAsReverse('lab:any', path=group_name + u'/\xe9?#')
+
+    def test_cached_per_prefix(self):
+        template = URLTemplate.get('lab:exercise-groups')
+        self.assertIs(template, URLTemplate.get('lab:exercise-groups'))
+        self.assertEqual('/lab/exercises/%(group_name)s', template.getFormat(frozenset(['group_name'])))
+        set_script_prefix('/harmony/')
+        self.assertEqual('/harmony/lab/exercises/V65', URLTemplate.get('lab:exercise-groups').format(group_name='V65'))
+
+    def test_unsupported_names(self):
+        self.assertIsNone(URLTemplate.get('lab:default').getFormat(frozenset(['group_name'])))
+        self.assertIsNone(URLTemplate.get('lab:letters').getFormat(frozenset(['name'])))
+        self.assertSameAsReverse('lab:letters', name='abc')
+        self.assertSameAsReverse('lab:default')
+        self.assertSameAsReverse('lab:default', group_name='a')
+        self.assertSameAsReverse('lab:missing')
+        self.assertSameAsReverse('missing:exercises', group_name='a', exercise_name='1')
+        self.assertSameAsReverse('lab:exercises', group_name='a')
@@ -0,0 +1,102 @@
+'''
+Timing of the phases of a request (repository scans, exercise loads, URL
+reversing, serialization), reported by ServerTimingMiddleware.
+
+Code marks a phase with timed(), as a context manager or a decorator:
+
+    @timed('findFiles')
+    def findFiles(self):
+        ...
+
+    with timed('json'):
+        ...
+
+Phases are only recorded while a RequestTimer is active on the current
+thread, so outside of a timed request a phase costs one thread-local lookup.
+'''
+from django.core import urlresolvers
+
+from functools import wraps
+from timeit import default_timer
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict # python 2.6
+
+_local = threading.local()
+
+class RequestTimer(object):
+    '''Accumulates the time and number of calls of each phase of a request.'''
+    def __init__(self):
+        self.started = default_timer()
+        self.phases = OrderedDict()
+
+    @staticmethod
+    def current():
+        '''Returns the timer that is active on this thread, or None.'''
+        return getattr(_local, 'timer', None)
+
+    def activate(self):
+        _local.timer = self
+
+    def deactivate(self):
+        _local.timer = None
+
+    def add(self, name, seconds):
+        '''Adds the duration of one call of a phase.'''
+        phase = self.phases.get(name, None)
+        if phase is None:
+            self.phases[name] = [seconds, 1]
+        else:
+            phase[0] += seconds
+            phase[1] += 1
+
+    def elapsed(self):
+        '''Returns the seconds since the timer was created.'''
+        return default_timer() - self.started
+
+    def asDict(self):
+        '''Returns the phases as {name: {"ms": total, "count": calls}}.'''
+        return OrderedDict([(name, {"ms": round(seconds * 1e3, 3), "count": count})
+            for name, (seconds, count) in self.phases.iteritems()])
+
+class timed(object):
+    '''
+    Records the time spent in a block (as a context manager) or in a
+    function (as a decorator) as a phase of the current request.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.timer = None
+
+    def __enter__(self):
+        self.timer = RequestTimer.current()
+        if self.timer is not None:
+            self.started = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timer is not None:
+            self.timer.add(self.name, default_timer() - self.started)
+        return False
+
+    def __call__(self, fn):
+        name = self.name
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            timer = RequestTimer.current()
+            if timer is None:
+                return fn(*args, **kwargs)
+            started = default_timer()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timer.add(name, default_timer() - started)
+        return wrapper
+
+def reverse(*args, **kwargs):
+    '''django.core.urlresolvers.reverse(), timed as the "reverse" phase.'''
+    with timed('reverse'):
+        return urlresolvers.reverse(*args, **kwargs)
@@ -1,7 +1,7 @@
 from django.conf.urls import patterns, url
 import views
 from views import PlayView, ExerciseView, ManageView
-from views import APIView, APIExerciseView, APIGroupView
+from views import APIView, APIExerciseView, APIGroupView, APILilyPondView
 from lti.views import LTIToolConfigView, LTILaunchView
 
 urlpatterns = patterns(
@@ -26,6 +26,7 @@ urlpatterns = patterns(
     url(r'^api$', APIView.as_view(), name="api"),
     url(r'^api/v1/exercises$', APIExerciseView.as_view(), name="api-exercises"),
     url(r'^api/v1/groups$', APIGroupView.as_view(), name="api-groups"),
+    url(r'^api/v1/lilypond$', APILilyPondView.as_view(), name="api-lilypond"),
 
     # LTI -- deprecated -- moved into separate app named "lti" 
     # Mainting these URLs for backwards compatibility. Remove when possible.
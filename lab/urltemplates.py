@@ -0,0 +1,131 @@
+'''
+URL formatting without a reverse() per object.
+
+reverse() walks the namespaces, looks up the URL name and builds and matches
+a regular expression on every call, which adds up when a URL is needed for
+every exercise and group of a repository. A URLTemplate calls reverse() once
+per URL name and set of kwarg names (and URLconf and script prefix) with
+sentinel values, and turns the URL into a format string by replacing the
+sentinels with placeholders, so that
+
+    URLTemplate.get('lab:course-exercises').format(course_id="1", group_name="V65", exercise_name="03")
+
+returns the same URL as reverse() with the same kwargs, or raises the same
+NoReverseMatch. Only the public reverse() is used.
+
+Whether reverse() accepts a value (and puts it where the placeholder is) is
+checked once per kwarg and value, with sentinels for the other kwargs, so a
+repository's URLs take one reverse() per distinct group name, exercise name
+and course instead of one per URL. This assumes, like all the URL patterns
+of this project, that the pattern of each kwarg doesn't depend on the other
+kwargs. Names that can't be handled this way (e.g. patterns that reject the
+sentinels, or have default kwargs) are passed to reverse().
+'''
+from django.core import urlresolvers
+from django.test.signals import setting_changed
+from django.utils.encoding import force_text
+from django.utils.http import urlquote
+
+from .timing import timed
+
+import re
+
+class URLTemplate(object):
+    # characters that urlquote() leaves as they are
+    SAFE_RE = re.compile(r'^[a-zA-Z0-9_.\-/]*\Z')
+    # sentinels are digits, which the URL patterns of this project accept for
+    # any kwarg, and are long enough not to be found elsewhere in a URL
+    SENTINEL_BASE = 7319046283
+    # number of checked (kwarg, value) pairs kept per template
+    MAX_VALUES = 10000
+
+    _templates = {}
+
+    def __init__(self, viewname, urlconf=None, prefix='/'):
+        self.viewname = viewname
+        self.urlconf = urlconf
+        self.prefix = prefix
+        self.formats = {}
+        self.values = {}
+
+    @classmethod
+    def get(cls, viewname):
+        '''Returns the template of a URL name for the current URLconf and script prefix.'''
+        key = (urlresolvers.get_urlconf(), urlresolvers.get_script_prefix(), viewname)
+        template = cls._templates.get(key, None)
+        if template is None:
+            template = cls._templates[key] = cls(viewname, *key[:2])
+        return template
+
+    @classmethod
+    def clear(cls):
+        cls._templates.clear()
+
+    def reverse(self, kwargs):
+        return urlresolvers.reverse(self.viewname, urlconf=self.urlconf, kwargs=kwargs, prefix=self.prefix)
+
+    def getSentinels(self, names):
+        return dict([(name, str(self.SENTINEL_BASE + i)) for i, name in enumerate(sorted(names))])
+
+    def getFormat(self, names):
+        '''
+        Returns the format string for a frozenset of kwarg names, or None if
+        URLs with those kwargs must be built by reverse().
+        '''
+        if names not in self.formats:
+            self.formats[names] = self.makeFormat(names)
+        return self.formats[names]
+
+    def makeFormat(self, names):
+        sentinels = self.getSentinels(names)
+        try:
+            url = self.reverse(sentinels)
+        except urlresolvers.NoReverseMatch:
+            return None
+        if any([url.count(sentinel) != 1 for sentinel in sentinels.itervalues()]):
+            return None
+        url_format = url.replace('%', '%%')
+        for name, sentinel in sentinels.iteritems():
+            url_format = url_format.replace(sentinel, '%%(%s)s' % name)
+        return url_format
+
+    def substitute(self, url_format, text_kwargs):
+        '''Returns the URL for kwargs that reverse() accepts, quoted like reverse() quotes them.'''
+        return str(url_format % dict([(k, v if self.SAFE_RE.match(v) else urlquote(v))
+            for k, v in text_kwargs.iteritems()]))
+
+    def isAccepted(self, names, url_format, name, value):
+        '''
+        Returns true if reverse() gives the URL of the format string for a
+        kwarg value (with sentinels for the other kwargs).
+        '''
+        key = (names, name, value)
+        accepted = self.values.get(key, None)
+        if accepted is None:
+            kwargs = self.getSentinels(names)
+            kwargs[name] = value
+            try:
+                accepted = self.reverse(kwargs) == self.substitute(url_format, kwargs)
+            except urlresolvers.NoReverseMatch:
+                accepted = False
+            if len(self.values) >= self.MAX_VALUES:
+                self.values.clear()
+            self.values[key] = accepted
+        return accepted
+
+    @timed('reverse')
+    def format(self, **kwargs):
+        '''Returns the URL for the kwargs, like reverse(viewname, kwargs=kwargs).'''
+        names = frozenset(kwargs)
+        url_format = self.getFormat(names)
+        if url_format is not None:
+            text_kwargs = dict([(k, force_text(v)) for k, v in kwargs.iteritems()])
+            if all([self.isAccepted(names, url_format, k, v) for k, v in text_kwargs.iteritems()]):
+                return self.substitute(url_format, text_kwargs)
+        return self.reverse(kwargs)
+
+def _settings_changed(sender, setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        URLTemplate.clear()
+
+setting_changed.connect(_settings_changed)
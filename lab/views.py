@@ -1,56 +1,31 @@
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.core.urlresolvers import reverse
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse, Http404
 from django.shortcuts import render, redirect
 from django.utils.decorators import method_decorator
 from django.utils.http import urlencode
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from django.views.generic import View, TemplateView, RedirectView
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import condition
 
 from braces.views import CsrfExemptMixin, LoginRequiredMixin
 from django_auth_lti import const
 
-from .objects import ExerciseRepository
+from .objects import ExerciseRepository, ExerciseCursor, ExerciseLilyPond
+from .timing import reverse
+from .requirejs import RequirejsContext
+from .pagecache import page_cache
+from .metrics import collector as metrics_collector
+from .encoders import StreamingJSONEncoder, MessagePackEncoder
 from .decorators import role_required, course_authorization_required
 from .verification import has_instructor_role, has_course_authorization
 from lti.models import LTIConsumer, LTICourse
 
 import json
-import copy
-
-
-class RequirejsContext(object):
-    def __init__(self, config, debug=True):
-        self._debug = debug
-        self._config = copy.deepcopy(config)
-    
-    def set_module_params(self, module_id, params):
-        module_config = {}
-        module_config.update(params)
-        if 'config' not in self._config:
-            self._config['config'] = {}
-        if module_id not in self._config['config']:
-            self._config['config'][module_id] = {}
-        self._config['config'][module_id].update(module_config)
-        return self
-    
-    def set_app_module(self, app_module_id):
-        self.set_module_params('app/main', {'app_module': app_module_id})
-        return self
-    
-    def add_to_view(self, view_context):
-        view_context['requirejs'] = self
-        return self
-
-    def debug(self):
-        if self._debug:
-            return True
-        return False
-
-    def config_json(self):
-        return json.dumps(self._config)
-    
+import datetime
+import re
 
 
 class RequirejsTemplateView(TemplateView):
@@ -75,16 +50,32 @@ class RequirejsView(View):
 
 
 
+def has_manage_perm(request, course_id):
+    '''
+    Returns true if the user may manage the exercises of the course. It is
+    computed once per request.
+    '''
+    if not hasattr(request, '_has_manage_perm'):
+        request._has_manage_perm = has_instructor_role(request) and has_course_authorization(request, course_id)
+    return request._has_manage_perm
+
+# Caches the HTML of the exercise pages (see lab.pagecache).
+exercise_page_cache = page_cache(has_manage_perm)
+
 class PlayView(RequirejsTemplateView):
     template_name = "play.html"
     requirejs_app = 'app/components/app/play'
 
+    @method_decorator(exercise_page_cache)
+    def get(self, request, *args, **kwargs):
+        return super(PlayView, self).get(request, *args, **kwargs)
+
     def get_context_data(self, course_id=None, **kwargs):
         context = super(PlayView, self).get_context_data(**kwargs)
         er = ExerciseRepository.create(course_id=course_id)
 
         context['group_list'] = er.getGroupList()
-        context['has_manage_perm'] = has_instructor_role(self.request) and has_course_authorization(self.request, course_id)
+        context['has_manage_perm'] = has_manage_perm(self.request, course_id)
         if context['has_manage_perm']:
             if course_id is None:
                 context['manage_url'] = reverse('lab:manage')
@@ -99,12 +90,13 @@ class PlayView(RequirejsTemplateView):
         return context
 
 class ExerciseView(RequirejsView):
+    @method_decorator(exercise_page_cache)
     def get(self, request, course_id=None, group_name=None, exercise_name=None):
         context = {}
         er = ExerciseRepository.create(course_id=course_id)
 
         context['group_list'] = er.getGroupList()
-        context['has_manage_perm'] = has_instructor_role(request) and has_course_authorization(request, course_id)
+        context['has_manage_perm'] = has_manage_perm(request, course_id)
         if context['has_manage_perm']:
             if course_id is None:
                 context['manage_url'] = reverse('lab:manage')
@@ -140,7 +132,7 @@ class ExerciseView(RequirejsView):
         exercise_context.update({
             "nextExercise": exercise.nextUrl(),
             "previousExercise": exercise.previousUrl(),
-            "exerciseList": exercise.group.getList()
+            "exerciseList": exercise.group.getList(selected=exercise)
         })
 
         self.requirejs_context.set_app_module('app/components/app/exercise')
@@ -184,20 +176,60 @@ class APIView(View):
             'version': self.api_version
         }))
 
+def get_repository_version(request):
+    '''
+    Returns the (version, last_modified) tuple of the repository requested
+    by the course_id query parameter. It is computed once per request.
+    '''
+    if not hasattr(request, '_repository_version'):
+        course_id = request.GET.get('course_id', None)
+        request._repository_version = ExerciseRepository.getVersion(course_id=course_id)
+    return request._repository_version
+
+def repository_etag(request, *args, **kwargs):
+    version, last_modified = get_repository_version(request)
+    etag = "%s.%s" % (version, get_api_format(request))
+    if accepts_gzip(request):
+        etag += ".gz"
+    return etag
+
+def repository_last_modified(request, *args, **kwargs):
+    version, last_modified = get_repository_version(request)
+    if last_modified is None:
+        return None
+    return datetime.datetime.utcfromtimestamp(last_modified)
+
+# Answers conditional GET requests (If-None-Match, If-Modified-Since) with 304
+# before the repository is created, and adds ETag and Last-Modified headers.
+repository_condition = condition(etag_func=repository_etag, last_modified_func=repository_last_modified)
+
 class APIGroupView(CsrfExemptMixin, View):
+    @method_decorator(repository_condition)
     def get(self, request):
         '''Public list of groups and exercises.'''
         course_id = request.GET.get('course_id', None)
+        try:
+            cursor, limit = get_page_params(request)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
         er = ExerciseRepository.create(course_id=course_id)
-        data = er.getGroupList()
-        json_data = json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
-        return HttpResponse(json_data, content_type='application/json')
+        groups, keys = er.getSortedGroups()
+        group_list, next_cursor = ExerciseCursor.paginate(er.getGroupList(), keys, cursor, limit)
+        response = api_response(request, iter(group_list))
+        return add_next_link(request, response, next_cursor)
 
 class APIExerciseView(CsrfExemptMixin, View):
+    @method_decorator(repository_condition)
     def get(self, request):
         course_id = request.GET.get('course_id', None)
         group_name = request.GET.get('group_name', None)
         exercise_name = request.GET.get('exercise_name', None)
+        include = request.GET.get('include', None)
+        try:
+            cursor, limit = get_page_params(request)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
         
         er = ExerciseRepository.create(course_id=course_id)
         if exercise_name is not None and group_name is not None:
@@ -205,23 +237,67 @@ class APIExerciseView(CsrfExemptMixin, View):
             if exercise is None:
                 raise Http404("Exercise does not exist.")
             exercise.load()
-            data = exercise.asDict()
+            return api_response(request, exercise.asDict())
         elif exercise_name is None and group_name is not None:
             group = er.findGroup(group_name)
             if group is None:
                 raise Http404("Exercise group does not exist.")
-            data = group.asDict()
+            exercises, next_cursor = ExerciseCursor.paginate(group.exercises, group.getSortKeys(), cursor, limit)
+            response = api_response(request, group.asDict(lazy=True, exercises=exercises))
+            return add_next_link(request, response, next_cursor)
+
+        groups, next_cursor = None, None
+        if limit is not None or cursor is not None:
+            groups, keys = er.getSortedGroups()
+            groups, next_cursor = ExerciseCursor.paginate(groups, keys, cursor, limit)
+        if include == 'definitions':
+            response = self.get_definitions_response(request, er, groups)
         else:
-            data = er.asDict()
-
-        return HttpResponse(json.dumps(data, sort_keys=True, indent=4, separators=(',', ': ')), content_type='application/json')
+            response = api_response(request, er.asDict(lazy=True, groups=groups))
+        return add_next_link(request, response, next_cursor)
+
+    def get_definitions_response(self, request, er, groups=None):
+        '''
+        Streams every group in the repository (or the given groups) with its
+        exercise definitions loaded, so that a whole course can be fetched in
+        one request. An exercise that can't be loaded is sent as its id and
+        the error, since the response has already started.
+        '''
+        data = {
+            "course_id": er.course_id,
+            "data": {
+                "groups": (g.asDict(lazy=True) for g in er.iterLoadedGroups(groups=groups)),
+            }
+        }
+        return api_response(request, data)
  
     @method_decorator(course_authorization_required(source='query'))
     @method_decorator(role_required([const.ADMINISTRATOR,const.INSTRUCTOR], redirect_url='lab:not_authorized', raise_exception=True))
     def post(self, request):
         course_id = request.GET.get("course_id", None)
+        er = ExerciseRepository.create(course_id=course_id)
+
+        if 'exercises' in request.POST:
+            # batch of exercises, possibly in different groups
+            try:
+                exercises_data = json.loads(request.POST['exercises'])
+            except ValueError:
+                return HttpResponseBadRequest("Invalid exercises: not JSON")
+            if not isinstance(exercises_data, list):
+                return HttpResponseBadRequest("Invalid exercises: expected a list")
+            results = er.createExercises(exercises_data)
+            num_failed = len([r for r in results if r['status'] != "success"])
+            result = {"results": results}
+            if num_failed == 0:
+                result['status'] = "success"
+                result['message'] = "%d exercises created successfully!" % len(results)
+            else:
+                result['status'] = "error"
+                result['message'] = "%d of %d exercises failed to save." % (num_failed, len(results))
+            return HttpResponse(json.dumps(result), content_type='application/json')
+
         exercise_data = json.loads(request.POST.get('exercise', None))
-        result = ExerciseRepository.create(course_id=course_id).createExercise(exercise_data)
+        result = er.createExercise(exercise_data)
 
         return HttpResponse(json.dumps(result), content_type='application/json')
     
@@ -249,6 +325,119 @@ class APIExerciseView(CsrfExemptMixin, View):
             
         return HttpResponse(json.dumps(result), content_type='application/json')
 
+class APILilyPondView(CsrfExemptMixin, View):
+    '''
+    Parses LilyPond chords (the "lilypond_chords" parameter) and returns the
+    MIDI chords and any errors, so that the chords can be checked while an
+    exercise is being edited. Like saving an exercise, this requires the
+    instructor role in the course (the course_id query parameter). Results
+    of valid chord strings are memoized per chord string.
+    '''
+    # the chords of the longest exercise source in data/exercises/ly are
+    # under 400 characters long
+    max_length = 2000
+
+    @method_decorator(course_authorization_required(source='query'))
+    @method_decorator(role_required([const.ADMINISTRATOR,const.INSTRUCTOR], redirect_url='lab:not_authorized', raise_exception=True))
+    def get(self, request):
+        return self.preview(request, request.GET.get('lilypond_chords', None))
+
+    @method_decorator(course_authorization_required(source='query'))
+    @method_decorator(role_required([const.ADMINISTRATOR,const.INSTRUCTOR], redirect_url='lab:not_authorized', raise_exception=True))
+    def post(self, request):
+        return self.preview(request, request.POST.get('lilypond_chords', None))
+
+    def preview(self, request, lilypond_chords):
+        if lilypond_chords is None:
+            return HttpResponseBadRequest("Missing lilypond_chords")
+        if len(lilypond_chords) > self.max_length:
+            return HttpResponseBadRequest("Invalid lilypond_chords: longer than %d characters" % self.max_length)
+        return api_response(request, ExerciseLilyPond.preview(lilypond_chords))
+
+def metrics_view(request):
+    '''
+    Returns the metrics of all processes (see lab.metrics) in the Prometheus
+    text exposition format. Not found unless METRICS_ENABLED is set.
+    '''
+    if not metrics_collector.isEnabled():
+        raise Http404
+    return HttpResponse(metrics_collector.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Response formats of the JSON API. Pretty-printed JSON is the default (for
+# humans); machine clients can ask for compact JSON or MessagePack.
+API_FORMATS = ('json', 'compact', 'msgpack')
+API_MSGPACK_TYPES = ('application/x-msgpack', 'application/msgpack')
+
+def get_api_format(request):
+    '''
+    Returns the API response format requested with the "format" query
+    parameter or, failing that, the Accept header.
+    '''
+    api_format = request.GET.get('format', None)
+    if api_format in API_FORMATS:
+        return api_format
+    accept = request.META.get('HTTP_ACCEPT', '')
+    for content_type in API_MSGPACK_TYPES:
+        if content_type in accept:
+            return 'msgpack'
+    return 'json'
+
+def get_api_encoder(api_format):
+    if api_format == 'msgpack':
+        return MessagePackEncoder()
+    if api_format == 'compact':
+        return StreamingJSONEncoder(separators=(',', ':'))
+    return StreamingJSONEncoder(sort_keys=True, indent=4, separators=(',', ': '))
+
+def accepts_gzip(request):
+    return re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+
+def api_response(request, data):
+    '''
+    Returns a response that writes the data out in the requested API format
+    while it is being encoded, gzipped if the client accepts it. Generators
+    in the data are consumed one item at a time, so large repository and
+    group dumps are never held in memory as a whole.
+    '''
+    encoder = get_api_encoder(get_api_format(request))
+    content = encoder.iterencode(data)
+    gzipped = accepts_gzip(request)
+    if gzipped:
+        content = compress_sequence(content)
+    response = StreamingHttpResponse(content, content_type=encoder.content_type)
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
+
+def get_page_params(request):
+    '''
+    Returns the (cursor, limit) pagination parameters of an API request.
+    Both are None when the request is not paginated. Raises ValueError if
+    the cursor or limit is invalid.
+    '''
+    cursor = request.GET.get('cursor', None)
+    limit = request.GET.get('limit', None)
+    if cursor is not None:
+        ExerciseCursor.decode(cursor)
+    if limit is not None:
+        max_limit = getattr(settings, 'API_PAGE_MAX_LIMIT', 1000)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("Invalid limit: %s" % limit)
+        if limit < 1 or limit > max_limit:
+            raise ValueError("Limit must be between 1 and %d" % max_limit)
+    return cursor, limit
+
+def add_next_link(request, response, next_cursor):
+    '''Adds a Link header pointing to the next page, if there is one.'''
+    if next_cursor is not None:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        response['Link'] = '<%s?%s>; rel="next"' % (request.path, params.urlencode())
+    return response
+
 def not_authorized(request):
     return HttpResponse('Unauthorized', status=401)
 
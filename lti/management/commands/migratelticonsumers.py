@@ -0,0 +1,85 @@
+# DESCRIPTION
+#
+# This script adds the unique index on (consumer_key, resource_link_id) of
+# lti.models.LTIConsumer to a database that was created before the index was
+# added. Django 1.6 has no migrations and "./manage.py syncdb" doesn't alter
+# existing tables; databases created by syncdb since then already have the
+# index, and are left as they are.
+#
+# Before the index existed, concurrent launches could set up the same tool
+# consumer instance more than once. The duplicates are deleted, keeping the
+# consumer that launches have been using (the first in the model ordering).
+# The courses of the deleted consumers are kept, and listed so that their
+# exercises can be moved if need be.
+#
+# USAGE:
+#
+#   ./manage.py migratelticonsumers
+#   ./manage.py migratelticonsumers --dry-run
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, IntegrityError, DatabaseError
+from django.db.models import Count
+from optparse import make_option
+
+from lti.models import LTIConsumer, LTICourse
+
+INDEX_NAME = 'lti_lticonsumer_consumer_key_resource_link_id_uniq'
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Adds the unique index on (consumer_key, resource_link_id) of the LTI consumers, removing duplicates.'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', dest='dry_run', action='store_true', default=False,
+            help='Only list the duplicate consumers.'),
+    )
+
+    def handle(self, *args, **options):
+        if self._has_unique_index():
+            self.stdout.write("The unique index already exists.")
+            return
+
+        with transaction.atomic():
+            duplicates = self._get_duplicates()
+            for consumer in duplicates:
+                self.stdout.write("Duplicate consumer {0} ({1}, {2}) of course {3}".format(
+                    consumer.id, consumer.consumer_key, consumer.resource_link_id, consumer.course_id))
+            if options['dry_run']:
+                self.stdout.write("{0} duplicate consumers".format(len(duplicates)))
+                return
+            LTIConsumer.objects.filter(id__in=[c.id for c in duplicates]).delete()
+
+            qn = connection.ops.quote_name
+            try:
+                connection.cursor().execute("CREATE UNIQUE INDEX {0} ON {1} ({2}, {3})".format(
+                    qn(INDEX_NAME), qn(LTIConsumer._meta.db_table), qn('consumer_key'), qn('resource_link_id')))
+            except DatabaseError as e:
+                raise CommandError("Unable to create the unique index: {0}".format(e))
+        self.stdout.write("Deleted {0} duplicate consumers and created the unique index.".format(len(duplicates)))
+
+    def _get_duplicates(self):
+        '''Returns the consumers to delete: all but the first of each (consumer_key, resource_link_id).'''
+        keys = LTIConsumer.objects.values_list('consumer_key', 'resource_link_id').annotate(n=Count('id')).filter(n__gt=1).order_by()
+        duplicates = []
+        for consumer_key, resource_link_id, n in keys:
+            consumers = LTIConsumer.objects.filter(consumer_key=consumer_key, resource_link_id=resource_link_id)
+            duplicates.extend(list(consumers.order_by(*(LTIConsumer._meta.ordering + ['id'])))[1:])
+        return duplicates
+
+    def _has_unique_index(self):
+        '''
+        Returns true if the database rejects a duplicate consumer, by trying
+        to insert one in a transaction that is always rolled back.
+        '''
+        probe = '__migratelticonsumers__'
+        try:
+            with transaction.atomic():
+                course = LTICourse.objects.create(course_name_short=probe, course_name=probe)
+                for i in range(2):
+                    LTIConsumer.objects.create(consumer_key=probe, resource_link_id=probe, course=course)
+                raise Rollback()
+        except IntegrityError:
+            return True
+        except Rollback:
+            return False
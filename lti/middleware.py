@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from ims_lti_py.tool_provider import DjangoToolProvider
+
+from lab.metrics import LTI_NONCE_REJECTIONS
+from .nonces import get_nonce_store
+
+import logging
+import oauth2
+import time
+
+log = logging.getLogger(__name__)
+
+class LTINonceMiddleware(object):
+    '''
+    Rejects replayed LTI launch requests: a signed POST whose OAuth
+    timestamp isn't fresh or whose nonce was already used (see lti.nonces)
+    gets a 403 response, before it reaches the login of
+    django_auth_lti.middleware.LTIAuthMiddleware.
+
+    A nonce is only recorded once the request's signature is checked with
+    the secret of its consumer key in LTI_OAUTH_CREDENTIALS, so that
+    forged requests can't fill the store. Requests with an unknown key or a
+    bad signature are left to LTIAuthMiddleware, which rejects them.
+
+    This must come right before LTIAuthMiddleware in MIDDLEWARE_CLASSES.
+    '''
+    def __init__(self):
+        self.store = get_nonce_store()
+
+    def process_request(self, request):
+        if request.method != 'POST' or 'oauth_consumer_key' not in request.POST:
+            return None
+        consumer_key = request.POST['oauth_consumer_key']
+        secret = settings.LTI_OAUTH_CREDENTIALS.get(consumer_key, None)
+        if secret is None:
+            return None
+        nonce = request.POST.get('oauth_nonce', '')
+        try:
+            timestamp = int(request.POST.get('oauth_timestamp', ''))
+        except ValueError:
+            timestamp = None
+        if not nonce or timestamp is None:
+            reason = "invalid"
+        elif not self.store.isFresh(timestamp, time.time()):
+            reason = "stale"
+        elif not self.isSigned(request, consumer_key, secret):
+            return None
+        elif not self.store.useNonce(consumer_key, timestamp, nonce):
+            reason = "replay"
+        else:
+            return None
+        LTI_NONCE_REJECTIONS.inc(reason=reason)
+        log.warning("Rejected LTI launch from consumer %r: %s nonce or timestamp", consumer_key, reason)
+        raise PermissionDenied
+
+    def isSigned(self, request, consumer_key, secret):
+        '''Returns true if the request has a valid OAuth signature.'''
+        tool_provider = DjangoToolProvider(consumer_key, secret, request.POST.dict())
+        try:
+            return tool_provider.is_valid_request(request)
+        except oauth2.Error:
+            return False
@@ -1,16 +1,21 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import force_bytes
+
+import hashlib
 
 class LTICourse(models.Model):
     course_name_short = models.CharField(max_length=1024)
     course_name = models.CharField(max_length=2048)
-    
+
     @classmethod
     def getCourseNames(cls, course_id):
         result = {"name": "", "name_short": ""}
-        if cls.objects.filter(id=course_id).exists():
-            c = cls.objects.get(id=course_id)
-            result['name'] = c.course_name
-            result['name_short'] = c.course_name_short
+        names = cls.objects.filter(id=course_id).values_list('course_name', 'course_name_short').first()
+        if names is not None:
+            result['name'], result['name_short'] = names
         return result
 
     class Meta:
@@ -25,29 +30,79 @@ class LTIConsumer(models.Model):
     context_id = models.CharField(max_length=255, blank=True, null=True)
     canvas_course_id = models.CharField(max_length=255, blank=True, null=True)
     course = models.ForeignKey(LTICourse)
-    
+
+    # Course IDs are cached by (consumer_key, resource_link_id), so that
+    # launches from a known tool consumer don't query the database (see
+    # getCourseId).
+    COURSE_ID_KEY_PREFIX = 'lti:course_id'
+
     @classmethod
     def hasCourse(cls, consumer_key, resource_link_id):
-        return cls.objects.filter(consumer_key=consumer_key,resource_link_id=resource_link_id).exists()
-    
+        return cls.getCourseId(consumer_key, resource_link_id) is not None
+
     @classmethod
     def getConsumer(cls, consumer_key, resource_link_id):
-        result = cls.objects.filter(consumer_key=consumer_key,resource_link_id=resource_link_id)
+        result = cls.objects.filter(consumer_key=consumer_key,resource_link_id=resource_link_id)[:1]
         if len(result) > 0:
             return result[0]
         return None
-    
+
+    @classmethod
+    def getCourseId(cls, consumer_key, resource_link_id):
+        '''
+        Returns the ID of the course of a tool consumer instance, or None if
+        it has no course yet. Found IDs are kept in the cache (CACHES) for
+        LTI_CONSUMER_CACHE_TIMEOUT seconds. Saving or deleting a consumer
+        deletes its entry, so with a cache shared by the workers a change is
+        seen by all of them at once; otherwise, the other workers see it when
+        their entry expires.
+        '''
+        key = cls.getCourseIdCacheKey(consumer_key, resource_link_id)
+        course_id = cache.get(key)
+        if course_id is None:
+            result = cls.objects.filter(consumer_key=consumer_key,resource_link_id=resource_link_id).values_list('course_id', flat=True)[:1]
+            if len(result) > 0:
+                course_id = result[0]
+                cache.set(key, course_id, getattr(settings, 'LTI_CONSUMER_CACHE_TIMEOUT', 300))
+        return course_id
+
+    @classmethod
+    def getCourseIdCacheKey(cls, consumer_key, resource_link_id):
+        identifiers = force_bytes(consumer_key) + b'\n' + force_bytes(resource_link_id)
+        return "%s:%s" % (cls.COURSE_ID_KEY_PREFIX, hashlib.sha1(identifiers).hexdigest())
+
+    @classmethod
+    def clearCourseId(cls, instance, **kwargs):
+        '''Deletes the cached course ID of a consumer that was saved or deleted.'''
+        cache.delete(cls.getCourseIdCacheKey(instance.consumer_key, instance.resource_link_id))
+
     @classmethod
     def setupCourse(cls, launch):
-        if not ("consumer_key" in launch and "resource_link_id" in launch): 
+        '''
+        Creates a course for a tool consumer instance and returns the new
+        consumer. If a concurrent launch set up the same consumer first, the
+        unique index on (consumer_key, resource_link_id) rejects this one,
+        and the consumer that was set up first is returned instead.
+        '''
+        if not ("consumer_key" in launch and "resource_link_id" in launch):
             raise Exception("Missing required launch parameters: consumer_key and resource_link_id")
- 
+
         course_name_short = launch.pop('course_name_short', 'untitled')
         course_name = launch.pop('course_name', 'Untitled Course')
-        course = LTICourse.objects.create(course_name_short=course_name_short,course_name=course_name)
- 
-        return cls.objects.create(course=course, **launch)
-    
+        try:
+            with transaction.atomic():
+                course = LTICourse.objects.create(course_name_short=course_name_short,course_name=course_name)
+                return cls.objects.create(course=course, **launch)
+        except IntegrityError:
+            consumer = cls.getConsumer(launch['consumer_key'], launch['resource_link_id'])
+            if consumer is None:
+                raise
+            return consumer
+
     class Meta:
         verbose_name = 'LTI Consumer'
         ordering = ['consumer_key','resource_link_id','context_id']
+        unique_together = ('consumer_key', 'resource_link_id')
+
+post_save.connect(LTIConsumer.clearCourseId, sender=LTIConsumer)
+post_delete.connect(LTIConsumer.clearCourseId, sender=LTIConsumer)
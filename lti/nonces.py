@@ -0,0 +1,127 @@
+'''
+Replay protection for LTI launches: stores of the OAuth nonces of signed
+launch requests, used by lti.middleware.LTINonceMiddleware.
+
+OAuth 1.0 makes each request unique by its consumer key, timestamp and
+nonce. A launch is accepted if its timestamp is within LTI_NONCE_TTL
+seconds of the server time and that (consumer key, timestamp, nonce) hasn't
+been used yet, so a store only needs to remember nonces for LTI_NONCE_TTL
+seconds after their timestamp.
+
+The store is set with LTI_NONCE_STORE:
+
+    lti.nonces.MemoryNonceStore
+        Nonces in memory, per process, bounded by LTI_NONCE_STORE_SIZE. Only
+        use this with a single process, since a launch replayed to another
+        worker isn't detected.
+
+    lti.nonces.CacheNonceStore
+        Nonces in the cache LTI_NONCE_CACHE (see CACHES), which should be
+        shared by the workers (e.g. memcached).
+'''
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.module_loading import import_by_path
+
+import hashlib
+import threading
+import time
+
+class NonceStore(object):
+    '''Base class of the nonce stores.'''
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def isFresh(self, timestamp, now):
+        '''Returns true if the timestamp is within the TTL of the current time.'''
+        return abs(now - timestamp) <= self.ttl
+
+    def useNonce(self, consumer_key, timestamp, nonce, now=None):
+        '''
+        Records a nonce, and returns true if the request may be accepted:
+        its timestamp is fresh, and the nonce wasn't used before.
+        '''
+        raise Exception("subclass responsibility")
+
+class MemoryNonceStore(NonceStore):
+    '''
+    Stores nonces in memory, in sets of nonces by time bucket: each bucket
+    holds the nonces of BUCKET_COUNT-th of the TTL of timestamps. A replayed
+    request has the same timestamp (it's signed), so a nonce is only looked
+    up in the bucket of its timestamp, and buckets are dropped as a whole
+    once all of their timestamps are stale.
+
+    When the store holds max_size nonces, the bucket of the oldest
+    timestamps is dropped early. Its timestamps are still accepted while
+    they are fresh, so that a full store never rejects genuine launches;
+    only signed launches are recorded (see LTINonceMiddleware), so this
+    takes more than max_size launches from known consumers within the TTL.
+    '''
+    BUCKET_COUNT = 10
+
+    def __init__(self, ttl, max_size=100000):
+        super(MemoryNonceStore, self).__init__(ttl)
+        self.max_size = max_size
+        self.bucket_width = max(ttl / float(self.BUCKET_COUNT), 1.0)
+        self.buckets = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def useNonce(self, consumer_key, timestamp, nonce, now=None):
+        if now is None:
+            now = time.time()
+        if not self.isFresh(timestamp, now):
+            return False
+        key = (consumer_key, timestamp, nonce)
+        bucket_number = int(timestamp // self.bucket_width)
+        with self.lock:
+            self.expire(now)
+            if key in self.buckets.get(bucket_number, ()):
+                return False
+            while self.size >= self.max_size:
+                self.evictOldest()
+            self.buckets.setdefault(bucket_number, set()).add(key)
+            self.size += 1
+        return True
+
+    def expire(self, now):
+        '''Drops the buckets whose timestamps are all stale.'''
+        stale = int((now - self.ttl) // self.bucket_width)
+        for bucket_number in [n for n in self.buckets if n < stale]:
+            self.size -= len(self.buckets.pop(bucket_number))
+
+    def evictOldest(self):
+        '''Drops the bucket of the oldest timestamps.'''
+        self.size -= len(self.buckets.pop(min(self.buckets)))
+
+class CacheNonceStore(NonceStore):
+    '''
+    Stores nonces in the cache framework, so that the workers of a
+    multi-process deployment share them. cache.add() is atomic in the
+    shared cache backends (memcached, database), so only one of two
+    concurrent requests with the same nonce is accepted.
+    '''
+    KEY_PREFIX = 'lti:nonce'
+
+    def __init__(self, ttl, cache_alias='default'):
+        super(CacheNonceStore, self).__init__(ttl)
+        self.cache = get_cache(cache_alias)
+
+    def useNonce(self, consumer_key, timestamp, nonce, now=None):
+        if now is None:
+            now = time.time()
+        if not self.isFresh(timestamp, now):
+            return False
+        key = "%s:%s" % (self.KEY_PREFIX, hashlib.sha1(repr((consumer_key, timestamp, nonce))).hexdigest())
+        timeout = int(timestamp + self.ttl - now) + 1
+        return self.cache.add(key, 1, timeout)
+
+def get_nonce_store():
+    '''Returns a new nonce store as configured in the settings.'''
+    store_class = import_by_path(getattr(settings, 'LTI_NONCE_STORE', 'lti.nonces.MemoryNonceStore'))
+    ttl = getattr(settings, 'LTI_NONCE_TTL', 600)
+    if issubclass(store_class, CacheNonceStore):
+        return store_class(ttl, getattr(settings, 'LTI_NONCE_CACHE', 'default'))
+    if issubclass(store_class, MemoryNonceStore):
+        return store_class(ttl, getattr(settings, 'LTI_NONCE_STORE_SIZE', 100000))
+    return store_class(ttl)
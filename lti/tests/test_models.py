@@ -0,0 +1,107 @@
+from StringIO import StringIO
+from django.core.cache import cache, get_cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from ..models import LTIConsumer, LTICourse
+
+class LTIConsumerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def launch(self, resource_link_id="link1"):
+        return {
+            "consumer_key": "key",
+            "resource_link_id": resource_link_id,
+            "context_id": "context",
+            "course_name_short": "HL101",
+            "course_name": "Harmony Lab 101",
+            "canvas_course_id": "42",
+        }
+
+    def test_setup_course(self):
+        self.assertIsNone(LTIConsumer.getCourseId("key", "link1"))
+        consumer = LTIConsumer.setupCourse(self.launch())
+        self.assertEqual({"name": "Harmony Lab 101", "name_short": "HL101"}, LTICourse.getCourseNames(consumer.course_id))
+        self.assertEqual({"name": "", "name_short": ""}, LTICourse.getCourseNames(consumer.course_id + 1))
+        self.assertTrue(LTIConsumer.hasCourse("key", "link1"))
+        self.assertFalse(LTIConsumer.hasCourse("key", "link2"))
+        self.assertEqual(consumer, LTIConsumer.getConsumer("key", "link1"))
+
+    def test_course_id_cached(self):
+        course_id = LTIConsumer.setupCourse(self.launch()).course_id
+        self.assertEqual(course_id, LTIConsumer.getCourseId("key", "link1"))
+        with self.assertNumQueries(0):
+            self.assertEqual(course_id, LTIConsumer.getCourseId("key", "link1"))
+        LTIConsumer.objects.filter(resource_link_id="link1").delete()
+        self.assertIsNone(LTIConsumer.getCourseId("key", "link1"))
+
+    def test_course_id_changed_by_other_process(self):
+        # two workers with their own clients of a shared cache
+        location = 'lti-test-%s' % id(self)
+        worker_cache, other_cache = [get_cache('django.core.cache.backends.locmem.LocMemCache', LOCATION=location) for i in range(2)]
+        self.addCleanup(worker_cache.clear)
+        consumer = LTIConsumer.setupCourse(self.launch())
+        with patch('lti.models.cache', worker_cache):
+            self.assertEqual(consumer.course_id, LTIConsumer.getCourseId("key", "link1"))
+        with patch('lti.models.cache', other_cache):
+            consumer.course = LTICourse.objects.create(course_name_short="b", course_name="B")
+            consumer.save()
+        with patch('lti.models.cache', worker_cache):
+            with self.assertNumQueries(1):
+                self.assertEqual(consumer.course.id, LTIConsumer.getCourseId("key", "link1"))
+        with patch('lti.models.cache', other_cache):
+            consumer.delete()
+        with patch('lti.models.cache', worker_cache):
+            self.assertIsNone(LTIConsumer.getCourseId("key", "link1"))
+
+    @override_settings(LTI_CONSUMER_CACHE_TIMEOUT=60)
+    def test_course_id_expires(self):
+        # a worker that doesn't share the cache sees a change made elsewhere
+        # (here without signals) once its entry expires
+        consumer = LTIConsumer.setupCourse(self.launch())
+        with patch('django.core.cache.backends.locmem.time.time', return_value=1000):
+            self.assertEqual(consumer.course_id, LTIConsumer.getCourseId("key", "link1"))
+        course = LTICourse.objects.create(course_name_short="b", course_name="B")
+        LTIConsumer.objects.filter(pk=consumer.pk).update(course=course)
+        with patch('django.core.cache.backends.locmem.time.time', return_value=1059):
+            self.assertEqual(consumer.course_id, LTIConsumer.getCourseId("key", "link1"))
+        with patch('django.core.cache.backends.locmem.time.time', return_value=1061):
+            self.assertEqual(course.id, LTIConsumer.getCourseId("key", "link1"))
+
+    def test_setup_course_once(self):
+        first = LTIConsumer.setupCourse(self.launch())
+        # a launch that looked the consumer up before the first one was set up
+        second = LTIConsumer.setupCourse(self.launch())
+        self.assertEqual(first, second)
+        self.assertEqual(1, LTIConsumer.objects.count())
+        self.assertEqual(1, LTICourse.objects.count())
+
+class MigrateLTIConsumersTest(TestCase):
+    def test_unique_index_exists(self):
+        out = StringIO()
+        call_command('migratelticonsumers', stdout=out)
+        self.assertIn("already exists", out.getvalue())
+
+    def test_migrate(self):
+        table = LTIConsumer._meta.db_table
+        cursor = connection.cursor()
+        # recreate the table as it was before the unique index
+        cursor.execute("ALTER TABLE %s RENAME TO old_consumers" % table)
+        cursor.execute("CREATE TABLE %s AS SELECT * FROM old_consumers WHERE 0" % table)
+        cursor.execute("DROP TABLE old_consumers")
+        course = LTICourse.objects.create(course_name_short="a", course_name="A")
+        for i, link in enumerate(["link1", "link1", "link2"]):
+            cursor.execute("INSERT INTO %s (id, consumer_key, resource_link_id, course_id) VALUES (%d, 'key', '%s', %d)" % (table, i + 1, link, course.id))
+
+        out = StringIO()
+        call_command('migratelticonsumers', stdout=out)
+        self.assertIn("Deleted 1 duplicate consumers", out.getvalue())
+        self.assertEqual([1, 3], sorted(LTIConsumer.objects.values_list('id', flat=True)))
+        out = StringIO()
+        call_command('migratelticonsumers', stdout=out)
+        self.assertIn("already exists", out.getvalue())
@@ -0,0 +1,110 @@
+import unittest
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.test import SimpleTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from ..nonces import MemoryNonceStore, CacheNonceStore, get_nonce_store
+from ..middleware import LTINonceMiddleware
+
+import oauth2
+import time
+
+class MemoryNonceStoreTest(unittest.TestCase):
+    def test_replay_rejected(self):
+        store = MemoryNonceStore(ttl=600)
+        self.assertTrue(store.useNonce("key", 1000, "abc", now=1000))
+        self.assertFalse(store.useNonce("key", 1000, "abc", now=1001))
+        self.assertTrue(store.useNonce("key", 1000, "abd", now=1001))
+        self.assertTrue(store.useNonce("key", 1001, "abc", now=1001))
+        self.assertTrue(store.useNonce("other", 1000, "abc", now=1001))
+
+    def test_stale_rejected(self):
+        store = MemoryNonceStore(ttl=600)
+        self.assertFalse(store.useNonce("key", 1000, "abc", now=1601))
+        self.assertFalse(store.useNonce("key", 2000, "abc", now=1000))
+        self.assertTrue(store.useNonce("key", 1000, "abc", now=1600))
+
+    def test_expired_nonces_dropped(self):
+        store = MemoryNonceStore(ttl=600)
+        for i in range(100):
+            store.useNonce("key", 1000 + i, "n%d" % i, now=1000 + i)
+        self.assertEqual(100, store.size)
+        store.useNonce("key", 2000, "last", now=2000)
+        self.assertEqual(1, store.size)
+
+    def test_bounded(self):
+        store = MemoryNonceStore(ttl=600, max_size=50)
+        for i in range(200):
+            self.assertTrue(store.useNonce("key", 1000 + 3 * i, "n%d" % i, now=1000 + 3 * i))
+            self.assertTrue(store.size <= 50)
+        # the most recent nonces are kept, and a full store accepts new launches
+        for i in range(190, 200):
+            self.assertFalse(store.useNonce("key", 1000 + 3 * i, "n%d" % i, now=1600))
+        self.assertTrue(store.useNonce("key", 1600, "new", now=1600))
+        # a storm of launches in one bucket keeps the store bounded too
+        for i in range(200):
+            store.useNonce("key", 1600, "s%d" % i, now=1600)
+            self.assertTrue(store.size <= 50)
+
+class CacheNonceStoreTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_replay_rejected(self):
+        now = time.time()
+        self.assertTrue(CacheNonceStore(ttl=600).useNonce("key", int(now), "abc"))
+        # another process has a store of its own, sharing the cache
+        self.assertFalse(CacheNonceStore(ttl=600).useNonce("key", int(now), "abc"))
+        self.assertTrue(CacheNonceStore(ttl=600).useNonce("key", int(now), "abd"))
+        self.assertFalse(CacheNonceStore(ttl=600).useNonce("key", int(now) - 601, "abe"))
+
+    def test_get_nonce_store(self):
+        with override_settings(LTI_NONCE_STORE='lti.nonces.CacheNonceStore', LTI_NONCE_TTL=60):
+            store = get_nonce_store()
+        self.assertIsInstance(store, CacheNonceStore)
+        self.assertEqual(60, store.ttl)
+
+@override_settings(LTI_OAUTH_CREDENTIALS={"key": "secret"})
+class LTINonceMiddlewareTest(SimpleTestCase):
+    URL = 'http://testserver/lti/launch'
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        with override_settings(LTI_NONCE_STORE='lti.nonces.MemoryNonceStore', LTI_NONCE_STORE_SIZE=100):
+            self.middleware = LTINonceMiddleware()
+
+    def launch(self, secret="secret", **params):
+        data = {"oauth_consumer_key": "key", "oauth_nonce": "abc", "oauth_timestamp": str(int(time.time())),
+            "oauth_version": "1.0", "lti_message_type": "basic-lti-launch-request", "resource_link_id": "link1"}
+        data.update(params)
+        oauth_request = oauth2.Request(method="POST", url=self.URL, parameters=data)
+        oauth_request.sign_request(oauth2.SignatureMethod_HMAC_SHA1(), oauth2.Consumer(data["oauth_consumer_key"], secret), None)
+        return self.factory.post('/lti/launch', dict(oauth_request))
+
+    def test_replay_rejected(self):
+        request = self.launch()
+        self.assertIsNone(self.middleware.process_request(request))
+        self.assertRaises(PermissionDenied, self.middleware.process_request, self.launch())
+        self.assertIsNone(self.middleware.process_request(self.launch(oauth_nonce="abd")))
+
+    def test_invalid_rejected(self):
+        self.assertRaises(PermissionDenied, self.middleware.process_request, self.launch(oauth_timestamp="x"))
+        self.assertRaises(PermissionDenied, self.middleware.process_request, self.launch(oauth_nonce=""))
+        self.assertRaises(PermissionDenied, self.middleware.process_request, self.launch(oauth_timestamp="1000"))
+
+    def test_forged_requests_not_recorded(self):
+        # unknown keys and bad signatures are left to LTIAuthMiddleware
+        for i in range(500):
+            self.assertIsNone(self.middleware.process_request(self.launch(oauth_consumer_key="forged%d" % i, oauth_nonce="f%d" % i)))
+            self.assertIsNone(self.middleware.process_request(self.launch(secret="guess", oauth_nonce="g%d" % i)))
+        self.assertEqual(0, self.middleware.store.size)
+        # including a forged request with the nonce of a genuine launch
+        self.assertIsNone(self.middleware.process_request(self.launch(secret="guess", oauth_nonce="abc")))
+        self.assertIsNone(self.middleware.process_request(self.launch()))
+
+    def test_other_requests_ignored(self):
+        self.assertIsNone(self.middleware.process_request(self.factory.get('/lti/launch')))
+        self.assertIsNone(self.middleware.process_request(self.factory.post('/lab/api/v1/exercises', {})))
@@ -6,6 +6,7 @@ from django.views.generic import View
 from ims_lti_py.tool_config import ToolConfig
 from braces.views import CsrfExemptMixin, LoginRequiredMixin
 
+from lab.metrics import LTI_LAUNCHES
 from .models import LTIConsumer, LTICourse
 
 def logout_view(request):
@@ -40,13 +41,14 @@ class LTILaunchView(CsrfExemptMixin, LoginRequiredMixin, View):
         # are the only required attributes specified by LTI. If none is found,
         # setup a new course instance associated with the tool consumer instance.
         identifiers = [launch[x] for x in ('consumer_key', 'resource_link_id')]
-        if LTIConsumer.hasCourse(*identifiers):
-            lti_consumer = LTIConsumer.getConsumer(*identifiers)
+        course_id = LTIConsumer.getCourseId(*identifiers)
+        if course_id is not None:
+            LTI_LAUNCHES.inc(course="existing")
         else:
-            lti_consumer = LTIConsumer.setupCourse(launch)
+            course_id = LTIConsumer.setupCourse(launch).course_id
+            LTI_LAUNCHES.inc(course="new")
         
         # Save the course ID in the session
-        course_id = lti_consumer.course.id
         request.session['course_id'] = course_id
         
         # Redirect back to the index.